@@ -1,22 +1,225 @@
 import os
 import json
+import hashlib
+import logging
+import threading
+import time
+
+CONFIGURATION_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIGURATION_FILE = 'configured_conveyors.json'
+HISTORY_DIR = 'history'
+HISTORY_INDEX_FILE = 'versions.json'
+HISTORY_LENGTH = 10
+
+
+def configuration_hash(data: dict):
+    """ The sha256 of a configuration, independent of the order of its keys."""
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def atomic_write_json(path: str, data):
+    """
+    Writes data as json to a temporary file next to path and renames it over path.
+    A crash during the write leaves the previous file untouched.
+    """
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'w') as json_file:
+        json.dump(data, json_file, indent=4)
+        json_file.flush()
+        os.fsync(json_file.fileno())
+    os.replace(temporary_path, path)
+
+
+class ConfigurationStore:
+    """
+    ConfigurationStore keeps the conveyor configuration in memory and on disk.
+    Every new configuration gets a version number and a hash, is written atomically to configured_conveyors.json
+    and a copy is kept in the history folder, so the last HISTORY_LENGTH versions can be rolled back to.
+    The parsed configuration is handed back to the caller, so it never has to be read back from disk.
+    Attributes:
+        directory: A string, the folder of configured_conveyors.json.
+        history_length: An int, number of versions kept in the history.
+        current: A dictionary, the configuration in use.
+        version: An int, the version of the configuration in use, 0 if it was never versioned.
+        hash: A string, the hash of the configuration in use.
+        history: A list of {"version", "hash", "time", "previous"} of the kept versions, oldest first,
+            previous being the version in use when the version was stored.
+    Methods:
+        load: Reads the configuration in use from disk.
+        store: Parses, versions and writes a new configuration.
+        rollback: Goes back to a previous version of the configuration.
+        previous_version: The version in use before a version was stored.
+        info: The version and hash of the configuration in use.
+    """
+
+    def __init__(self, directory=CONFIGURATION_DIR, history_length=HISTORY_LENGTH):
+        self.directory = directory
+        self.history_length = history_length
+        self.current = None
+        self.version = 0
+        self.hash = None
+        self.history = []
+        self.__lock = threading.Lock()
+
+    def configuration_path(self):
+        return os.path.join(self.directory, CONFIGURATION_FILE)
+
+    def history_path(self, version=None):
+        if version is None:
+            return os.path.join(self.directory, HISTORY_DIR, HISTORY_INDEX_FILE)
+        return os.path.join(self.directory, HISTORY_DIR, f"configured_conveyors.v{version}.json")
+
+    def load(self):
+        """ Reads the configuration in use and the history index from disk, once, and keeps them in memory."""
+        with self.__lock:
+            if self.current is not None:
+                return self.current
+            with open(self.configuration_path()) as json_file:
+                self.current = json.load(json_file)
+            self.hash = configuration_hash(self.current)
+            try:
+                with open(self.history_path()) as json_file:
+                    self.history = json.load(json_file)
+            except (IOError, json.JSONDecodeError):
+                self.history = []
+            for entry in reversed(self.history):
+                if entry["hash"] == self.hash:
+                    self.version = entry["version"]
+                    break
+            return self.current
+
+    def store(self, payload: str):
+        """
+        Parses a new configuration, gives it the next version and writes it to disk.
+
+        Parameters
+        ----------
+        payload : str
+            The configuration as received on the restart topic
+
+        Returns
+        ----------
+        dict
+            The parsed configuration, None if the payload could not be parsed or written
+        """
+        try:
+            data = json.loads(payload)
+        except json.JSONDecodeError as e:
+            print(f"Failed to decode JSON payload: {e}")
+            return None
+        self.load()
+
+        with self.__lock:
+            data_hash = configuration_hash(data)
+            if data_hash == self.hash:
+                print(f"Configuration unchanged, staying on version {self.version}")
+                return self.current
+
+            version = max([entry["version"] for entry in self.history] + [self.version])
+            previous_version = self.version
+            history = list(self.history)
+            try:
+                os.makedirs(os.path.join(self.directory, HISTORY_DIR), exist_ok=True)
+                if self.version not in [entry["version"] for entry in history]:
+                    # Keep the configuration in use before the first push, so it can be rolled back to
+                    version += 1
+                    previous_version = version
+                    history.append({"version": version, "hash": self.hash, "time": time.time(), "previous": None})
+                    atomic_write_json(self.history_path(version), self.current)
+                version += 1
+                history.append({"version": version, "hash": data_hash, "time": time.time(),
+                                "previous": previous_version})
+                atomic_write_json(self.history_path(version), data)
+                atomic_write_json(self.configuration_path(), data)
+                history = self.prune_history(history)
+                atomic_write_json(self.history_path(), history)
+            except IOError as e:
+                print(f"Failed to write to file: {e}")
+                return None
+
+            self.current = data
+            self.version = version
+            self.hash = data_hash
+            self.history = history
+            print(f"Successfully wrote configuration version {version} to {self.configuration_path()}")
+            return data
+
+    def rollback(self, steps=1):
+        """
+        Goes back steps versions from the configuration in use and writes it back as the configuration in use.
+        steps must be at least 1, the configuration in use is never rolled forward.
+        Each step goes to the version that was in use when the version was stored, so a version abandoned by
+        an earlier rollback is never restored.
+
+        Returns
+        ----------
+        dict
+            The configuration rolled back to, None if there is no such version in the history
+        """
+        if steps < 1:
+            logging.error(f"Cannot roll back {steps} version(s), at least 1 is needed")
+            return None
+        self.load()
+        with self.__lock:
+            entries = {entry["version"]: entry for entry in self.history}
+            if self.version not in entries:
+                logging.error(f"Configuration version {self.version} is not in the history, cannot roll back")
+                return None
+            version = self.version
+            for _ in range(steps):
+                version = self.previous_version(version)
+                if version not in entries:
+                    logging.error(f"No configuration {steps} version(s) before version {self.version}")
+                    return None
+
+            entry = entries[version]
+            try:
+                with open(self.history_path(entry["version"])) as json_file:
+                    data = json.load(json_file)
+                atomic_write_json(self.configuration_path(), data)
+            except (IOError, json.JSONDecodeError) as e:
+                logging.error(f"Failed to roll back to configuration version {entry['version']}: {e}")
+                return None
+
+            self.current = data
+            self.version = entry["version"]
+            self.hash = entry["hash"]
+            print(f"Rolled back to configuration version {self.version}")
+            return data
+
+    def previous_version(self, version: int):
+        """
+        The version in use when version was stored, None if there was none.
+        A history written before the previous version was recorded goes back in the order of the history.
+        """
+        versions = [entry["version"] for entry in self.history]
+        position = versions.index(version)
+        if "previous" in self.history[position]:
+            return self.history[position]["previous"]
+        return versions[position - 1] if position > 0 else None
+
+    def prune_history(self, history: list):
+        """ Drops the oldest versions past history_length and deletes their files."""
+        while len(history) > self.history_length:
+            dropped = history.pop(0)
+            try:
+                os.remove(self.history_path(dropped["version"]))
+            except OSError:
+                pass
+        return history
+
+    def info(self):
+        """ The version and hash of the configuration in use."""
+        return {"version": self.version, "hash": self.hash}
+
+
+configuration_store = ConfigurationStore()
 
 
 def write_to_json(payload: str):
+    """
+    Write the payload to the JSON file, atomically and as a new version of the configuration.
+    Returns the parsed configuration, None if it could not be parsed or written.
+    """
     print(f"Payload: {payload}")
-    """Write the payload to the JSON file."""
-    try:
-        data = json.loads(payload)
-    except json.JSONDecodeError as e:
-        print(f"Failed to decode JSON payload: {e}")
-        return
-
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    conveyor_configuration_path = os.path.join(script_dir, 'configured_conveyors.json')
-
-    try:
-        with open(conveyor_configuration_path, 'w') as json_file:
-            json.dump(data, json_file, indent=4)
-        print(f"Successfully wrote configuration to {conveyor_configuration_path}")
-    except IOError as e:
-        print(f"Failed to write to file: {e}")
\ No newline at end of file
+    return configuration_store.store(payload)
@@ -1,24 +1,47 @@
+import time
+
+STARTUP_TIME = time.perf_counter()
+
 import logging
+import os
 import threading
-import time
 
 from machinelogic import Machine
 
-from configurations.restart_control import write_to_json
+from configurations.restart_control import write_to_json, configuration_store
+from conveyor_types.base import ConveyorState
 from conveyor_types.conveyors import ControlAllConveyor
 from conveyor_types.definitions.ipc_mqtt_definitions import mqtt_topics
 from conveyor_types.system import SystemState
-from helpers.conveyor_configuration import get_conveyor_config, configure_conveyors, fake_box
+from helpers.conveyor_configuration import configure_conveyors, fake_box
 from helpers.thread_helpers import InterThreadBool
+from helpers.robot_handshake import RobotHandshake
+from helpers.robot_cells import RobotCells
+from helpers.box_tracking import BoxTracker
+from helpers.sensor_filter import SensorFilterBank
+from helpers.input_snapshot import InputSnapshot
+from helpers.command_dispatcher import CommandDispatcher
+from helpers.state_watchdog import StateWatchdog
+from helpers.startup_profiler import StartupProfiler
+from helpers.state_store import StateStore
+from helpers.metrics import LineMetrics, METRICS_PORT_ENV
+from helpers.trace_recorder import TraceRecorder, TRACE_PATH_ENV
+from helpers.bottleneck import BottleneckDetector
+from helpers.estop_fast_path import EstopFastPath
 
 # Setup logging
 logging.basicConfig(level=logging.ERROR,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
-machine = Machine()
-system = SystemState(machine)
+startup_profiler = StartupProfiler(STARTUP_TIME)
+startup_profiler.phases.append(("imports", time.perf_counter() - STARTUP_TIME))
 
-configuration_data = get_conveyor_config()
+machine = None
+system = None
+robot_handshake = None
+robot_cells = None
+conveyors_list = None
+metrics = None
 robot_is_picking = InterThreadBool()
 program_run = InterThreadBool()
 END_PROGRAM = False
@@ -48,30 +71,79 @@ def stop_conveyor_thread():
         logging.info("Conveyor thread stopped")
 
 
-def on_restart_command(topic: str, message: str):
-    print(f"Received restart command on topic {topic} with message {message}")
-
+def restart_with_configuration(new_configuration_data: dict):
+    restart_start = time.perf_counter()
     stop_conveyor_thread()
     logging.info("Conveyors stopped")
     time.sleep(1)
     logging.info("Restarting with new configuration")
 
-    # Write new configuration
-    write_to_json(message)
-    new_configuration_data = get_conveyor_config()
-    new_conveyors = configure_conveyors(new_configuration_data, system, robot_is_picking)
+    new_conveyors = configure_conveyors(new_configuration_data, system, robot_is_picking, robot_handshake,
+                                        robot_cells=robot_cells)
     conveyors_list.update_conveyors(new_conveyors)
+    system.publish_config_version(configuration_store.info())
 
     # Start a new conveyor thread
     start_conveyor_thread()
+    metrics.observe_restart(time.perf_counter() - restart_start)
+
+
+def on_restart_command(topic: str, message: str):
+    print(f"Received restart command on topic {topic} with message {message}")
+
+    # Write new configuration, the conveyors keep running on the current one if it is rejected
+    new_configuration_data = write_to_json(message)
+    if new_configuration_data is None:
+        logging.error("New configuration rejected, keeping the current configuration")
+        return
+    restart_with_configuration(new_configuration_data)
+
+
+def on_rollback_command(topic: str, message: str):
+    print(f"Received rollback command on topic {topic} with message {message}")
+
+    try:
+        steps = int(message) if message and message.strip() else 1
+    except ValueError:
+        logging.error(f"Rollback rejected, {message} is not a number of versions")
+        return
+    if steps < 1:
+        logging.error(f"Rollback rejected, it goes back at least 1 version, not {steps}")
+        return
+    new_configuration_data = configuration_store.rollback(steps)
+    if new_configuration_data is None:
+        return
+    restart_with_configuration(new_configuration_data)
+
+
+def on_fault_reset_command(topic: str, message: str):
+    print(f"Received fault reset command on topic {topic} with message {message}")
+
+    try:
+        index = int(message) if message and message.strip() else None
+    except ValueError:
+        logging.error(f"Fault reset rejected, {message} is not a conveyor index")
+        return
+    if conveyors_list is None:
+        return
+    reset = conveyors_list.reset_faults(index)
+    if not reset:
+        logging.error(f"Fault reset ignored, no latched fault on {'any conveyor' if index is None else index}")
 
 
 def conveyor_loop():
     prev_time = time.perf_counter()
     while not thread_stop_flag.is_set():
         if control_flag.get() and program_run.get() and system.program_run:
+            tick_start = time.perf_counter()
             conveyors_list.run_all()
+            metrics.observe_tick(time.perf_counter() - tick_start)
             logging.info('running')
+            if startup_profiler.first_running is None and any(
+                    conveyor.conveyor_state == ConveyorState.RUNNING for conveyor in conveyors_list.list_of_conveyors):
+                startup_profiler.mark_first_running()
+                print(f"Startup report: {startup_profiler.report()}")
+                system.publish_startup_report(startup_profiler.report())
         elif not system.program_run:
             conveyors_list.stop_all()
             logging.info('stopped')
@@ -82,27 +154,62 @@ def conveyor_loop():
         prev_time = time.perf_counter()
 
 
-# Register MQTT event
-logging.info("Registering MQTT event for topic 'conveyors/configured'")
-machine.on_mqtt_event(mqtt_topics['restart'], on_restart_command)
-system.subscribe_to_control_topics()
-
-# Configure conveyors and start controlling them
-conveyors = configure_conveyors(configuration_data, system, robot_is_picking)
-conveyors_list = ControlAllConveyor(conveyors)
+def main():
+    global machine, system, robot_handshake, robot_cells, conveyors_list, metrics
+
+    with startup_profiler.phase("machine"):
+        machine = Machine()
+        system = SystemState(machine)
+        robot_handshake = RobotHandshake(machine)
+        robot_cells = RobotCells(machine, robot_is_picking, robot_handshake)
+        state_store = StateStore(system)
+        estop_fast_path = EstopFastPath(system)
+        metrics = LineMetrics(system)
+        trace_recorder = TraceRecorder(os.environ[TRACE_PATH_ENV]) if os.environ.get(TRACE_PATH_ENV) else None
+
+    with startup_profiler.phase("configuration"):
+        configuration_data = configuration_store.load()
+
+    # Register MQTT event
+    with startup_profiler.phase("subscriptions"):
+        logging.info("Registering MQTT event for topic 'conveyors/configured'")
+        machine.on_mqtt_event(mqtt_topics['restart'], on_restart_command)
+        machine.on_mqtt_event(mqtt_topics['rollback'], on_rollback_command)
+        machine.on_mqtt_event(mqtt_topics['faultReset'], on_fault_reset_command)
+        system.subscribe_to_control_topics()
+        robot_handshake.subscribe()
+        robot_cells.subscribe()
+        state_store.subscribe()
+
+    # Configure conveyors and start controlling them
+    with startup_profiler.phase("conveyors"):
+        conveyors = configure_conveyors(configuration_data, system, robot_is_picking, robot_handshake,
+                                        robot_cells=robot_cells)
+    with startup_profiler.phase("helpers"):
+        conveyors_list = ControlAllConveyor(conveyors, BoxTracker(system), SensorFilterBank(system), InputSnapshot(),
+                                           CommandDispatcher(), StateWatchdog(system), state_store, metrics,
+                                           trace_recorder, BottleneckDetector(system), estop_fast_path)
+    system.publish_config_version(configuration_store.info())
+    system.publish_startup_report(startup_profiler.report())
+    if os.environ.get(METRICS_PORT_ENV):
+        metrics.serve(int(os.environ[METRICS_PORT_ENV]))
+
+    # fake_box(system)
+
+    # Start the conveyor loop in a separate thread
+    start_conveyor_thread()
 
-# fake_box(system)
+    # try:
+    while True:
+        time.sleep(10)
+    # except KeyboardInterrupt:
+    #     logging.info("Keyboard Interrupt received, stopping conveyors...")
+    #     END_PROGRAM = True
+    # finally:
+    #     stop_conveyor_thread()
+    #     conveyors_list.stop_all()
+    #     logging.info("Conveyors have been stopped. Program terminated.")
 
-# Start the conveyor loop in a separate thread
-start_conveyor_thread()
 
-# try:
-while True:
-    time.sleep(10)
-# except KeyboardInterrupt:
-#     logging.info("Keyboard Interrupt received, stopping conveyors...")
-#     END_PROGRAM = True
-# finally:
-#     stop_conveyor_thread()
-#     conveyors_list.stop_all()
-#     logging.info("Conveyors have been stopped. Program terminated.")
+if __name__ == '__main__':
+    main()
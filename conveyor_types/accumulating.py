@@ -1,14 +1,21 @@
 
-from conveyor_types.base import Conveyor, ConveyorState
+from conveyor_types.base import Conveyor, ConveyorState, PNEUMATIC_STATE_TIMEOUTS
 from conveyor_types.system import SystemState
 from helpers.thread_helpers import InterThreadBool
 from helpers.timer_helper import Timer
+from helpers.robot_handshake import RobotHandshake
 from conveyor_types.definitions.conveyor_definitions import RESTART_TIME, ACCUMULATION_TIME
 from conveyor_types.definitions.ipc_mqtt_definitions import mqtt_messages
 
 
 class AccumulatingConveyor(Conveyor):
-    def __init__(self, system_state: SystemState, robot_is_picking: InterThreadBool, index, **kwargs):
+    __slots__ = ('box_was_picked', 'is_first_box_ready_for_pick', 'accumulationConveyorTimer', 'robot_is_picking')
+
+    DEFAULT_STATE_TIMEOUTS = PNEUMATIC_STATE_TIMEOUTS
+    RETRACT_OVERLAP_SUPPORTED = True
+
+    def __init__(self, system_state: SystemState, robot_is_picking: InterThreadBool, index,
+                 robot_handshake: RobotHandshake = None, **kwargs):
         super().__init__(system_state, index, **kwargs)
 
         self.initialize_pusher(kwargs)
@@ -20,8 +27,11 @@ class AccumulatingConveyor(Conveyor):
         self.is_first_box_ready_for_pick = False
         self.restart_conveyor_timer = Timer(kwargs.get(RESTART_TIME))
         self.accumulationConveyorTimer = Timer(kwargs.get(ACCUMULATION_TIME))
+        self.initialize_pick_cycle_tuner(kwargs, self.accumulationConveyorTimer)
+        self.initialize_speed_profile(kwargs)
 
         self.robot_is_picking = robot_is_picking
+        self.initialize_robot_handshake(robot_handshake, kwargs)
 
     def run(self):
         self.system_state.publish_conv_state(self.index, self.conveyor_state.name)
@@ -29,6 +39,7 @@ class AccumulatingConveyor(Conveyor):
             self.conveyor_state = ConveyorState.INIT
             if self.pusher_present:
                 self.pusher.pull_async()
+        self.finish_retract()
 
         if self.conveyor_state == ConveyorState.INIT:
             self.is_first_box_ready_for_pick = False
@@ -39,6 +50,7 @@ class AccumulatingConveyor(Conveyor):
                 self.conveyor_state = ConveyorState.RUNNING
 
         if self.conveyor_state == ConveyorState.RUNNING:
+            self.update_speed_profile()
             if self.get_box_sensor_state() and self.get_accumulation_sensor_state():
                 if self.accumulationConveyorTimer.paused:
                     self.accumulationConveyorTimer.unpause()
@@ -65,8 +77,8 @@ class AccumulatingConveyor(Conveyor):
         elif self.conveyor_state == ConveyorState.RETRACT:
             self.pusher.pull_async()
             self.is_first_box_ready_for_pick = True
-            if self.pusher_state("pulled"):
-                self.pusher.idle_async()
+            if self.pusher_clear():
+                self.release_pusher()
                 self.move_conveyor()
                 self.conveyor_state = ConveyorState.RUNNING
 
@@ -82,18 +94,26 @@ class AccumulatingConveyor(Conveyor):
             self.is_first_box_ready_for_pick = False
             if not self.get_box_sensor_state():
                 self.box_was_picked = True
-            if self.box_was_picked and not self.robot_is_picking.get() and not self.restart_conveyor_timer.started:
-                self.restart_conveyor_timer.start()
-            if self.restart_conveyor_timer.done():
+            if self.box_was_picked and self.robot_handshake_allows_restart():
                 self.restart_conveyor_timer.stop()
                 self.move_conveyor()
                 self.conveyor_state = ConveyorState.RUNNING
-
-        if self.robot_is_picking.get():
+            else:
+                if self.box_was_picked and not self.robot_is_picking.get() and not self.restart_conveyor_timer.started:
+                    self.restart_conveyor_timer.start()
+                if self.restart_conveyor_timer.done():
+                    self.restart_conveyor_timer.stop()
+                    self.mark_robot_handshake_used()
+                    self.move_conveyor()
+                    self.conveyor_state = ConveyorState.RUNNING
+
+        if self.robot_pick_pending(self.robot_is_picking.get()):
             if self.conveyor_state == ConveyorState.RUNNING and self.is_first_box_ready_for_pick:
                 self.stop_conveyor()
                 self.conveyor_state = ConveyorState.STOPPING
 
+        self.update_pick_cycle_tuner(self.robot_is_picking.get())
+
     def stop(self):
         self.system_state.publish_conv_state(self.index, self.conveyor_state.name)
         self.conveyor_state = ConveyorState.INIT
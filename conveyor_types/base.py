@@ -3,8 +3,14 @@ from machinelogic import MachineException
 from conveyor_types.system import SystemState
 from conveyor_types.definitions.conveyor_definitions import *
 from conveyor_types.definitions.ipc_mqtt_definitions import mqtt_topics, mqtt_messages, format_message
+from helpers.pick_cycle_tuner import PickCycleTuner, DEFAULT_MINIMUM_FRACTION
+from helpers.pneumatic_model import PneumaticModel, UNKNOWN, PUSHED, PULLED, DEFAULT_RETRACT_CLEARANCE
+from helpers.speed_profile import SpeedProfile, DemandSpeed
+from helpers.sensor_filter import FilteredSensor
+from collections import deque
 from enum import Enum
 import logging
+import time
 
 logging.basicConfig(level=logging.ERROR,
                     format='%(asctime)s - %(levelname)s - %(message)s')
@@ -27,10 +33,40 @@ class ConveyorState(Enum):
     WAITING = 9
 
 
+# Maximum time in seconds a conveyor waits on its pusher before the watchdog steps in,
+# INIT waits on the pusher to be pulled back. Only used when the stroke time of the pusher is not known
+PNEUMATIC_STATE_TIMEOUTS = {
+    ConveyorState.INIT: 5.0,
+    ConveyorState.PUSHING: 5.0,
+    ConveyorState.RETRACT: 5.0,
+}
+# Direction of the pusher stroke each pneumatic state waits on
+PUSHER_STATE_DIRECTIONS = {
+    ConveyorState.INIT: PULLED,
+    ConveyorState.PUSHING: PUSHED,
+    ConveyorState.RETRACT: PULLED,
+}
+# A state waiting on the pusher times out after this many stroke times, and never before the floor in seconds
+STROKE_TIMEOUT_FACTOR = 3.0
+STROKE_TIMEOUT_FLOOR = 2.0
+DEFAULT_WATCHDOG_RETRIES = 2
+# A conveyor brought back to a safe state this many times within the window latches its fault,
+# it stays stopped until an operator resets it
+DEFAULT_RECOVERY_LIMIT = 3
+RECOVERY_WINDOW = 600.0
+# Fraction of the maximum speed a demand driven belt slows down to when minimumSpeed is not configured
+DEFAULT_MINIMUM_SPEED_FRACTION = 0.25
+# A conveyor with this many failed or hung commands within the window is brought back to a safe state
+COMMAND_FAILURE_LIMIT = 3
+COMMAND_FAILURE_WINDOW = 10.0
+
+
 class Conveyor(ABC):
     """ Base class for all conveyors.
     It is an abstract class that is used to define the methods that all conveyors should have.
     It also has some helper methods that are used by all conveyors.
+    The attributes are stored in __slots__ to keep large lines compact, a subclass
+    lists the attributes it adds in its own __slots__.
     Attributes:
         system_state: A SystemState object that is used to keep track of the state of the system.
         conveyor_state: A ConveyorState object used to keep track of the state of the conveyor.
@@ -51,6 +87,11 @@ class Conveyor(ABC):
         pusher_extend_delay: A float used to keep track of the delay for extending the pusher.
         pusher_retract_delay: A float used to keep track of the delay for retracting the pusher.
         pusher_sensor_present: A boolean used to track of whether the pusher sensor is present.
+        retract_overlap: A boolean, True to restart once the retracting pusher is clear instead of pulled,
+            only on the conveyor types with RETRACT_OVERLAP_SUPPORTED.
+        retract_clearance: A float, fraction of the retract stroke after which the pusher is clear.
+        retract_clearance_sensor: A machine object, input on once the pusher is clear, None to use the stroke time.
+        retract_finishing: A boolean, True while a pusher left the retract state before it was pulled.
         stopper_present: A boolean used to keep track of whether the stopper is present or not.
         stopper: A machine object that is used to control the stopper.
         stopper_extend_logic: A string used to keep track of the logic for extending the stopper.
@@ -59,6 +100,27 @@ class Conveyor(ABC):
         stopper_extend_delay: A float used to keep track of the delay for extending the stopper.
         stopper_retract_delay: A float used to keep track of the delay for retracting the stopper.
         stopper_sensor_present: A boolean used to track of whether the stopper sensor is present.
+        pick_cycle_tuner: A PickCycleTuner used to tune the restart timers, None when auto tuning is off.
+        robot_handshake: A RobotHandshake used to restart before the restart timer, None if not used.
+        robot_handshake_cycle: An int, the last handshake pick cycle used to restart the conveyor.
+        handshake_lead_time: A float, time in seconds the next box needs to reach the pick point.
+        belt_length: A float, length travelled by a box on the conveyor, None if unknown.
+        belt_speed: A float, speed of the belt in the same unit per second, None if unknown.
+        speed_profile: A SpeedProfile used to slow the belt down before the stop point, None if not used.
+        demand_speed: A DemandSpeed used to follow the downstream demand, None if not used.
+        commanded_speed: A float, the last speed setpoint sent by set_conveyor_speed, None when stopped.
+        sensor_filters: A dictionary of FilteredSensor by sensor role, updated by ControlAllConveyor.
+        input_snapshot: The InputSnapshot of the current tick, set by ControlAllConveyor, None for live reads.
+        command_failures: An int, number of actuator or pneumatic commands that failed.
+        last_failed_command: The last Command that failed, None if none did.
+        command_failure_times: A deque of the times of the last failed or hung commands.
+        state_timeouts: A dictionary of the maximum dwell time in seconds by ConveyorState, used by the watchdog.
+        stroke_timeouts: A dictionary of the pusher direction by ConveyorState, for the states whose timeout
+            follows the stroke time of the pusher instead of state_timeouts.
+        watchdog_retries: An int, number of pneumatic retries before the watchdog recovers the conveyor.
+        recovery_limit: An int, number of recoveries within RECOVERY_WINDOW seconds before the fault latches.
+        recovery_times: A deque of the times of the last recoveries to a safe state.
+        fault_latched: A boolean, True once the fault latched, the conveyor does not run until it is reset.
     Methods:
         run: An abstract method to define the behavior of the conveyor when it is running.
         stop: An abstract method used to define the behavior of the conveyor when it is stopped.
@@ -68,16 +130,62 @@ class Conveyor(ABC):
         get_box_sensor_state: A method that is used to get the state of the box sensor.
         initialize_accumulation_sensor: A method that is used to initialize the accumulation sensor.
         get_accumulation_sensor_state: A method to get the state of the accumulation sensor.
+        initialize_sensor_filter: A method that is used to initialize the filter of a sensor.
+        get_stopper_sensor_state: A method to get the state of the stopper sensor.
+        read_input: A method that reads an input from the snapshot of the current tick.
+        inputs: A method that returns the inputs read by the conveyor.
+        use_command_dispatcher: A method that routes the commands of the conveyor through a dispatcher.
+        on_command_failed: A method called when a command issued by the conveyor failed.
+        initialize_watchdog: A method that is used to initialize the state timeouts of the watchdog.
+        retry_stuck_state: A method that retries the pneumatic of a state that timed out.
+        watchdog_timeout: A method that returns the maximum dwell time of the current state.
+        recover_to_safe_state: A method that brings the conveyor back to a safe state.
+        latch_fault: A method that latches the fault of a conveyor that keeps failing after its recoveries.
+        reset_fault: A method that clears a latched fault on request of an operator.
         initialize_pusher: A method that is used to initialize the pusher.
         pusher_state: A method that is used to get the state of the pusher.
+        pusher_clear: A method that tells if the retracting pusher is out of the way of the boxes.
+        release_pusher: A method that idles the pusher at the end of the retract, or lets it finish the stroke.
+        finish_retract: A method that keeps pulling an overlapped pusher and idles it once it is pulled.
         initialize_stopper: A method that is used to initialize the stopper.
         stopper_state: A method that is used to get the state of the stopper.
+        initialize_pick_cycle_tuner: A method that is used to initialize the pick cycle tuner.
+        update_pick_cycle_tuner: A method that feeds the pick cycle tuner and publishes its report.
+        initialize_robot_handshake: A method that is used to initialize the robot handshake.
+        robot_pick_pending: A method that tells if the robot is picking, from the boolean or the handshake.
+        robot_handshake_allows_restart: A method that tells if the handshake allows to restart now.
+        mark_robot_handshake_used: A method that marks the current handshake pick cycle as used.
+        transit_time: A method that returns the time for a box to cross the conveyor.
+        initialize_speed_profile: A method that is used to initialize the speed profile.
+        update_speed_profile: A method that slows the belt down when the box nears the stop point.
+        initialize_demand_speed: A method that is used to initialize the demand driven speed.
+        buffer_fill: A method that returns how full the conveyor is, used by the conveyors feeding it.
+        set_conveyor_speed: A method that moves the conveyor at a speed, only sending changes.
         move_conveyor: A method that is used to move the conveyor.
         stop_conveyor: A method that is used to stop the conveyor.
         set_conveyor_state_to_init: A method that is used to set the conveyor state to INIT.
         get_status: A method that is used to get the status of the conveyor.
     """
 
+    __slots__ = (
+        'accumulation_sensor_present', 'sensor_topic', 'pull_sensor', 'push_sensor', 'actuator',
+        'actuator_name', 'index', 'system_state', 'conveyor_state', 'actuator_speed', 'actuator_acceleration',
+        'actuator_deceleration', 'reverse_box_logic', 'box_sensor', 'reverse_accumulation_logic',
+        'accumulation_sensor', 'pusher_present', 'pusher', 'pusher_extend_logic', 'pusher_retract_logic',
+        'pusher_extend_delay', 'pusher_retract_delay', 'pusher_sensor_present', 'stopper_present', 'stopper',
+        'stopper_extend_logic', 'stopper_retract_logic', 'stopper_extend_delay', 'stopper_retract_delay',
+        'stopper_sensor_present', 'restart_conveyor_timer', 'stopper_sensor', 'actuator_is_vfd',
+        'stopper_config', 'pick_cycle_tuner', 'robot_handshake', 'robot_handshake_cycle', 'handshake_lead_time',
+        'belt_length', 'belt_speed', 'speed_profile', 'demand_speed', 'commanded_speed', 'sensor_filters',
+        'input_snapshot', 'command_failures', 'last_failed_command', 'command_failure_times', 'state_timeouts',
+        'stroke_timeouts', 'watchdog_retries', 'recovery_limit', 'recovery_times', 'fault_latched',
+        'retract_overlap', 'retract_clearance', 'retract_clearance_sensor', 'retract_finishing',
+    )
+
+    DEFAULT_STATE_TIMEOUTS = {}
+    # True for the conveyor types whose belt restarts at the end of the retract, the others wait for the pick
+    RETRACT_OVERLAP_SUPPORTED = False
+
     def __init__(self, system_state: SystemState, index, **kwargs):
         """ Constructor for the Conveyor class. It initializes the system_state
         and sets the conveyor_state to INIT.
@@ -105,6 +213,10 @@ class Conveyor(ABC):
         self.pusher_extend_delay = 0
         self.pusher_retract_delay = 0
         self.pusher_sensor_present = False
+        self.retract_overlap = False
+        self.retract_clearance = DEFAULT_RETRACT_CLEARANCE
+        self.retract_clearance_sensor = None
+        self.retract_finishing = False
         self.stopper_present = False
         self.stopper = None
         self.stopper_extend_logic = None
@@ -116,7 +228,30 @@ class Conveyor(ABC):
         self.stopper_sensor = None
         self.actuator_is_vfd = False
         self.stopper_config = {}
+        self.pick_cycle_tuner = None
+        self.robot_handshake = None
+        self.robot_handshake_cycle = 0
+        self.handshake_lead_time = 0.0
+        self.belt_length = kwargs.get(BELT_LENGTH)
+        self.belt_speed = kwargs.get(BELT_SPEED)
+        self.speed_profile = None
+        self.demand_speed = None
+        self.commanded_speed = None
+        self.sensor_filters = {}
+        self.input_snapshot = None
+        self.command_failures = 0
+        self.last_failed_command = None
+        self.command_failure_times = deque(maxlen=COMMAND_FAILURE_LIMIT)
+        self.state_timeouts = {}
+        self.stroke_timeouts = {}
+        self.watchdog_retries = DEFAULT_WATCHDOG_RETRIES
+        self.recovery_limit = DEFAULT_RECOVERY_LIMIT
+        self.fault_latched = False
+        self.initialize_watchdog(kwargs)
+        self.recovery_times = deque(maxlen=self.recovery_limit)
         self.initialize_actuator(kwargs)
+        if self.belt_speed is None and not self.actuator_is_vfd:
+            self.belt_speed = self.actuator_speed
 
     def initialize_actuator(self, kwargs):
         """
@@ -180,6 +315,8 @@ class Conveyor(ABC):
                 self.sensor_topic = format_message(mqtt_topics['sensor'],
                                                    device=self.box_sensor.configuration.device,
                                                    port=self.box_sensor.configuration.port)
+                self.initialize_sensor_filter('box', self.box_sensor, self.reverse_box_logic,
+                                              sensor_config.get(SENSOR_FILTER_CONFIG))
             else:
                 self.box_sensor = None
         except MachineException as e:
@@ -193,7 +330,9 @@ class Conveyor(ABC):
         is set to False. If the reverse_box_logic is set to True, it returns
         the opposite of the state of the box sensor.
         """
-        state = self.box_sensor.state.value
+        if 'box' in self.sensor_filters:
+            return self.sensor_filters['box'].state
+        state = self.read_input(self.box_sensor)
         if self.reverse_box_logic:
             return not state
         else:
@@ -218,6 +357,9 @@ class Conveyor(ABC):
                 if sensor:
                     self.reverse_accumulation_logic = kwargs.get(REVERSE_ACCUMULATION_LOGIC)
                     self.accumulation_sensor = self.system_state.machine.get_input(sensor)
+                    self.initialize_sensor_filter('accumulation', self.accumulation_sensor,
+                                                  self.reverse_accumulation_logic,
+                                                  kwargs.get(ACCUMULATION_SENSOR_FILTER_CONFIG))
                 else:
                     self.accumulation_sensor = None
             except MachineException as e:
@@ -231,7 +373,9 @@ class Conveyor(ABC):
         is set to False. If the reverse_accumulation_logic is set to True, it returns
         the opposite of the state of the accumulation sensor.
         """
-        state = self.accumulation_sensor.state.value
+        if 'accumulation' in self.sensor_filters:
+            return self.sensor_filters['accumulation'].state
+        state = self.read_input(self.accumulation_sensor)
         if self.reverse_accumulation_logic:
             return not state
         else:
@@ -249,34 +393,104 @@ class Conveyor(ABC):
         and pusher_retract_delay to the extend and retract delay of the pusher respectively.
         It also sets the pusher_sensor_present to True if the pusher sensor is present
         and False if the pusher sensor is not present.
+        The pusher is a PneumaticModel, which predicts its position from the delays without sensors
+        and calibrates its stroke times with sensors.
+        With retractOverlapEnabled the conveyor restarts once the pusher has retracted past its clearance,
+        given by retractClearanceSensorName or by the retractClearance fraction of the retract stroke time.
         """
         pusher_params = kwargs.get(PUSHER_CONFIG, {})
         try:
             self.pusher_present = pusher_params.get(PUSHER_PRESENT)
             if self.pusher_present:
-                self.pusher = self.system_state.machine.get_pneumatic(pusher_params.get(PUSHER_NAME))
+                pusher = self.system_state.machine.get_pneumatic(pusher_params.get(PUSHER_NAME))
                 self.pusher_extend_logic = pusher_params.get(PUSHER_EXTEND_LOGIC)
                 self.pusher_retract_logic = pusher_params.get(PUSHER_RETRACT_LOGIC)
                 self.pusher_extend_delay = pusher_params.get(EXTEND_DELAY_SEC)
                 self.pusher_retract_delay = pusher_params.get(RETRACT_DELAY_SEC)
                 self.pusher_sensor_present = pusher_params.get(SENSORS_PRESENT)
+                self.pusher = self.pneumatic_model(pusher, f"Pusher of conveyor {self.index}", pusher_params,
+                                                   self.pusher_sensor_present)
+                self.retract_overlap = bool(pusher_params.get(RETRACT_OVERLAP_ENABLED, False))
+                if self.retract_overlap and not self.RETRACT_OVERLAP_SUPPORTED:
+                    logging.error(f"Retract overlap is not supported by {type(self).__name__}, "
+                                  f"conveyor {self.index} waits for the pusher to be pulled")
+                    self.retract_overlap = False
+                self.retract_clearance = pusher_params.get(RETRACT_CLEARANCE, DEFAULT_RETRACT_CLEARANCE)
+                if self.retract_overlap and pusher_params.get(RETRACT_CLEARANCE_SENSOR_NAME):
+                    self.retract_clearance_sensor = self.system_state.machine.get_input(
+                        pusher_params.get(RETRACT_CLEARANCE_SENSOR_NAME)
+                    )
         except MachineException as e:
             logging.error('Pneumatic Pusher not found')
             # raise Exception(f"Pneumatic Pusher not found") from e
 
+    @staticmethod
+    def pneumatic_model(pneumatic, name: str, params: dict, sensors_present):
+        """
+        A method that is used to wrap a pneumatic in a PneumaticModel.
+        It takes the pusher or stopper configuration for the extend and retract delays
+        and the stroke calibration settings.
+        """
+        return PneumaticModel(pneumatic, name, sensors_present, params.get(EXTEND_DELAY_SEC),
+                              params.get(RETRACT_DELAY_SEC), params.get(STROKE_CALIBRATION_ENABLED, True),
+                              params.get(STROKE_CALIBRATION_MARGIN, 0.2), params.get(STROKE_CALIBRATION_SAMPLES, 5))
+
     def pusher_state(self, desired_state):
         """
         A method that is used to get the state of the pusher.
         It returns True if the state of the pusher is equal to the desired state
         and False if the state of the pusher is not equal to the desired state.
+        With sensors the state is the sensed one. Without sensors it is predicted from the
+        time since the last push or pull, a pusher in an unknown position is pulled first.
         """
-        if self.pusher_sensor_present:
-            if self.pusher.state == desired_state:
-                return True
-            else:
-                return False
-        else:
+        if self.pusher is None:
+            return False
+        state = self.pusher.state
+        if state == UNKNOWN and not self.pusher_sensor_present:
+            self.pusher.pull_async()
+        return state == desired_state
+
+    def pusher_clear(self):
+        """
+        A method that tells if the retracting pusher is out of the way of the boxes.
+        It returns True once the pusher is pulled. With the retract overlap it also returns True
+        once the clearance sensor is on, or without one once the retract has run for the
+        clearance fraction of the retract stroke time.
+        """
+        if self.pusher_state("pulled"):
+            return True
+        if not self.retract_overlap:
             return False
+        if self.retract_clearance_sensor is not None:
+            return bool(self.read_input(self.retract_clearance_sensor))
+        return self.pusher.progress("pulled") >= self.retract_clearance
+
+    def release_pusher(self):
+        """
+        A method that ends the retract of the pusher.
+        It idles the pusher once it is pulled. A pusher only past its clearance keeps
+        pulling, finish_retract idles it once it is pulled.
+        """
+        if self.pusher_state("pulled"):
+            self.pusher.idle_async()
+        else:
+            self.retract_finishing = True
+
+    def finish_retract(self):
+        """
+        A method that keeps pulling a pusher released before it was pulled.
+        It idles the pusher once it is pulled. A pusher pushing again or brought back
+        to INIT is no longer finishing its retract.
+        """
+        if not self.retract_finishing:
+            return
+        if self.conveyor_state in (ConveyorState.INIT, ConveyorState.PUSHING):
+            self.retract_finishing = False
+        elif self.pusher_state("pulled"):
+            self.pusher.idle_async()
+            self.retract_finishing = False
+        else:
+            self.pusher.pull_async()
 
     def initialize_stopper(self, kwargs):
         """
@@ -290,6 +504,7 @@ class Conveyor(ABC):
         and stopper_retract_delay to the extend and retract delay of the stopper respectively.
         It also sets the stopper_sensor_present to True if the stopper sensor is present
         and False if the stopper sensor is not present.
+        A stopper without a sensor is a PneumaticModel, which predicts its position from the delays.
         """
         self.stopper_config = kwargs.get(STOPPER_CONFIG, {})
         self.stopper_present = self.stopper_config.get(STOPPER_PRESENT)
@@ -305,6 +520,11 @@ class Conveyor(ABC):
                     self.stopper_sensor = self.system_state.machine.get_input(
                         self.stopper_config.get(STOPPER_SENSOR_NAME)
                     )
+                    self.initialize_sensor_filter('stopper', self.stopper_sensor, False,
+                                                  self.stopper_config.get(SENSOR_FILTER_CONFIG))
+                else:
+                    self.stopper = self.pneumatic_model(self.stopper, f"Stopper of conveyor {self.index}",
+                                                        self.stopper_config, False)
         except MachineException as e:
             logging.error('Pneumatic Stopper not found')
             # raise Exception(f"Pneumatic Stopper not found") from e
@@ -314,23 +534,441 @@ class Conveyor(ABC):
         A method that is used to get the state of the stopper.
         It returns True if the state of the stopper is equal to the desired state
         and False if the state of the stopper is not equal to the desired state.
+        Without a sensor the state is predicted from the time since the last push or pull.
         """
+        if self.stopper_present and not self.stopper_sensor_present:
+            return self.stopper is not None and self.stopper.state == desired_state
         if self.stopper_present:
-            if self.stopper_sensor.state.value == desired_state:
+            if self.get_stopper_sensor_state() == desired_state:
                 return True
             else:
                 return False
         else:
             return False
 
+    def initialize_pick_cycle_tuner(self, kwargs, accumulation_timer=None):
+        """
+        A method that is used to initialize the pick cycle tuner.
+        It takes a dictionary as an argument and uses the AUTO_TUNE_CONFIG key
+        to get the parameters of the tuner. If auto tuning is enabled, it creates
+        a PickCycleTuner watching the restart_conveyor_timer and, if given,
+        the accumulation timer. Must be called after restart_conveyor_timer is created.
+        """
+        tune_params = kwargs.get(AUTO_TUNE_CONFIG, {})
+        if not tune_params.get(AUTO_TUNE_ENABLED):
+            self.pick_cycle_tuner = None
+            return
+        minimum_fraction = tune_params.get(MINIMUM_TIMER_FRACTION, DEFAULT_MINIMUM_FRACTION)
+        if not 0.0 < minimum_fraction <= 1.0:
+            logging.error(f"minimumTimerFraction of conveyor {self.index} must be above 0 and at most 1, "
+                          f"not {minimum_fraction}")
+            minimum_fraction = DEFAULT_MINIMUM_FRACTION
+        self.pick_cycle_tuner = PickCycleTuner(
+            self.restart_conveyor_timer,
+            accumulation_timer,
+            apply=bool(tune_params.get(AUTO_TUNE_APPLY, False)),
+            safety_margin=tune_params.get(SAFETY_MARGIN, 0.2),
+            minimum_samples=tune_params.get(MINIMUM_SAMPLES, 10),
+            minimum_restart_time=tune_params.get(MINIMUM_RESTART_TIME),
+            minimum_accumulation_time=tune_params.get(MINIMUM_ACCUMULATION_TIME),
+            minimum_fraction=minimum_fraction,
+        )
+
+    def update_pick_cycle_tuner(self, robot_is_picking):
+        """
+        A method that feeds the current robot and sensor values to the pick cycle tuner.
+        It publishes the tuning report every time a pick cycle is completed.
+        It does nothing if auto tuning is off.
+        """
+        if self.pick_cycle_tuner is None:
+            return
+        accumulation_present = None
+        if self.accumulation_sensor is not None:
+            accumulation_present = self.get_accumulation_sensor_state()
+        if self.pick_cycle_tuner.observe(robot_is_picking, self.get_box_sensor_state(), accumulation_present,
+                                         self.conveyor_state == ConveyorState.RUNNING):
+            self.system_state.publish_tuning_report(self.index, self.pick_cycle_tuner.report())
+
+    def initialize_robot_handshake(self, robot_handshake, kwargs):
+        """
+        A method that is used to initialize the robot handshake.
+        It takes the RobotHandshake shared by the conveyors of the cell, or None,
+        and a dictionary that uses the HANDSHAKE_LEAD_TIME key to get how long
+        the next box needs to reach the pick point.
+        """
+        self.robot_handshake = robot_handshake
+        self.handshake_lead_time = kwargs.get(HANDSHAKE_LEAD_TIME) or 0.0
+        if robot_handshake is not None:
+            self.robot_handshake_cycle = robot_handshake.cycle
+
+    def robot_pick_pending(self, robot_is_picking):
+        """
+        A method that tells if the robot is picking.
+        It returns True if the robot_is_picking boolean is set or if the
+        robot handshake reports a pick imminent or a box gripped.
+        """
+        if robot_is_picking:
+            return True
+        return self.robot_handshake is not None and self.robot_handshake.pick_pending()
+
+    def robot_handshake_allows_restart(self):
+        """
+        A method that tells if the robot handshake allows the conveyor to restart now,
+        without waiting for robot_is_picking and the restart timer.
+        Each handshake pick cycle allows a single restart.
+        It returns False if there is no handshake, so the boolean stays the fallback.
+        """
+        if self.robot_handshake is None:
+            return False
+        if self.robot_handshake.safe_to_advance(self.robot_handshake_cycle, self.handshake_lead_time):
+            self.robot_handshake_cycle = self.robot_handshake.cycle
+            return True
+        return False
+
+    def mark_robot_handshake_used(self):
+        """
+        A method that marks the current handshake pick cycle as used.
+        It is called when the conveyor restarted through the fallback restart timer,
+        so a late clear of the same pick does not restart the conveyor a second time.
+        """
+        if self.robot_handshake is not None:
+            self.robot_handshake_cycle = self.robot_handshake.cycle
+
+    def transit_time(self):
+        """
+        A method that returns the time in seconds for a box to cross the conveyor.
+        It uses the belt_length and the belt_speed, the axis speed is used when
+        no belt speed is configured. It returns None if either is unknown.
+        """
+        if not self.belt_length or not self.belt_speed:
+            return None
+        return self.belt_length / self.belt_speed
+
+    def initialize_speed_profile(self, kwargs):
+        """
+        A method that is used to initialize the speed profile.
+        It takes a dictionary as an argument and uses the SPEED_PROFILE_CONFIG key
+        to get the parameters of the profile. If the profile is enabled, it creates
+        a SpeedProfile with the slow speed and acceleration used by an axis, the
+        output selecting the slow preset speed used by a vfd, and the pre-stop sensor
+        and slow down time used to decide when to slow down.
+        """
+        profile_params = kwargs.get(SPEED_PROFILE_CONFIG, {})
+        if not profile_params.get(SPEED_PROFILE_ENABLED):
+            self.speed_profile = None
+            return
+        slow_down_sensor = None
+        slow_speed_output = None
+        try:
+            if profile_params.get(SLOW_DOWN_SENSOR_NAME):
+                slow_down_sensor = self.system_state.machine.get_input(profile_params.get(SLOW_DOWN_SENSOR_NAME))
+            if self.actuator_is_vfd and profile_params.get(SLOW_SPEED_OUTPUT_NAME):
+                slow_speed_output = self.system_state.machine.get_output(profile_params.get(SLOW_SPEED_OUTPUT_NAME))
+        except MachineException as e:
+            logging.error(f"Speed profile input or output not found")
+        self.speed_profile = SpeedProfile(
+            slow_speed=profile_params.get(SLOW_SPEED),
+            slow_acceleration=profile_params.get(SLOW_ACCELERATION) or self.actuator_acceleration,
+            slow_down_time=profile_params.get(SLOW_DOWN_TIME),
+            slow_down_sensor=slow_down_sensor,
+            reverse_sensor_logic=bool(profile_params.get(SLOW_DOWN_SENSOR_REVERSE_LOGIC)),
+            slow_speed_output=slow_speed_output,
+        )
+
+    def update_speed_profile(self):
+        """
+        A method that slows the belt down when the box nears the stop point.
+        It is called while the conveyor is RUNNING. It switches a vfd to its slow
+        preset speed through the slow speed output and moves an axis at the slow speed.
+        It does nothing if there is no speed profile or the belt already slowed down.
+        """
+        if self.speed_profile is None or not self.speed_profile.should_slow_down(read_input=self.read_input):
+            return
+        self.speed_profile.slow = True
+        if self.actuator_is_vfd:
+            if self.speed_profile.slow_speed_output is not None:
+                self.speed_profile.slow_speed_output.write(True)
+        elif self.speed_profile.slow_speed:
+            self.actuator.move_continuous_async(self.speed_profile.slow_speed, self.speed_profile.slow_acceleration)
+
+    def initialize_demand_speed(self, kwargs):
+        """
+        A method that is used to initialize the demand driven speed.
+        It takes a dictionary as an argument and uses the DEMAND_SPEED_CONFIG key
+        to get the minimum and maximum speeds and the speed step. The maximum speed
+        defaults to the axis speed. A vfd only has two preset speeds, selected with
+        the slow speed output.
+        The minimum speed must be positive, a full buffer must not stop a belt that reports RUNNING.
+        It defaults to DEFAULT_MINIMUM_SPEED_FRACTION of the maximum speed.
+        """
+        demand_params = kwargs.get(DEMAND_SPEED_CONFIG, {})
+        if not demand_params.get(DEMAND_SPEED_ENABLED):
+            self.demand_speed = None
+            return
+        slow_speed_output = None
+        try:
+            if self.actuator_is_vfd and demand_params.get(SLOW_SPEED_OUTPUT_NAME):
+                slow_speed_output = self.system_state.machine.get_output(demand_params.get(SLOW_SPEED_OUTPUT_NAME))
+        except MachineException as e:
+            logging.error(f"Demand speed output not found")
+        maximum_speed = demand_params.get(MAXIMUM_SPEED) or self.actuator_speed or 0
+        minimum_speed = demand_params.get(MINIMUM_SPEED)
+        if minimum_speed is not None and minimum_speed <= 0:
+            logging.error(f"Demand speed minimumSpeed of conveyor {self.index} must be positive, not {minimum_speed}")
+            minimum_speed = None
+        if minimum_speed is None:
+            minimum_speed = maximum_speed * DEFAULT_MINIMUM_SPEED_FRACTION
+        self.demand_speed = DemandSpeed(
+            minimum_speed,
+            maximum_speed,
+            demand_params.get(SPEED_STEP),
+            slow_speed_output,
+        )
+
+    def buffer_fill(self):
+        """
+        A method that returns how full the conveyor is, between 0.0 and 1.0.
+        It counts the box sensor and the accumulation sensor that see a box.
+        It returns None if the conveyor has no sensor.
+        """
+        sensors = []
+        if self.box_sensor is not None:
+            sensors.append(self.get_box_sensor_state())
+        if self.accumulation_sensor is not None:
+            sensors.append(self.get_accumulation_sensor_state())
+        if not sensors:
+            return None
+        return sum(1 for covered in sensors if covered) / len(sensors)
+
+    def set_conveyor_speed(self, speed):
+        """
+        A method that moves the conveyor at the given speed.
+        The setpoint is only sent to the drive when it changes. An axis moves
+        continuously at the speed, a vfd runs forward and selects its slow preset
+        speed when the speed is in the lower half of the demand speed range.
+        """
+        if speed == self.commanded_speed:
+            return
+        if self.actuator_is_vfd:
+            if self.demand_speed is not None and self.demand_speed.slow_speed_output is not None:
+                self.demand_speed.slow_speed_output.write(self.demand_speed.is_slow(speed))
+            if self.commanded_speed is None:
+                self.actuator.move_forward()
+        else:
+            self.actuator.move_continuous_async(speed, self.actuator_acceleration)
+        self.commanded_speed = speed
+
+    def initialize_sensor_filter(self, role, sensor, reverse_logic, filter_config):
+        """
+        A method that is used to initialize the filter of a sensor.
+        It takes the role of the sensor ('box', 'accumulation' or 'stopper'),
+        the sensor, its reverse logic and the filter parameters. If there are
+        filter parameters, it creates a FilteredSensor with the debounce window
+        and the minimum on and off times. The getters of the sensor then return
+        the filtered value, which ControlAllConveyor updates once per tick.
+        """
+        if not filter_config:
+            self.sensor_filters.pop(role, None)
+            return
+        debounce = filter_config.get(DEBOUNCE_TIME) or 0.0
+        self.sensor_filters[role] = FilteredSensor(
+            sensor,
+            bool(reverse_logic),
+            debounce_on=debounce,
+            debounce_off=debounce,
+            minimum_on=filter_config.get(MINIMUM_ON_TIME) or 0.0,
+            minimum_off=filter_config.get(MINIMUM_OFF_TIME) or 0.0,
+        )
+
+    def get_stopper_sensor_state(self):
+        """
+        A method that is used to get the state of the stopper sensor.
+        It returns the filtered state when the sensor is filtered.
+        """
+        if 'stopper' in self.sensor_filters:
+            return self.sensor_filters['stopper'].state
+        return self.read_input(self.stopper_sensor)
+
+    def read_input(self, sensor):
+        """
+        A method that reads an input.
+        It returns the value from the input snapshot of the current tick,
+        so every read of the same input in a tick gives the same value.
+        It reads the input live when there is no snapshot.
+        """
+        if self.input_snapshot is not None:
+            return self.input_snapshot.read(sensor)
+        return sensor.state.value
+
+    def inputs(self):
+        """
+        A method that returns the inputs read by the conveyor.
+        It is used by ControlAllConveyor to build the input snapshot.
+        """
+        sensors = [self.box_sensor, self.accumulation_sensor, self.stopper_sensor, self.retract_clearance_sensor]
+        if self.speed_profile is not None:
+            sensors.append(self.speed_profile.slow_down_sensor)
+        return [sensor for sensor in sensors if sensor is not None]
+
+    def use_command_dispatcher(self, dispatcher):
+        """
+        A method that routes the commands of the conveyor through a CommandDispatcher.
+        It replaces the actuator, the pneumatics and the speed outputs with
+        DispatchedDevice, so the commands issued in run() are sent at the end of the
+        tick together with the commands of the other conveyors.
+        """
+        self.actuator = dispatcher.wrap(self.actuator, self)
+        self.pusher = dispatcher.wrap(self.pusher, self)
+        self.stopper = dispatcher.wrap(self.stopper, self)
+        if self.speed_profile is not None:
+            self.speed_profile.slow_speed_output = dispatcher.wrap(self.speed_profile.slow_speed_output, self)
+        if self.demand_speed is not None:
+            self.demand_speed.slow_speed_output = dispatcher.wrap(self.demand_speed.slow_speed_output, self)
+
+    def on_command_failed(self, command):
+        """
+        A method called by the CommandDispatcher when a command issued by the conveyor failed.
+        It keeps count of the failures and the last failed command. A command that hung
+        is reported as failed with a TimeoutError. After COMMAND_FAILURE_LIMIT failures within
+        COMMAND_FAILURE_WINDOW seconds a fault is published and the conveyor is brought back to a safe state.
+        """
+        self.command_failures += 1
+        self.last_failed_command = command
+        now = time.perf_counter()
+        self.command_failure_times.append(now)
+        if (len(self.command_failure_times) == COMMAND_FAILURE_LIMIT and
+                now - self.command_failure_times[0] <= COMMAND_FAILURE_WINDOW):
+            self.command_failure_times.clear()
+            self.system_state.publish_conv_fault(self.index, {
+                "state": self.conveyor_state.name,
+                "action": "commandFailures",
+                "command": command.method,
+                "error": str(command.error),
+            })
+            self.recover_to_safe_state()
+
+    def initialize_watchdog(self, kwargs):
+        """
+        A method that is used to initialize the state timeouts of the watchdog.
+        It starts from the DEFAULT_STATE_TIMEOUTS of the conveyor type and takes
+        a dictionary that uses the WATCHDOG_CONFIG key to override them by state
+        name and to set the number of retries. The watchdog can be disabled.
+        A default timeout of a state waiting on the pusher follows the stroke time of the pusher,
+        a timeout set in the configuration is used as it is.
+        The number of recoveries before the fault latches is set in the same dictionary,
+        it also applies with the watchdog disabled as failed commands recover the conveyor too.
+        """
+        watchdog_params = kwargs.get(WATCHDOG_CONFIG, {})
+        recoveries = watchdog_params.get(WATCHDOG_RECOVERIES)
+        if recoveries is not None:
+            if recoveries < 1:
+                logging.error(f"Watchdog recoveries of conveyor {self.index} must be at least 1, not {recoveries}")
+            else:
+                self.recovery_limit = recoveries
+        if watchdog_params.get(WATCHDOG_ENABLED, True) is False:
+            self.state_timeouts = {}
+            return
+        self.state_timeouts = dict(self.DEFAULT_STATE_TIMEOUTS)
+        self.stroke_timeouts = {state: PUSHER_STATE_DIRECTIONS[state] for state in self.DEFAULT_STATE_TIMEOUTS
+                                if state in PUSHER_STATE_DIRECTIONS}
+        for state_name, timeout in watchdog_params.get(STATE_TIMEOUTS, {}).items():
+            try:
+                self.state_timeouts[ConveyorState[state_name]] = timeout
+                self.stroke_timeouts.pop(ConveyorState[state_name], None)
+            except KeyError:
+                logging.error(f"Unknown conveyor state {state_name} in the watchdog configuration")
+        retries = watchdog_params.get(WATCHDOG_RETRIES)
+        if retries is not None:
+            self.watchdog_retries = retries
+
+    def retry_stuck_state(self):
+        """
+        A method that retries the pneumatic of a state that timed out.
+        It idles the pusher, or the stopper, so the next run() sends the
+        push or pull command again from a released valve. A pusher that does
+        not come back pulled in INIT is pulled again.
+        """
+        if self.conveyor_state == ConveyorState.INIT and self.pusher_present:
+            self.pusher.pull_async()
+        elif self.conveyor_state in (ConveyorState.PUSHING, ConveyorState.RETRACT) and self.pusher_present:
+            self.pusher.idle_async()
+        elif self.conveyor_state == ConveyorState.QUEUEING and self.stopper_present:
+            self.stopper.idle_async()
+
+    def watchdog_timeout(self):
+        """
+        A method that returns the maximum dwell time of the current state, None when it is not watched.
+        INIT is only watched on a conveyor with a pusher while the drives are ready and the estop is off,
+        otherwise it waits on the line and not on the pusher.
+        A state waiting on the pusher times out after STROKE_TIMEOUT_FACTOR stroke times of the pusher,
+        at least STROKE_TIMEOUT_FLOOR seconds. The stroke time is the calibrated one once the pusher is calibrated.
+        """
+        if self.conveyor_state == ConveyorState.INIT and (
+                not self.pusher_present or not self.system_state.drives_are_ready or self.system_state.estop):
+            return None
+        direction = self.stroke_timeouts.get(self.conveyor_state)
+        if direction is not None and self.pusher is not None:
+            return max(STROKE_TIMEOUT_FLOOR, self.pusher.stroke_time(direction) * STROKE_TIMEOUT_FACTOR)
+        return self.state_timeouts.get(self.conveyor_state)
+
+    def recover_to_safe_state(self):
+        """
+        A method that brings the conveyor back to a safe state after the watchdog retries are used up.
+        It stops the conveyor, pulls the pusher back and sets the state to INIT,
+        from where run() starts over once the pusher is pulled.
+        The recoveries are counted across the passes through INIT, after recovery_limit
+        of them within RECOVERY_WINDOW seconds the fault latches.
+        """
+        self.stop()
+        if self.pusher_present:
+            self.pusher.pull_async()
+        self.conveyor_state = ConveyorState.INIT
+        now = time.perf_counter()
+        self.recovery_times.append(now)
+        if (len(self.recovery_times) == self.recovery_limit and
+                now - self.recovery_times[0] <= RECOVERY_WINDOW):
+            self.latch_fault()
+
+    def latch_fault(self):
+        """
+        A method that latches the fault of a conveyor that keeps failing after its recoveries.
+        The conveyor is left stopped in INIT and no longer runs until reset_fault is called by an operator.
+        """
+        self.fault_latched = True
+        self.system_state.publish_conv_fault(self.index, {
+            "state": self.conveyor_state.name,
+            "action": "latched",
+            "recoveries": len(self.recovery_times),
+        })
+
+    def reset_fault(self):
+        """
+        A method that clears a latched fault on request of an operator.
+        The counts of recoveries and failed commands start over and the conveyor starts over from INIT.
+        """
+        self.recovery_times.clear()
+        self.command_failure_times.clear()
+        self.conveyor_state = ConveyorState.INIT
+        self.fault_latched = False
+        self.system_state.publish_conv_fault(self.index, {
+            "state": self.conveyor_state.name,
+            "action": "reset",
+        })
+
     def move_conveyor(self):
         """
         A method that is used to move the conveyor.
         It moves the conveyor forward if the actuator is a vfd.
         If the actuator is not a vfd, it moves the conveyor continuously
         at the speed and acceleration set in the parameters.
+        With a speed profile, the conveyor always starts at full speed.
         """
+        self.commanded_speed = None
+        if self.speed_profile is not None:
+            self.speed_profile.start()
         if self.actuator_is_vfd:
+            if self.speed_profile is not None and self.speed_profile.slow_speed_output is not None:
+                self.speed_profile.slow_speed_output.write(False)
             self.actuator.move_forward()
         else:
             self.actuator.move_continuous_async(self.actuator_speed, self.actuator_acceleration)
@@ -342,6 +980,7 @@ class Conveyor(ABC):
         If the actuator is not a vfd, it stops the conveyor with the deceleration
         set in the parameters.
         """
+        self.commanded_speed = None
         if self.actuator_is_vfd:
             self.actuator.stop()
         else:
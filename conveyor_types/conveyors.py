@@ -1,6 +1,7 @@
 """
 Definitions for the different types of conveyors
 """
+from concurrent.futures import wait
 
 
 class ControlAllConveyor:
@@ -9,21 +10,133 @@ class ControlAllConveyor:
     It is used to control the behavior of all the conveyors in the system.
     Attributes:
         list_of_conveyors: A list of all the conveyors in the system.
+        box_tracker: A BoxTracker following the boxes along the conveyors, None if not used.
+        sensor_filter_bank: A SensorFilterBank updating the filtered sensors once per tick, None if not used.
+        input_snapshot: An InputSnapshot reading every input once per tick, None for live reads.
+        state_watchdog: A StateWatchdog checking the conveyors for stuck states, None if not used.
+        command_dispatcher: A CommandDispatcher sending the commands of a tick concurrently, None to send them
+            right away.
+        state_store: A StateStore publishing a snapshot of the line at the end of every tick for status requests
+            and the metrics, None if not used.
+        metrics: A LineMetrics collecting the metrics of the conveyors, None if not used.
+        trace_recorder: A TraceRecorder writing the changes of the line to a trace file, None if not used.
+        bottleneck_detector: A BottleneckDetector labelling the conveyors working, starved, blocked or faulted
+            every tick and publishing the current bottleneck, None if not used.
+        estop_fast_path: An EstopFastPath stopping the line from the estop callback, the conveyors are held in INIT
+            while it is faulted, None if not used.
+        holding_fault: A boolean, True from the first tick held faulted until the estop is released.
     Methods:
         run_all: A method that is used to run all the conveyors.
         stop_all: A method that is used to stop all the conveyors.
         set_init_state: A method that is used to set the state of all the conveyors to INIT.
+        hold_faulted: A method that is used to hold all the conveyors in INIT while the estop fast path is faulted.
+        reset_faults: A method that is used to reset the latched faults of the conveyors.
     """
 
-    def __init__(self, list_of_conveyors: list):
+    def __init__(self, list_of_conveyors: list, box_tracker=None, sensor_filter_bank=None, input_snapshot=None,
+                 command_dispatcher=None, state_watchdog=None, state_store=None, metrics=None,
+                 trace_recorder=None, bottleneck_detector=None, estop_fast_path=None):
         self.list_of_conveyors = list_of_conveyors
+        self.box_tracker = box_tracker
+        self.sensor_filter_bank = sensor_filter_bank
+        self.input_snapshot = input_snapshot
+        self.command_dispatcher = command_dispatcher
+        self.state_watchdog = state_watchdog
+        self.state_store = state_store
+        self.metrics = metrics
+        self.trace_recorder = trace_recorder
+        self.bottleneck_detector = bottleneck_detector
+        self.estop_fast_path = estop_fast_path
+        self.holding_fault = False
+        self.configure_helpers()
+
+    def configure_helpers(self):
+        """
+        A method that is used to hand the list of conveyors to the input snapshot,
+        the sensor filter bank, the box tracker, the command dispatcher, the watchdog, the state store,
+        the metrics, the trace recorder, the bottleneck detector and the estop fast path.
+        """
+        if self.input_snapshot is not None:
+            self.input_snapshot.configure(self.list_of_conveyors)
+            for conveyor in self.list_of_conveyors:
+                conveyor.input_snapshot = self.input_snapshot
+        if self.sensor_filter_bank is not None:
+            self.sensor_filter_bank.configure(self.list_of_conveyors)
+        if self.box_tracker is not None:
+            self.box_tracker.configure(self.list_of_conveyors)
+        if self.state_watchdog is not None:
+            self.state_watchdog.configure(self.list_of_conveyors)
+        if self.state_store is not None:
+            self.state_store.configure(self.list_of_conveyors)
+        if self.metrics is not None:
+            self.metrics.configure(self.list_of_conveyors, self.box_tracker, self.command_dispatcher,
+                                   self.state_store)
+        if self.trace_recorder is not None:
+            self.trace_recorder.configure(self.list_of_conveyors)
+        if self.bottleneck_detector is not None:
+            self.bottleneck_detector.configure(self.list_of_conveyors)
+        if self.estop_fast_path is not None:
+            self.estop_fast_path.configure(self.list_of_conveyors)
+            if self.command_dispatcher is not None:
+                self.command_dispatcher.estop_fast_path = self.estop_fast_path
+        if self.command_dispatcher is not None:
+            for conveyor in self.list_of_conveyors:
+                conveyor.use_command_dispatcher(self.command_dispatcher)
 
     def run_all(self):
         """
         A method that is used to run all the conveyors.
+        Every input is read once into the snapshot and the filtered sensors are
+        updated in one batch before the conveyors run, the box tracker is updated
+        after the conveyors ran and the commands of the tick are sent together.
+        Each conveyor is checked by the watchdog and recorded in the metrics and the trace
+        right after it ran. The bottleneck detector labels the conveyors once all of them ran,
+        as a conveyor is starved or not depending on the conveyors feeding it, and the state store
+        publishes the snapshot of the line at the end of the tick.
+        While the estop fast path is faulted the conveyors do not run, they are held in INIT.
+        A conveyor with a latched fault does not run either, it stays stopped until its fault is reset.
         """
+        if self.estop_fast_path is not None and self.estop_fast_path.faulted:
+            self.hold_faulted()
+            return
+        self.holding_fault = False
+        read_input = None
+        if self.input_snapshot is not None:
+            self.input_snapshot.refresh()
+            read_input = self.input_snapshot.read
+        if self.sensor_filter_bank is not None:
+            self.sensor_filter_bank.update_all(read_input=read_input)
         for conveyor in self.list_of_conveyors:
-            conveyor.run()
+            if not conveyor.fault_latched:
+                conveyor.run()
+            if self.state_watchdog is not None:
+                self.state_watchdog.check(conveyor)
+            if self.metrics is not None:
+                self.metrics.observe_conveyor(conveyor)
+            if self.trace_recorder is not None:
+                self.trace_recorder.record_conveyor(conveyor)
+        if self.estop_fast_path is not None and self.estop_fast_path.faulted:
+            # The estop came in during the tick, a conveyor that ran after the fast path may have moved again
+            self.hold_faulted()
+            return
+        if self.box_tracker is not None:
+            self.box_tracker.update()
+        if self.bottleneck_detector is not None:
+            self.bottleneck_detector.update()
+        if self.state_store is not None:
+            self.state_store.end_tick()
+        self.flush_commands()
+
+    def flush_commands(self):
+        """
+        A method that sends the commands collected by the command dispatcher.
+        """
+        if self.command_dispatcher is not None:
+            completed = self.command_dispatcher.flush()
+            if self.metrics is not None:
+                self.metrics.observe_command_latencies(self.command_dispatcher.last_latencies)
+            if self.trace_recorder is not None:
+                self.trace_recorder.record_commands(completed)
 
     def stop_all(self):
         """
@@ -31,6 +144,53 @@ class ControlAllConveyor:
         """
         for conveyor in self.list_of_conveyors:
             conveyor.stop()
+            if self.metrics is not None:
+                self.metrics.observe_conveyor(conveyor)
+            if self.trace_recorder is not None:
+                self.trace_recorder.record_conveyor(conveyor)
+        if self.state_store is not None:
+            self.state_store.publish()
+        self.flush_commands()
+
+    def hold_faulted(self):
+        """
+        A method that is used to hold all the conveyors in INIT while the estop fast path is faulted.
+        The commands collected during the tick are dropped, so nothing moves until the estop is released,
+        then the conveyors start over from INIT.
+        On the first faulted tick the commands sent before the estop are waited for and every device is
+        stopped again, as a command sent just before the estop may have reached its device after the fast path.
+        """
+        if self.command_dispatcher is not None:
+            self.command_dispatcher.discard()
+        if not self.holding_fault:
+            self.holding_fault = True
+            if self.command_dispatcher is not None:
+                self.command_dispatcher.wait_in_flight(self.estop_fast_path.timeout)
+            _, futures = self.estop_fast_path.stop_devices()
+            wait(futures, timeout=self.estop_fast_path.timeout)
+        for conveyor in self.list_of_conveyors:
+            conveyor.set_conveyor_state_to_init()
+            if self.metrics is not None:
+                self.metrics.observe_conveyor(conveyor)
+            if self.trace_recorder is not None:
+                self.trace_recorder.record_conveyor(conveyor)
+        if self.bottleneck_detector is not None:
+            self.bottleneck_detector.update()
+        if self.state_store is not None:
+            self.state_store.end_tick()
+        self.flush_commands()
+
+    def reset_faults(self, index=None):
+        """
+        A method that is used to reset the latched faults of the conveyors, or of the conveyor with the given index.
+        It returns the indexes of the conveyors that were reset.
+        """
+        reset = []
+        for conveyor in self.list_of_conveyors:
+            if conveyor.fault_latched and (index is None or conveyor.index == index):
+                conveyor.reset_fault()
+                reset.append(conveyor.index)
+        return reset
 
     def set_init_state(self):
         """
@@ -44,3 +204,4 @@ class ControlAllConveyor:
         A method that is used to update the list of conveyors.
         """
         self.list_of_conveyors = new_list_of_conveyors
+        self.configure_helpers()
@@ -1,11 +1,16 @@
 
-from conveyor_types.base import Conveyor, ConveyorState
+from conveyor_types.base import Conveyor, ConveyorState, PNEUMATIC_STATE_TIMEOUTS
 from conveyor_types.system import SystemState
 from helpers.thread_helpers import InterThreadBool
 from helpers.timer_helper import Timer
 
 
 class CustomConveyor(Conveyor):
+    # Keeps a __dict__ so attributes can be added when editing the run function of this conveyor
+    __slots__ = ('robot_is_picking', 'not_moving', '__dict__')
+
+    DEFAULT_STATE_TIMEOUTS = PNEUMATIC_STATE_TIMEOUTS
+
     def __init__(self, system_state: SystemState, robot_is_picking: InterThreadBool, index, **kwargs):
         super().__init__(system_state, index, **kwargs)
 
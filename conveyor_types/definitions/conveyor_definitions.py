@@ -46,4 +46,52 @@ DECCELERATION = "decceleration"
 RESTART_TIME = "restartTime"
 REVERSE_ACCUMULATION_LOGIC = "accumulationSensorReverseLogic"
 BOX_DETECTION_SENSOR_CONFIG = "boxSensorConfig"
-ACCUMULATION_SENSOR_CONFIG = "accumulationSensorConfig"
\ No newline at end of file
+ACCUMULATION_SENSOR_CONFIG = "accumulationSensorConfig"
+AUTO_TUNE_CONFIG = "autoTuneConfig"
+AUTO_TUNE_ENABLED = "autoTuneEnabled"
+AUTO_TUNE_APPLY = "autoTuneApply"
+SAFETY_MARGIN = "safetyMargin"
+MINIMUM_SAMPLES = "minimumSamples"
+MINIMUM_RESTART_TIME = "minimumRestartTime"
+MINIMUM_ACCUMULATION_TIME = "minimumAccumulationTime"
+MINIMUM_TIMER_FRACTION = "minimumTimerFraction"
+HANDSHAKE_LEAD_TIME = "handshakeLeadTime"
+ZONES = "zones"
+ZONE_SENSOR_NAME = "zoneSensorName"
+ZONE_SENSOR_REVERSE_LOGIC = "zoneSensorReverseLogic"
+ZONE_CONVEYOR_NAME = "zoneConveyorName"
+BELT_LENGTH = "beltLength"
+BELT_SPEED = "beltSpeed"
+METERING_ENABLED = "meteringEnabled"
+MINIMUM_GAP = "minimumGap_sec"
+MERGE_DISTANCE = "mergeDistance"
+SPEED_PROFILE_CONFIG = "speedProfileConfig"
+SPEED_PROFILE_ENABLED = "speedProfileEnabled"
+SLOW_SPEED = "slowSpeed"
+SLOW_ACCELERATION = "slowAcceleration"
+SLOW_DOWN_TIME = "slowDownTime"
+SLOW_DOWN_SENSOR_NAME = "slowDownSensorName"
+SLOW_DOWN_SENSOR_REVERSE_LOGIC = "slowDownSensorReverseLogic"
+SLOW_SPEED_OUTPUT_NAME = "slowSpeedOutputName"
+DEMAND_SPEED_CONFIG = "demandSpeedConfig"
+DEMAND_SPEED_ENABLED = "demandSpeedEnabled"
+MINIMUM_SPEED = "minimumSpeed"
+MAXIMUM_SPEED = "maximumSpeed"
+SPEED_STEP = "speedStep"
+SENSOR_FILTER_CONFIG = "sensorFilterConfig"
+ACCUMULATION_SENSOR_FILTER_CONFIG = "accumulationSensorFilterConfig"
+DEBOUNCE_TIME = "debounceTime"
+MINIMUM_ON_TIME = "minimumOnTime"
+MINIMUM_OFF_TIME = "minimumOffTime"
+WATCHDOG_CONFIG = "watchdogConfig"
+WATCHDOG_ENABLED = "watchdogEnabled"
+STATE_TIMEOUTS = "stateTimeouts"
+WATCHDOG_RETRIES = "retries"
+WATCHDOG_RECOVERIES = "recoveries"
+ROBOT_CELL = "robotCell"
+STROKE_CALIBRATION_ENABLED = "strokeCalibrationEnabled"
+STROKE_CALIBRATION_MARGIN = "strokeCalibrationMargin"
+STROKE_CALIBRATION_SAMPLES = "strokeCalibrationSamples"
+RETRACT_OVERLAP_ENABLED = "retractOverlapEnabled"
+RETRACT_CLEARANCE = "retractClearance"
+RETRACT_CLEARANCE_SENSOR_NAME = "retractClearanceSensorName"
\ No newline at end of file
@@ -1,13 +1,33 @@
 
 mqtt_topics = {
     'conveyor/state': 'conveyors/{id_conv}/state',
+    'conveyor/tuning': 'conveyors/{id_conv}/tuning',
+    'conveyor/zones': 'conveyors/{id_conv}/zones',
+    'conveyor/merge': 'conveyors/{id_conv}/merge',
+    'conveyor/fault': 'conveyors/{id_conv}/fault',
+    'faultReset': 'conveyors/fault/reset',
+    'tracking': 'conveyors/tracking',
+    'sensorGlitches': 'conveyors/sensors/glitches',
     'estop/status': 'estop/status',
     'smartDrivesReady': 'smartDrives/areReady',
     'conveyorControlStart': 'conveyors/control/start',
     'conveyorControlStop': 'conveyors/control/stop',
     'sensor': 'io-expander/devices/{device}/inputs/{port}',
     'robotPick': 'robot/picking',
+    'robotPickImminent': 'robot/pick/imminent',
+    'robotPickGripped': 'robot/pick/gripped',
+    'robotPickClear': 'robot/pick/clear',
+    'robotCellPick': 'robot/{cell}/picking',
+    'robotCellPickImminent': 'robot/{cell}/pick/imminent',
+    'robotCellPickGripped': 'robot/{cell}/pick/gripped',
+    'robotCellPickClear': 'robot/{cell}/pick/clear',
     'restart': 'conveyors/configured',
+    'rollback': 'conveyors/configured/rollback',
+    'configVersion': 'conveyors/configured/version',
+    'startup': 'conveyors/startup',
+    'statusRequest': 'conveyors/status/request',
+    'statusResponse': 'conveyors/status/response',
+    'bottleneck': 'conveyors/bottleneck',
 }
 
 mqtt_messages = {
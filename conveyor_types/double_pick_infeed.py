@@ -1,5 +1,5 @@
 
-from conveyor_types.base import Conveyor, ConveyorState
+from conveyor_types.base import Conveyor, ConveyorState, PNEUMATIC_STATE_TIMEOUTS
 from conveyor_types.system import SystemState
 from helpers.thread_helpers import InterThreadBool
 from helpers.timer_helper import Timer
@@ -8,6 +8,9 @@ from conveyor_types.definitions.ipc_mqtt_definitions import mqtt_messages
 
 
 class DoublePickInfeedConveyor(Conveyor):
+    __slots__ = ('pacingTimer', 'sustainTimer', 'startup_timer', 'boxes_to_queue', 'box_was_picked', 'robot_is_picking')
+
+    DEFAULT_STATE_TIMEOUTS = PNEUMATIC_STATE_TIMEOUTS
 
     def __init__(self, system_state: SystemState, robot_is_picking: InterThreadBool, index, **kwargs):
         super().__init__(system_state, index, **kwargs)
@@ -19,6 +22,7 @@ class DoublePickInfeedConveyor(Conveyor):
         self.initialize_accumulation_sensor(kwargs)
         self.initialize_pusher(kwargs)
         self.initialize_stopper(kwargs)
+        self.initialize_speed_profile(kwargs)
 
         self.restart_conveyor_timer = Timer(kwargs.get(RESTART_TIME))
         self.boxes_to_queue = 2
@@ -68,7 +72,7 @@ class DoublePickInfeedConveyor(Conveyor):
 
         elif self.conveyor_state == ConveyorState.QUEUEING:
             self.stopper.pull_async()
-            if self.stopper_sensor_present and self.stopper_sensor.state.value:
+            if self.stopper_sensor_present and self.get_stopper_sensor_state():
                 self.boxes_to_queue -= 1
             if self.boxes_to_queue == 0:
                 self.stopper.idle_async()
@@ -77,6 +81,7 @@ class DoublePickInfeedConveyor(Conveyor):
 
         elif self.conveyor_state == ConveyorState.RUNNING:
             self.stopper.push_async()
+            self.update_speed_profile()
             if self.get_box_sensor_state() and self.get_accumulation_sensor_state() and not self.sustainTimer.started:
                 self.sustainTimer.start()
             if self.sustainTimer.done():
@@ -113,7 +118,7 @@ class DoublePickInfeedConveyor(Conveyor):
                 if self.get_accumulation_sensor_state():
                     self.boxes_to_queue -= 1
                 self.move_conveyor()
-                if self.pacingTimer.started:
+                if not self.pacingTimer.started:
                     self.pacingTimer.start()
                 self.conveyor_state = ConveyorState.PACING
 
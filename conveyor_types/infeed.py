@@ -1,20 +1,29 @@
 
-from conveyor_types.base import Conveyor, ConveyorState
+from conveyor_types.base import Conveyor, ConveyorState, PNEUMATIC_STATE_TIMEOUTS
 from conveyor_types.system import SystemState
 from helpers.thread_helpers import InterThreadBool
 from helpers.timer_helper import Timer
+from helpers.robot_handshake import RobotHandshake
 from conveyor_types.definitions.ipc_mqtt_definitions import mqtt_messages
 
 
 class InfeedConveyor(Conveyor):
-    def __init__(self, system_state: SystemState, robot_is_picking: InterThreadBool, index, **kwargs):
+    __slots__ = ('robot_is_picking', 'not_moving')
+
+    DEFAULT_STATE_TIMEOUTS = PNEUMATIC_STATE_TIMEOUTS
+
+    def __init__(self, system_state: SystemState, robot_is_picking: InterThreadBool, index,
+                 robot_handshake: RobotHandshake = None, **kwargs):
         super().__init__(system_state, index, **kwargs)
 
         self.initialize_box_sensor(kwargs)
         self.initialize_pusher(kwargs)
 
         self.robot_is_picking = robot_is_picking
+        self.initialize_robot_handshake(robot_handshake, kwargs)
         self.restart_conveyor_timer = Timer(self.pusher_retract_delay)
+        self.initialize_pick_cycle_tuner(kwargs)
+        self.initialize_speed_profile(kwargs)
         self.not_moving = True
 
     def run(self):
@@ -35,6 +44,7 @@ class InfeedConveyor(Conveyor):
         if self.conveyor_state == ConveyorState.RUNNING:
             if self.pusher_present:
                 self.pusher.idle_async()
+            self.update_speed_profile()
             if self.get_box_sensor_state():
                 self.stop()
                 self.not_moving = True
@@ -63,13 +73,21 @@ class InfeedConveyor(Conveyor):
 
         elif self.conveyor_state == ConveyorState.WAITING_FOR_PICK:
             self.not_moving = True
-            if (not self.get_box_sensor_state() and not self.robot_is_picking.get() and
-                    not self.restart_conveyor_timer.started):
-                self.restart_conveyor_timer.start()
-            if self.restart_conveyor_timer.done():
+            if not self.get_box_sensor_state() and self.robot_handshake_allows_restart():
                 self.restart_conveyor_timer.stop()
                 self.move_conveyor()
                 self.conveyor_state = ConveyorState.RUNNING
+            else:
+                if (not self.get_box_sensor_state() and not self.robot_is_picking.get() and
+                        not self.restart_conveyor_timer.started):
+                    self.restart_conveyor_timer.start()
+                if self.restart_conveyor_timer.done():
+                    self.restart_conveyor_timer.stop()
+                    self.mark_robot_handshake_used()
+                    self.move_conveyor()
+                    self.conveyor_state = ConveyorState.RUNNING
+
+        self.update_pick_cycle_tuner(self.robot_is_picking.get())
 
     def stop(self):
         self.system_state.publish_conv_state(self.index, self.conveyor_state.name)
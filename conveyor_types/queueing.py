@@ -4,19 +4,25 @@ from conveyor_types.system import SystemState
 from conveyor_types.definitions.ipc_mqtt_definitions import mqtt_messages
 
 class QueueingConveyor(Conveyor):
+    __slots__ = ('parentConveyor',)
+
     def __init__(self, system_state: SystemState, parentConveyor: Conveyor, index, **kwargs):
         super().__init__(system_state, index, **kwargs)
         self.initialize_box_sensor(kwargs)
         self.parentConveyor = parentConveyor
+        self.initialize_demand_speed(kwargs)
         self.conveyor_state = parentConveyor.conveyor_state
 
     def run(self):
         self.system_state.publish_conv_state(self.index, self.conveyor_state.name)
         if self.parentConveyor.conveyor_state == ConveyorState.RUNNING:
             self.conveyor_state = self.parentConveyor.conveyor_state
-            self.move_conveyor()
+            if self.demand_speed is not None:
+                self.set_conveyor_speed(self.demand_speed.speed_for(self.parentConveyor.buffer_fill()))
+            else:
+                self.move_conveyor()
         else:
-            if self.box_sensor.state.value:
+            if self.get_box_sensor_state():
                 self.stop()
 
     def stop(self):
@@ -4,6 +4,8 @@ from conveyor_types.definitions.ipc_mqtt_definitions import mqtt_messages
 
 
 class SimpleConveyor(Conveyor):
+    __slots__ = ()
+
     def __init__(self, system_state: SystemState, index, **kwargs):
         super().__init__(system_state, index, **kwargs)
         self.initialize_box_sensor(kwargs)
@@ -1,3 +1,6 @@
+import json
+import time
+
 from conveyor_types.definitions.ipc_mqtt_definitions import mqtt_messages, mqtt_topics, format_message
 from helpers.thread_helpers import InterThreadBool
 from conveyor_types.conveyors import ControlAllConveyor
@@ -13,11 +16,14 @@ class SystemState:
                         It is set to True when the drives are ready and False when the drives are not ready.
         estop: A boolean that is used to keep track of the state of the estop.
             It is set to True when the estop is active and False when the estop is not active.
+        mqtt_publish_count: An int, number of messages published through publish_mqtt_event.
+        state_store: A StateStore kept up to date with the estop, drive readiness and program_run, None if not used.
+        estop_fast_path: An EstopFastPath stopping the line from the estop callback, None if not used.
     Methods:
         subscribe_to_estop: Subscribes to the estop/status topic on the mqtt broker.
             When a message is received on this topic, the estop_callback function is called.
         estop_callback: This function is called when a message is received on the estop/status topic.
-            It sets the estop variable to the value of the payload.
+            It sets the estop variable to the value of the payload and triggers or releases the estop fast path.
         subscribe_to_drive_readiness: Subscribes to the smartDrives/areReady topic on the mqtt broker.
             When a message is received on this topic, the smart_drive_callback function is called.
         smart_drive_callback: This function is called when a message is received on the smartDrives/areReady topic.
@@ -31,6 +37,9 @@ class SystemState:
         broker.
         """
         self.machine = Machine
+        self.state_store = None
+        self.estop_fast_path = None
+        self.mqtt_publish_count = 0
         self._observers = []
         self.drives_are_ready = False
         self.estop = False
@@ -40,10 +49,55 @@ class SystemState:
         self.machine.on_mqtt_event(mqtt_topics['conveyorControlStop'], self.on_stop_command)
         self.program_run = False
 
+    def publish_mqtt_event(self, topic: str, payload: str):
+        """ Publishes a message to the mqtt broker and counts it."""
+        self.mqtt_publish_count += 1
+        self.machine.publish_mqtt_event(topic, payload)
+
     def publish_conv_state(self, id_conv, state):
         """ Publishes the state of the conveyor with the given id to the mqtt broker."""
         topic = format_message(mqtt_topics['conveyor/state'], id_conv=id_conv)
-        self.machine.publish_mqtt_event(topic, state)
+        self.publish_mqtt_event(topic, state)
+
+    def publish_zone_occupancy(self, id_conv, bitmap: int):
+        """ Publishes the zone occupancy bitmap of the conveyor with the given id to the mqtt broker."""
+        topic = format_message(mqtt_topics['conveyor/zones'], id_conv=id_conv)
+        self.publish_mqtt_event(topic, str(bitmap))
+
+    def publish_conv_fault(self, id_conv, fault: dict):
+        """ Publishes a fault of the conveyor with the given id to the mqtt broker."""
+        topic = format_message(mqtt_topics['conveyor/fault'], id_conv=id_conv)
+        self.publish_mqtt_event(topic, json.dumps(fault))
+
+    def publish_merge_report(self, id_conv, report: dict):
+        """ Publishes the merge metering report of the conveyor with the given id to the mqtt broker."""
+        topic = format_message(mqtt_topics['conveyor/merge'], id_conv=id_conv)
+        self.publish_mqtt_event(topic, json.dumps(report))
+
+    def publish_tracking_report(self, report: dict):
+        """ Publishes the box tracking report of the line to the mqtt broker."""
+        self.publish_mqtt_event(mqtt_topics['tracking'], json.dumps(report))
+
+    def publish_sensor_report(self, report: dict):
+        """ Publishes the glitch counters of the filtered sensors to the mqtt broker."""
+        self.publish_mqtt_event(mqtt_topics['sensorGlitches'], json.dumps(report))
+
+    def publish_config_version(self, info: dict):
+        """ Publishes the version and hash of the configuration in use to the mqtt broker."""
+        self.publish_mqtt_event(mqtt_topics['configVersion'], json.dumps(info))
+
+    def publish_startup_report(self, report: dict):
+        """ Publishes the timed breakdown of the startup of the conveyor process to the mqtt broker."""
+        self.publish_mqtt_event(mqtt_topics['startup'], json.dumps(report))
+
+    def publish_bottleneck_report(self, report: dict):
+        """ Publishes the rolling bottleneck summary of the line to the mqtt broker."""
+        self.publish_mqtt_event(mqtt_topics['bottleneck'], json.dumps(report))
+
+    def publish_tuning_report(self, id_conv, report: dict):
+        """ Publishes the pick cycle tuning report of the conveyor with the given id to the mqtt broker."""
+        topic = format_message(mqtt_topics['conveyor/tuning'], id_conv=id_conv)
+        self.publish_mqtt_event(topic, json.dumps(report))
 
     def subscribe_to_estop(self):
         """ Subscribes to the estop/status topic on the mqtt broker. When a message is received on this topic,
@@ -52,13 +106,20 @@ class SystemState:
 
     def estop_callback(self, topic: str, payload: str):
         """ This function is called when a message is received on the estop/status topic.
-        It sets the estop variable to the value of the payload."""
+        It sets the estop variable to the value of the payload. The estop fast path stops the line right away,
+        before the conveyors see the estop on their next run()."""
+        received = time.perf_counter()
         if payload.lower() == mqtt_messages['estopTrigger']:
             self.estop = True
+            if self.estop_fast_path is not None:
+                self.estop_fast_path.trigger(received)
         elif payload.lower() == mqtt_messages['estopUnTrigger']:
             self.estop = False
+            if self.estop_fast_path is not None:
+                self.estop_fast_path.release()
         else:
             print(f"Unexpected payload received in estopCallback: {payload}")
+        self.update_state_store()
 
     def subscribe_to_control_topics(self):
         self.machine.on_mqtt_event(mqtt_topics['conveyorControlStart'], self.on_start_command)
@@ -81,12 +142,19 @@ class SystemState:
             self.drives_are_ready = False
         else:
             print(f"Unexpected payload received in smartDriveCallback: {payload}")
+        self.update_state_store()
+
+    def update_state_store(self):
+        if self.state_store is not None:
+            self.state_store.update_system(self)
 
     def start_conveyors(self):
         self.program_run = True
+        self.update_state_store()
 
     def stop_conveyors(self):
         self.program_run = False
+        self.update_state_store()
 
     def on_start_command(self, topic, payload):
         print('start command received')
@@ -1,19 +1,56 @@
 
-from conveyor_types.base import Conveyor, ConveyorState
+import logging
+
+from conveyor_types.base import Conveyor, ConveyorState, PNEUMATIC_STATE_TIMEOUTS
 from conveyor_types.system import SystemState
+from conveyor_types.definitions.conveyor_definitions import METERING_ENABLED, MINIMUM_GAP, MERGE_DISTANCE
 from conveyor_types.definitions.ipc_mqtt_definitions import mqtt_messages
+from helpers.merge_metering import MergeMeter
 
 
 class TransferConveyor(Conveyor):
+    __slots__ = ('parentConveyor', 'merge_meter')
+
+    DEFAULT_STATE_TIMEOUTS = PNEUMATIC_STATE_TIMEOUTS
+
     def __init__(self, system_state: SystemState, parentConveyor: Conveyor, index, **kwargs):
         super().__init__(system_state, index, **kwargs)
         self.initialize_box_sensor(kwargs)
         self.initialize_pusher(kwargs)
         self.parentConveyor = parentConveyor
         self.conveyor_state = ConveyorState.INIT
+        self.merge_meter = None
+        self.initialize_merge_meter(kwargs)
+
+    def initialize_merge_meter(self, kwargs):
+        """
+        Creates the MergeMeter when metering is enabled. Metering needs a box sensor on the parent,
+        without one the transfer pushes whenever the parent is running.
+        """
+        if not kwargs.get(METERING_ENABLED):
+            return
+        if self.parentConveyor is None or self.parentConveyor.box_sensor is None:
+            logging.error(f"Metering on {self.actuator_name} needs a box sensor on the parent conveyor")
+            return
+        merge_offset = 0.0
+        merge_distance = kwargs.get(MERGE_DISTANCE)
+        if merge_distance and self.parentConveyor.belt_speed:
+            merge_offset = merge_distance / self.parentConveyor.belt_speed
+        self.merge_meter = MergeMeter(kwargs.get(MINIMUM_GAP) or 0.0, merge_offset)
+
+    def merge_allowed(self):
+        """ True when the box can be pushed onto the parent now."""
+        if self.parentConveyor.conveyor_state != ConveyorState.RUNNING:
+            return False
+        return self.merge_meter is None or self.merge_meter.gap_available()
 
     def run(self):
         self.system_state.publish_conv_state(self.index, self.conveyor_state.name)
+        if self.merge_meter is not None:
+            box_waiting = self.conveyor_state == ConveyorState.STOPPING and self.pusher_present
+            if self.merge_meter.observe(self.parentConveyor.get_box_sensor_state(), box_waiting):
+                self.system_state.publish_merge_report(self.index, self.merge_meter.report())
+
         if not self.system_state.drives_are_ready and not self.system_state.estop:
             self.conveyor_state = ConveyorState.INIT
             if self.pusher_present:
@@ -27,17 +64,19 @@ class TransferConveyor(Conveyor):
                 self.conveyor_state = ConveyorState.RUNNING
 
         elif self.conveyor_state == ConveyorState.RUNNING:
-            if self.box_sensor.state.value:
+            if self.get_box_sensor_state():
                 self.stop()
 
         elif self.conveyor_state == ConveyorState.STOPPING:
             if self.pusher_present and (
-                    self.conveyor_state == ConveyorState.STOPPING and
-                    self.parentConveyor.conveyor_state == ConveyorState.RUNNING):
+                    self.conveyor_state == ConveyorState.STOPPING and self.merge_allowed()):
                 self.conveyor_state = ConveyorState.PUSHING
+                if self.merge_meter is not None:
+                    self.merge_meter.record_push()
+                    self.system_state.publish_merge_report(self.index, self.merge_meter.report())
             elif not self.pusher_present:
                 self.conveyor_state = ConveyorState.WAITING
-            if not self.box_sensor.state.value:
+            if not self.get_box_sensor_state():
                 self.move_conveyor()
                 self.conveyor_state = ConveyorState.RUNNING
 
@@ -54,7 +93,7 @@ class TransferConveyor(Conveyor):
                 self.conveyor_state = ConveyorState.WAITING
 
         elif self.conveyor_state == ConveyorState.WAITING:
-            if not self.box_sensor.state.value:
+            if not self.get_box_sensor_state():
                 self.move_conveyor()
                 self.conveyor_state = ConveyorState.RUNNING
 
@@ -0,0 +1,229 @@
+
+import logging
+
+from machinelogic import MachineException
+
+from conveyor_types.base import Conveyor, ConveyorState
+from conveyor_types.system import SystemState
+from helpers.thread_helpers import InterThreadBool
+from helpers.timer_helper import Timer
+from helpers.robot_handshake import RobotHandshake
+from conveyor_types.definitions.conveyor_definitions import (RESTART_TIME, ZONES, ZONE_SENSOR_NAME,
+                                                             ZONE_SENSOR_REVERSE_LOGIC, ZONE_CONVEYOR_NAME,
+                                                             SENSOR_FILTER_CONFIG)
+
+
+class Zone:
+    """
+    Zone is one zone of a ZoneAccumulatingConveyor.
+    Attributes:
+        sensor: A machine object used to detect a box at the discharge end of the zone.
+        reverse_logic: A boolean used to keep track of whether the sensor logic is reverse.
+        actuator: A machine object used to drive the zone, None when the zone uses the conveyor's drive.
+        actuator_is_vfd: A boolean used to keep track of whether the zone drive is a vfd or not.
+        running: A boolean, the last command sent to the zone drive.
+        sensor_filter: A FilteredSensor of the zone sensor, None if the sensor is not filtered.
+    """
+
+    __slots__ = ('sensor', 'reverse_logic', 'actuator', 'actuator_is_vfd', 'running', 'sensor_filter')
+
+    def __init__(self, system_state: SystemState, zone_config: dict):
+        self.sensor = None
+        self.reverse_logic = bool(zone_config.get(ZONE_SENSOR_REVERSE_LOGIC))
+        self.actuator = None
+        self.actuator_is_vfd = False
+        self.running = False
+        self.sensor_filter = None
+        try:
+            self.sensor = system_state.machine.get_input(zone_config.get(ZONE_SENSOR_NAME))
+        except MachineException:
+            logging.error(f"Zone sensor {zone_config.get(ZONE_SENSOR_NAME)} not found")
+        drive_name = zone_config.get(ZONE_CONVEYOR_NAME)
+        if drive_name:
+            try:
+                self.actuator = system_state.machine.get_ac_motor(drive_name)
+                self.actuator_is_vfd = True
+            except MachineException:
+                try:
+                    self.actuator = system_state.machine.get_actuator(drive_name)
+                except MachineException:
+                    logging.error(f"Zone actuator {drive_name} not found")
+
+    def is_occupied(self, read_input=None):
+        """ Returns True when a box is on the zone sensor, reading it through read_input when given."""
+        if self.sensor_filter is not None:
+            return self.sensor_filter.state
+        if self.sensor is None:
+            return False
+        state = read_input(self.sensor) if read_input is not None else self.sensor.state.value
+        return not state if self.reverse_logic else state
+
+
+class ZoneAccumulatingConveyor(Conveyor):
+    """
+    ZoneAccumulatingConveyor does zero-pressure accumulation over N zones.
+    Each zone has its own sensor at its discharge end and optionally its own drive,
+    zones without a drive share the conveyor's actuator.
+    The first zone of the configuration is the discharge zone the robot picks from.
+    A zone runs while it is empty, or when the zone downstream of it is empty and running,
+    so boxes never push against each other and queue one per zone.
+    The shared drive only runs when every zone on it is allowed to run.
+    The discharge zone restarts after a pick like the AccumulatingConveyor does, with the
+    restart timer or the robot handshake.
+    The conveyor is RUNNING while its most upstream zone can take a box, so conveyors
+    following it only feed it when there is room. It is WAITING_FOR_PICK when full.
+    Attributes:
+        zones: The list of Zone, discharge zone first.
+        zone_occupancy: An int bitmap of the occupied zones, bit 0 is the discharge zone.
+        discharge_running: A boolean, True while the discharge zone is releasing after a pick.
+    """
+
+    __slots__ = ('zones', 'zone_occupancy', 'discharge_running', 'shared_drive_running', 'robot_is_picking')
+
+    def __init__(self, system_state: SystemState, robot_is_picking: InterThreadBool, index,
+                 robot_handshake: RobotHandshake = None, **kwargs):
+        super().__init__(system_state, index, **kwargs)
+
+        self.zones = []
+        for position, zone_config in enumerate(kwargs.get(ZONES, [])):
+            zone = Zone(system_state, zone_config)
+            if zone.sensor is not None:
+                role = f'zone{position}'
+                self.initialize_sensor_filter(role, zone.sensor, zone.reverse_logic,
+                                              zone_config.get(SENSOR_FILTER_CONFIG))
+                zone.sensor_filter = self.sensor_filters.get(role)
+            self.zones.append(zone)
+        self.zone_occupancy = 0
+        self.discharge_running = False
+        self.shared_drive_running = False
+        self.restart_conveyor_timer = Timer(kwargs.get(RESTART_TIME) or 0.0)
+
+        self.robot_is_picking = robot_is_picking
+        self.initialize_robot_handshake(robot_handshake, kwargs)
+
+    def read_zone_occupancy(self):
+        """ Reads every zone sensor once, returns the list of occupied zones and updates the bitmap."""
+        occupied = [zone.is_occupied(self.read_input) for zone in self.zones]
+        bitmap = 0
+        for position, zone_occupied in enumerate(occupied):
+            if zone_occupied:
+                bitmap |= 1 << position
+        if bitmap != self.zone_occupancy:
+            self.zone_occupancy = bitmap
+            self.system_state.publish_zone_occupancy(self.index, bitmap)
+        return occupied
+
+    def use_command_dispatcher(self, dispatcher):
+        """ Routes the commands of the conveyor and of the zone drives through a dispatcher."""
+        super().use_command_dispatcher(dispatcher)
+        for zone in self.zones:
+            zone.actuator = dispatcher.wrap(zone.actuator, self)
+
+    def inputs(self):
+        """ The inputs read by the conveyor, including the zone sensors."""
+        return super().inputs() + [zone.sensor for zone in self.zones if zone.sensor is not None]
+
+    def buffer_fill(self):
+        """ How full the conveyor is, the fraction of occupied zones."""
+        if not self.zones:
+            return None
+        return bin(self.zone_occupancy).count("1") / len(self.zones)
+
+    def discharge_zone_should_run(self, occupied):
+        """ Decides if the discharge zone can run, it waits for the pick to be over before releasing."""
+        if occupied:
+            self.restart_conveyor_timer.stop()
+            return False
+        if self.discharge_running:
+            return True
+        if self.robot_pick_pending(self.robot_is_picking.get()):
+            self.restart_conveyor_timer.stop()
+            return False
+        if self.robot_handshake_allows_restart():
+            self.restart_conveyor_timer.stop()
+            return True
+        if not self.restart_conveyor_timer.started:
+            self.restart_conveyor_timer.start()
+        if self.restart_conveyor_timer.done():
+            self.restart_conveyor_timer.stop()
+            self.mark_robot_handshake_used()
+            return True
+        return False
+
+    def plan_zones(self, occupied):
+        """
+        Computes which zones run this tick.
+        Starts from every zone stopped and lets zones run from downstream to upstream until
+        nothing changes, which gives the most conservative plan that is consistent with the
+        shared drive.
+        """
+        discharge_run = self.discharge_zone_should_run(occupied[0])
+        running = [False] * len(self.zones)
+        for _ in range(len(self.zones) + 1):
+            wanted = [discharge_run]
+            for position in range(1, len(self.zones)):
+                downstream_ready = not occupied[position - 1] and running[position - 1]
+                wanted.append(not occupied[position] or downstream_ready)
+            shared = all(wanted[position] for position, zone in enumerate(self.zones) if zone.actuator is None)
+            planned = [shared if zone.actuator is None else wanted[position]
+                       for position, zone in enumerate(self.zones)]
+            if planned == running:
+                break
+            running = planned
+        self.discharge_running = running[0]
+        return running
+
+    def drive_zones(self, running):
+        """ Sends the planned commands, only to the drives whose command changed."""
+        shared_running = any(running[position] for position, zone in enumerate(self.zones) if zone.actuator is None)
+        if shared_running != self.shared_drive_running:
+            if shared_running:
+                self.move_conveyor()
+            else:
+                self.stop_conveyor()
+            self.shared_drive_running = shared_running
+        for zone, zone_running in zip(self.zones, running):
+            if zone.actuator is None or zone.running == zone_running:
+                zone.running = zone_running
+                continue
+            if zone_running:
+                if zone.actuator_is_vfd:
+                    zone.actuator.move_forward()
+                else:
+                    zone.actuator.move_continuous_async(self.actuator_speed, self.actuator_acceleration)
+            else:
+                if zone.actuator_is_vfd:
+                    zone.actuator.stop()
+                else:
+                    zone.actuator.stop(self.actuator_deceleration)
+            zone.running = zone_running
+
+    def run(self):
+        self.system_state.publish_conv_state(self.index, self.conveyor_state.name)
+        if not self.zones:
+            return
+        if not self.system_state.drives_are_ready or self.system_state.estop:
+            if self.conveyor_state != ConveyorState.INIT:
+                self.stop()
+            return
+
+        occupied = self.read_zone_occupancy()
+        running = self.plan_zones(occupied)
+        self.drive_zones(running)
+
+        if running[-1]:
+            self.conveyor_state = ConveyorState.RUNNING
+        elif occupied[0]:
+            self.conveyor_state = ConveyorState.WAITING_FOR_PICK
+        else:
+            self.conveyor_state = ConveyorState.STOPPING
+
+    def stop(self):
+        self.system_state.publish_conv_state(self.index, self.conveyor_state.name)
+        self.conveyor_state = ConveyorState.INIT
+        if self.actuator is not None:
+            self.stop_conveyor()
+        self.shared_drive_running = False
+        self.discharge_running = False
+        self.restart_conveyor_timer.stop()
+        self.drive_zones([False] * len(self.zones))
@@ -0,0 +1,146 @@
+
+import time
+
+from helpers.line_status import LineStatus, classify_state, is_active
+from helpers.timer_helper import Timer
+
+
+class ConveyorActivity:
+    """
+    ConveyorActivity is the rolling share of time one conveyor spent in each LineStatus.
+    The shares are exponential moving averages over the window, so they cost the same whatever the window.
+    Attributes:
+        status: The LineStatus of the conveyor at the last update.
+        shares: A dictionary of the rolling share of each LineStatus.
+        active_share: The rolling share of time the conveyor was active.
+    """
+
+    def __init__(self):
+        self.status = None
+        self.shares = {status: 0.0 for status in LineStatus}
+        self.active_share = 0.0
+        self.last_time = None
+
+    def update(self, status: LineStatus, active: bool, now: float, window: float):
+        if self.last_time is None:
+            self.shares[status] = 1.0
+            self.active_share = 1.0 if active else 0.0
+        else:
+            weight = min(1.0, max(0.0, now - self.last_time) / window)
+            for each in LineStatus:
+                self.shares[each] += weight * ((1.0 if each == status else 0.0) - self.shares[each])
+            self.active_share += weight * ((1.0 if active else 0.0) - self.active_share)
+        self.status = status
+        self.last_time = now
+
+
+class BottleneckDetector:
+    """
+    BottleneckDetector labels each conveyor every tick as working, starved, blocked or faulted, from its state,
+    its box sensor and the conveyors feeding it through their parent links:
+        A belt running with its sensor clear is starved, unless a conveyor feeding it holds a box,
+        then the box is on its way and the conveyor is working.
+        A conveyor stopped with a box, or waiting on its parent or on the robot, is blocked.
+        A conveyor in PACING is working while its pacing timer runs and blocked otherwise.
+        A conveyor in INIT, or any conveyor while the estop is on or the drives are not ready, is faulted.
+        A belt running without a box sensor is unknown, it cannot tell if it carries a box.
+    The bottleneck is the conveyor active the largest share of the rolling window, active being working or
+    holding a box for the robot. A conveyor without a box sensor is never the bottleneck.
+    A summary is published every report period.
+    Attributes:
+        system_state: A SystemState used to publish the summary, None to not publish.
+        window: A float, time in seconds the rolling shares are averaged over.
+        activities: A dictionary of ConveyorActivity by conveyor index.
+        feeders: A dictionary of the conveyors feeding each conveyor, by conveyor index.
+        bottleneck: The index of the current bottleneck conveyor, None while no conveyor with a box sensor is active.
+    Methods:
+        configure: Builds the feeders of each conveyor from the parent links.
+        label: The LineStatus of one conveyor for this tick.
+        update: Labels every conveyor, meant to be called once per tick after the conveyors ran.
+        report: A dictionary of the current bottleneck and the status of every conveyor.
+    """
+
+    def __init__(self, system_state=None, window=300.0, report_period=5.0):
+        self.system_state = system_state
+        self.window = window
+        self.activities = {}
+        self.feeders = {}
+        self.list_of_conveyors = []
+        self.bottleneck = None
+        self.report_timer = Timer(report_period)
+
+    def configure(self, list_of_conveyors: list):
+        """ Builds the conveyors feeding each conveyor, a conveyor feeds its parent."""
+        self.list_of_conveyors = list_of_conveyors
+        self.activities = {conveyor.index: ConveyorActivity() for conveyor in list_of_conveyors}
+        self.feeders = {conveyor.index: [] for conveyor in list_of_conveyors}
+        for conveyor in list_of_conveyors:
+            parent = getattr(conveyor, 'parentConveyor', None)
+            if parent is not None and parent.index in self.feeders:
+                self.feeders[parent.index].append(conveyor)
+        self.bottleneck = None
+        self.report_timer.stop()
+
+    @staticmethod
+    def box_present(conveyor):
+        return conveyor.get_box_sensor_state() if conveyor.box_sensor is not None else None
+
+    @staticmethod
+    def pacing(conveyor):
+        timer = getattr(conveyor, 'pacingTimer', None)
+        return timer is not None and timer.started
+
+    def label(self, conveyor):
+        """ The LineStatus of a conveyor for this tick."""
+        if self.system_state is not None and (self.system_state.estop or not self.system_state.drives_are_ready):
+            return LineStatus.FAULTED
+        status = classify_state(conveyor.conveyor_state.name, self.box_present(conveyor), self.pacing(conveyor))
+        if status == LineStatus.STARVED:
+            for feeder in self.feeders.get(conveyor.index, ()):
+                if self.box_present(feeder):
+                    return LineStatus.WORKING
+        return status
+
+    def update(self, now=None):
+        """ Labels every conveyor, updates the rolling shares and publishes the summary every report period."""
+        if not self.list_of_conveyors:
+            return
+        now = time.perf_counter() if now is None else now
+        for conveyor in self.list_of_conveyors:
+            status = self.label(conveyor)
+            self.activities[conveyor.index].update(status, is_active(conveyor.conveyor_state.name, status),
+                                                   now, self.window)
+        self.bottleneck = None
+        best_share = 0.0
+        for conveyor in self.list_of_conveyors:
+            share = self.activities[conveyor.index].active_share
+            if conveyor.box_sensor is not None and share > best_share:
+                self.bottleneck, best_share = conveyor.index, share
+
+        if self.system_state is not None:
+            if not self.report_timer.started:
+                self.report_timer.start()
+            if self.report_timer.done():
+                self.report_timer.stop()
+                self.system_state.publish_bottleneck_report(self.report())
+
+    def report(self):
+        """ The current bottleneck and the status and rolling shares of every conveyor."""
+        conveyors = {}
+        for conveyor in self.list_of_conveyors:
+            activity = self.activities[conveyor.index]
+            conveyors[conveyor.index] = {
+                "type": type(conveyor).__name__,
+                "state": conveyor.conveyor_state.name,
+                "status": activity.status.name if activity.status is not None else None,
+                "activeShare": activity.active_share,
+                "shares": {status.name.lower(): share for status, share in activity.shares.items()},
+            }
+        bottleneck = conveyors.get(self.bottleneck)
+        return {
+            "bottleneck": self.bottleneck,
+            "bottleneckType": bottleneck["type"] if bottleneck else None,
+            "bottleneckState": bottleneck["state"] if bottleneck else None,
+            "window_sec": self.window,
+            "conveyors": conveyors,
+        }
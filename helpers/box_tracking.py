@@ -0,0 +1,199 @@
+
+import time
+from collections import deque
+
+from helpers.timer_helper import Timer
+
+
+class TrackedBox:
+    """
+    TrackedBox is one box followed by the BoxTracker.
+    Attributes:
+        box_id: An int given when the box first tripped a sensor.
+        conveyor_index: The index of the conveyor the box is on.
+        entered_time: time.perf_counter() when the box entered that conveyor.
+        at_sensor: A boolean, True while the box is on the sensor of that conveyor.
+        expected_arrival: time.perf_counter() when the box should reach the sensor, None if unknown.
+        created_time: time.perf_counter() when the box was first seen.
+    """
+
+    def __init__(self, box_id: int, conveyor_index, now: float, expected_arrival=None):
+        self.box_id = box_id
+        self.conveyor_index = conveyor_index
+        self.entered_time = now
+        self.at_sensor = False
+        self.expected_arrival = expected_arrival
+        self.created_time = now
+
+
+class TrackedConveyor:
+    """
+    TrackedConveyor is what the BoxTracker knows about one conveyor.
+    Attributes:
+        conveyor: The Conveyor being tracked.
+        downstream_index: The index of the conveyor boxes go to after this one, None if they leave the line.
+        transit_time: Time in seconds for a box to cross the conveyor, None if unknown.
+        boxes: A deque of TrackedBox on the conveyor, oldest first.
+        box_was_present: The sensor value of the previous update, for edge detection.
+        box_count, total_dwell, max_dwell: Statistics of the boxes that left this conveyor.
+    """
+
+    def __init__(self, conveyor, downstream_index=None, transit_time=None):
+        self.conveyor = conveyor
+        self.downstream_index = downstream_index
+        self.transit_time = transit_time
+        self.boxes = deque()
+        self.box_was_present = False
+        self.box_count = 0
+        self.total_dwell = 0.0
+        self.max_dwell = 0.0
+
+    def record_departure(self, box: TrackedBox, now: float):
+        dwell = now - box.entered_time
+        self.box_count += 1
+        self.total_dwell += dwell
+        self.max_dwell = max(self.max_dwell, dwell)
+
+
+class BoxTracker:
+    """
+    BoxTracker follows individual boxes along chained conveyors using only the box sensor edges.
+    A box gets an ID when it trips a sensor with no box expected on that conveyor, which is the
+    first sensor of the line or a box put on by hand. When it leaves the sensor of a conveyor with
+    a parent (QueueingConveyor, TransferConveyor) it moves to the parent's FIFO, and when it leaves
+    the sensor of a conveyor without one (the infeed types) it is picked and leaves the line.
+    The belt length and speed of each conveyor give the expected arrival time, so boxes that never
+    arrive are reported as overdue.
+    Attributes:
+        system_state: A SystemState used to publish the tracking report.
+        conveyors: A dictionary of TrackedConveyor by conveyor index.
+        next_box_id: An int, the ID given to the next new box.
+        line_box_count, line_total_latency: Statistics of the boxes that left the line.
+        overdue_tolerance: A float, fraction of the transit time a box can be late before it is overdue.
+    Methods:
+        configure: Builds the conveyor chain from the parent links of the conveyors.
+        update: Reads the box sensors and moves the boxes, meant to be called once per tick.
+        report: A dictionary with the position of every box and the dwell statistics of every conveyor.
+    """
+
+    def __init__(self, system_state=None, report_period=1.0, overdue_tolerance=0.5):
+        self.system_state = system_state
+        self.conveyors = {}
+        self.next_box_id = 1
+        self.line_box_count = 0
+        self.line_total_latency = 0.0
+        self.overdue_tolerance = overdue_tolerance
+        self.report_timer = Timer(report_period)
+
+    def configure(self, list_of_conveyors: list):
+        """
+        Builds the conveyor chain. Only the conveyors with a box sensor are tracked, a conveyor's
+        downstream is its parent when the parent has a box sensor as well.
+        """
+        self.conveyors = {}
+        for conveyor in list_of_conveyors:
+            if conveyor.box_sensor is None:
+                continue
+            parent = getattr(conveyor, 'parentConveyor', None)
+            downstream_index = None
+            if parent is not None and parent.box_sensor is not None:
+                downstream_index = parent.index
+            self.conveyors[conveyor.index] = TrackedConveyor(conveyor, downstream_index, conveyor.transit_time())
+
+    def new_box(self, conveyor_index, now: float):
+        box = TrackedBox(self.next_box_id, conveyor_index, now)
+        self.next_box_id += 1
+        return box
+
+    def on_box_arrived(self, tracked: TrackedConveyor, now: float):
+        """ Rising edge: the oldest box on the conveyor not yet at the sensor reaches it."""
+        for box in tracked.boxes:
+            if not box.at_sensor:
+                box.at_sensor = True
+                return box
+        box = self.new_box(tracked.conveyor.index, now)
+        box.at_sensor = True
+        tracked.boxes.append(box)
+        return box
+
+    def on_box_left(self, tracked: TrackedConveyor, now: float):
+        """ Falling edge: the box at the sensor goes to the downstream conveyor, or leaves the line."""
+        box = None
+        for candidate in tracked.boxes:
+            if candidate.at_sensor:
+                box = candidate
+                break
+        if box is None:
+            return None
+        tracked.boxes.remove(box)
+        tracked.record_departure(box, now)
+        downstream = self.conveyors.get(tracked.downstream_index)
+        if downstream is None:
+            self.line_box_count += 1
+            self.line_total_latency += now - box.created_time
+            return box
+        box.conveyor_index = downstream.conveyor.index
+        box.entered_time = now
+        box.at_sensor = False
+        box.expected_arrival = now + downstream.transit_time if downstream.transit_time else None
+        downstream.boxes.append(box)
+        return box
+
+    def update(self, now=None):
+        """ Reads the box sensor of every tracked conveyor once and moves the boxes on the edges."""
+        now = time.perf_counter() if now is None else now
+        for tracked in self.conveyors.values():
+            box_present = tracked.conveyor.get_box_sensor_state()
+            if box_present and not tracked.box_was_present:
+                self.on_box_arrived(tracked, now)
+            elif not box_present and tracked.box_was_present:
+                self.on_box_left(tracked, now)
+            tracked.box_was_present = box_present
+
+        if self.system_state is not None:
+            if not self.report_timer.started:
+                self.report_timer.start()
+            if self.report_timer.done():
+                self.report_timer.start()
+                self.system_state.publish_tracking_report(self.report(now))
+
+    def box_locations(self, now=None):
+        """ A list describing where every box on the line is and for how long it has been there."""
+        now = time.perf_counter() if now is None else now
+        locations = []
+        for tracked in self.conveyors.values():
+            for box in tracked.boxes:
+                overdue = False
+                position = None
+                if box.expected_arrival is not None and not box.at_sensor:
+                    late_after = tracked.transit_time * self.overdue_tolerance
+                    overdue = now > box.expected_arrival + late_after
+                    position = min(1.0, (now - box.entered_time) / tracked.transit_time)
+                locations.append({
+                    "boxId": box.box_id,
+                    "conveyor": box.conveyor_index,
+                    "atSensor": box.at_sensor,
+                    "position": position,
+                    "dwell_sec": now - box.entered_time,
+                    "overdue": overdue,
+                })
+        return locations
+
+    def report(self, now=None):
+        """ The position of every box and the dwell statistics of every conveyor and of the line."""
+        now = time.perf_counter() if now is None else now
+        conveyors = {}
+        for index, tracked in self.conveyors.items():
+            conveyors[index] = {
+                "boxes": len(tracked.boxes),
+                "boxCount": tracked.box_count,
+                "averageDwell_sec": tracked.total_dwell / tracked.box_count if tracked.box_count else None,
+                "maxDwell_sec": tracked.max_dwell,
+            }
+        return {
+            "boxes": self.box_locations(now),
+            "conveyors": conveyors,
+            "lineBoxCount": self.line_box_count,
+            "averageLineLatency_sec": (self.line_total_latency / self.line_box_count
+                                       if self.line_box_count else None),
+        }
@@ -0,0 +1,338 @@
+
+import contextlib
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+# Methods of the machine objects that send a command, every other attribute is read directly
+COMMAND_METHODS = frozenset({
+    'move_forward',
+    'move_reverse',
+    'stop',
+    'move_continuous_async',
+    'push_async',
+    'pull_async',
+    'idle_async',
+    'write',
+})
+
+# Methods that bring a device to rest, never dropped and sent on the priority workers
+SAFETY_METHODS = frozenset({
+    'stop',
+    'idle_async',
+})
+
+# Commands kept for a device that is still busy, the oldest ones other than stop and idle are dropped past this
+MAX_QUEUED_COMMANDS = 20
+
+# Time in seconds a command may run before it is reported as failed to its conveyor
+DEFAULT_COMMAND_TIMEOUT = 1.0
+
+
+class Command:
+    """
+    Command is one call to a machine object collected during a tick.
+    Attributes:
+        device: The DispatchedDevice the command was issued on.
+        method: A string, the name of the method to call.
+        args, kwargs: The arguments of the call.
+        issued_time: time.perf_counter() when the command was issued.
+        completed_time: time.perf_counter() when the call returned, None until then.
+        error: The exception raised by the call, None if it succeeded.
+        timed_out: A boolean, True once the call ran longer than the command timeout.
+    """
+
+    def __init__(self, device, method: str, args, kwargs):
+        self.device = device
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.issued_time = time.perf_counter()
+        self.completed_time = None
+        self.error = None
+        self.timed_out = False
+
+    def is_safety(self):
+        return self.method in SAFETY_METHODS
+
+    def same_call(self, other):
+        return self.method == other.method and self.args == other.args and self.kwargs == other.kwargs
+
+    def latency(self):
+        """ Time in seconds from the command being issued to the call returning, None until then."""
+        if self.completed_time is None:
+            return None
+        return self.completed_time - self.issued_time
+
+
+class DispatchedDevice:
+    """
+    DispatchedDevice stands in for an actuator, pneumatic or output of a conveyor.
+    Command methods are collected by the CommandDispatcher instead of being called right away,
+    every other attribute, such as the state of a pneumatic, is read from the real device.
+    Attributes:
+        device: The real machine object.
+        dispatcher: The CommandDispatcher collecting the commands.
+        owner: The conveyor the failures of the commands are reported to.
+    """
+
+    def __init__(self, device, dispatcher, owner):
+        self.device = device
+        self.dispatcher = dispatcher
+        self.owner = owner
+
+    def __getattr__(self, name):
+        if name in COMMAND_METHODS:
+            def issue(*args, **kwargs):
+                self.dispatcher.submit(Command(self, name, args, kwargs))
+            return issue
+        return getattr(self.device, name)
+
+    def device_name(self):
+        configuration = getattr(self.device, 'configuration', None)
+        return getattr(configuration, 'name', repr(self.device))
+
+
+class CommandDispatcher:
+    """
+    CommandDispatcher collects the commands issued by the conveyors during a tick and sends them
+    at the same time through a bounded pool of workers, so a drive that is slow to answer does not
+    hold up the conveyors after it.
+    The commands of one device are sent in the order they were issued, in a single job, and
+    identical consecutive commands are sent once. The jobs of one device never run alongside each other:
+    when the previous job of a device is still running, its new commands wait for the next flush.
+    Failures are reported to the conveyor that issued the command through its on_command_failed method,
+    from the control thread.
+    Stop and idle commands are never dropped: a job with one of them is sent on a pool of priority workers,
+    so hung calls holding the other workers cannot keep the line from stopping. A previous job of the device
+    still waiting for a worker is cancelled, the stop is sent instead of it. When the device is still running
+    a command, the last stop or idle is chained to it and sent as soon as the command returns, the commands
+    issued before the stop are superseded and the ones issued after it wait for the next flush.
+    A command running longer than command_timeout is reported as failed once, with a TimeoutError.
+    With an estop fast path, flush checks it is not faulted under the lock of the fast path while
+    sending the jobs, so no command is sent once the estop triggered: the collected commands are dropped.
+    Attributes:
+        timeout: A float, time in seconds flush waits for the jobs before returning.
+        command_timeout: A float, time in seconds a command may run before it is reported as failed.
+        estop_fast_path: The EstopFastPath of the line, None if not used.
+        commands_sent: An int, number of commands sent.
+        commands_failed: An int, number of commands that raised an exception.
+        commands_timed_out: An int, number of jobs that were still running when a flush returned.
+        commands_hung: An int, number of commands that ran longer than command_timeout.
+        commands_superseded: An int, number of commands dropped for a stop or idle issued after them.
+        last_latencies: A list of the latencies of the commands completed at the last flush.
+    Methods:
+        wrap: Returns a DispatchedDevice for a device of a conveyor.
+        submit: Collects a command.
+        flush: Sends the collected commands and reports the completed ones.
+        discard: Drops the collected commands that were not sent yet.
+        wait_in_flight: Waits for the jobs already sent.
+        shutdown: Stops the workers.
+    """
+
+    def __init__(self, max_workers=4, timeout=0.05, command_timeout=DEFAULT_COMMAND_TIMEOUT, priority_workers=4):
+        self.timeout = timeout
+        self.command_timeout = command_timeout
+        self.estop_fast_path = None
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='conveyor-command')
+        self.priority_executor = ThreadPoolExecutor(max_workers=priority_workers,
+                                                    thread_name_prefix='conveyor-command-stop')
+        self.commands_sent = 0
+        self.commands_failed = 0
+        self.commands_timed_out = 0
+        self.commands_hung = 0
+        self.commands_superseded = 0
+        self.last_latencies = []
+        self.__queued = {}
+        # Jobs sent and not reported yet by device key, oldest first, each a (future, commands, time sent)
+        self.__in_flight = {}
+        self.__timed_out = set()
+        self.__lock = threading.Lock()
+
+    def wrap(self, device, owner):
+        """ Returns a DispatchedDevice for a device, None stays None and a device is never wrapped twice."""
+        if device is None or isinstance(device, DispatchedDevice):
+            return device
+        return DispatchedDevice(device, self, owner)
+
+    def submit(self, command: Command):
+        """ Collects a command, dropping it if it repeats the previous command of the same device."""
+        key = id(command.device.device)
+        with self.__lock:
+            commands = self.__queued.setdefault(key, [])
+            if commands and commands[-1].same_call(command):
+                return
+            commands.append(command)
+            if len(commands) > MAX_QUEUED_COMMANDS:
+                oldest = next((position for position, queued in enumerate(commands) if not queued.is_safety()), 0)
+                del commands[oldest]
+
+    def running(self, key):
+        """ The jobs of the device that did not complete yet, oldest first."""
+        return [job for job in self.__in_flight.get(key, ()) if not job[0].done()]
+
+    def send(self, key, commands: list, priority: bool, now: float):
+        executor = self.priority_executor if priority else self.executor
+        future = executor.submit(self.execute, commands)
+        self.__in_flight.setdefault(key, []).append((future, commands, now))
+        self.commands_sent += len(commands)
+        return future
+
+    def chain(self, key, commands: list, previous: Future, now: float):
+        """ Sends the commands on the priority workers once the previous job of the device completed."""
+        future = Future()
+
+        def send_next(_):
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                job = self.priority_executor.submit(self.execute, commands)
+            except RuntimeError as e:
+                # The workers were shut down, the commands can no longer be sent
+                for command in commands:
+                    command.error = e
+                    command.completed_time = time.perf_counter()
+                future.set_result(commands)
+                return
+            job.add_done_callback(lambda done: future.set_result(done.result()))
+
+        self.__in_flight.setdefault(key, []).append((future, commands, now))
+        self.commands_sent += len(commands)
+        previous.add_done_callback(send_next)
+        return future
+
+    @staticmethod
+    def execute(commands: list):
+        """ Sends the commands of one device in order, runs in a worker."""
+        for command in commands:
+            try:
+                getattr(command.device.device, command.method)(*command.args, **command.kwargs)
+            except Exception as e:
+                command.error = e
+            command.completed_time = time.perf_counter()
+        return commands
+
+    def flush(self):
+        """
+        Sends the collected commands, one job per device, and waits for the new jobs at most timeout seconds.
+        The jobs completed since the last flush are reported, the others are reported once they complete.
+        While the estop fast path is faulted nothing is sent and the collected commands are dropped.
+
+        Returns
+        ----------
+        list
+            The commands completed since the last flush
+        """
+        now = time.perf_counter()
+        with self.fault_lock(), self.__lock:
+            queued = self.__queued
+            self.__queued = {}
+            submitted = []
+            if self.estop_fast_path is not None and self.estop_fast_path.faulted:
+                queued = {}
+            for key, commands in queued.items():
+                safety = [position for position, command in enumerate(commands) if command.is_safety()]
+                running = self.running(key)
+                if safety:
+                    for job in running:
+                        if job[0].cancel():
+                            # The job did not start yet, the stop is sent instead of it rather than after it
+                            self.__in_flight[key].remove(job)
+                            self.commands_superseded += len(job[1])
+                    running = self.running(key)
+                if not running:
+                    submitted.append(self.send(key, commands, bool(safety), now))
+                elif safety:
+                    # The device is still running a command, its last stop or idle follows as soon as it returns
+                    # and supersedes the commands before it
+                    last = safety[-1]
+                    self.commands_superseded += last
+                    future, chained, _ = running[-1]
+                    if not chained[-1].same_call(commands[last]) or not chained[-1].is_safety():
+                        submitted.append(self.chain(key, [commands[last]], future, now))
+                    if commands[last + 1:]:
+                        self.__queued[key] = commands[last + 1:]
+                else:
+                    # The device is still busy with the previous job, keep the commands for the next flush
+                    self.__queued[key] = commands
+            jobs = [(key, job) for key, device_jobs in self.__in_flight.items() for job in device_jobs]
+
+        if submitted:
+            _, not_done = wait(submitted, timeout=self.timeout)
+            for future in not_done:
+                if id(future) not in self.__timed_out:
+                    self.__timed_out.add(id(future))
+                    self.commands_timed_out += 1
+
+        completed = []
+        hung = []
+        now = time.perf_counter()
+        with self.__lock:
+            for key, job in jobs:
+                future, commands, sent = job
+                if future.done():
+                    device_jobs = self.__in_flight.get(key, [])
+                    if job in device_jobs:
+                        device_jobs.remove(job)
+                        if not device_jobs:
+                            del self.__in_flight[key]
+                    self.__timed_out.discard(id(future))
+                    if not future.cancelled():
+                        completed.extend(command for command in future.result() if not command.timed_out)
+                elif now - sent > self.command_timeout:
+                    for command in commands:
+                        if command.completed_time is None and not command.timed_out:
+                            command.timed_out = True
+                            command.error = TimeoutError(f"no answer within {self.command_timeout} s")
+                            hung.append(command)
+
+        self.last_latencies = []
+        for command in completed:
+            self.last_latencies.append(command.latency())
+        self.commands_hung += len(hung)
+        for command in completed + hung:
+            if command.error is not None:
+                self.commands_failed += 1
+                logging.error(f"Command {command.method} on {command.device.device_name()} failed: {command.error}")
+                on_command_failed = getattr(command.device.owner, 'on_command_failed', None)
+                if on_command_failed is not None:
+                    on_command_failed(command)
+        return completed
+
+    def fault_lock(self):
+        """ The lock the estop fast path is marked faulted under, a lock of its own without a fast path."""
+        if self.estop_fast_path is not None:
+            return self.estop_fast_path.lock
+        return contextlib.nullcontext()
+
+    def wait_in_flight(self, timeout=None):
+        """
+        Waits for the jobs already sent to return.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            time in seconds to wait at most, defaults to waiting until they all returned
+
+        Returns
+        ----------
+        int
+            The number of jobs still running
+        """
+        with self.__lock:
+            futures = [future for device_jobs in self.__in_flight.values() for future, _, _ in device_jobs]
+        _, not_done = wait(futures, timeout=timeout)
+        return len(not_done)
+
+    def discard(self):
+        """ Drops the collected commands that were not sent yet, the jobs already running are left to complete."""
+        with self.__lock:
+            discarded = sum(len(commands) for commands in self.__queued.values())
+            self.__queued = {}
+        return discarded
+
+    def shutdown(self):
+        """ Stops the workers once the running jobs are done."""
+        self.executor.shutdown(wait=True)
+        self.priority_executor.shutdown(wait=True)
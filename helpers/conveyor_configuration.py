@@ -1,16 +1,34 @@
 
-from conveyor_types.system import SystemState
-from conveyor_types.simple import SimpleConveyor
-from conveyor_types.infeed import InfeedConveyor
-from conveyor_types.accumulating import AccumulatingConveyor
-from conveyor_types.double_pick_infeed import DoublePickInfeedConveyor
-from conveyor_types.follower import FollowerConveyor
-from conveyor_types.queueing import QueueingConveyor
-from conveyor_types.transfer import TransferConveyor
-from conveyor_types.custom import CustomConveyor
-from conveyor_types.definitions.conveyor_definitions import *
+import importlib
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
+
+from conveyor_types.system import SystemState
+from conveyor_types.definitions.conveyor_definitions import *
+
+# Module and class of every conveyor type, a module is only imported once the configuration uses it
+CONVEYOR_TYPES = {
+    "SimpleConveyor": ("conveyor_types.simple", "SimpleConveyor"),
+    "InfeedConveyor": ("conveyor_types.infeed", "InfeedConveyor"),
+    "AccumulatingConveyor": ("conveyor_types.accumulating", "AccumulatingConveyor"),
+    "ZoneAccumulatingConveyor": ("conveyor_types.zone_accumulating", "ZoneAccumulatingConveyor"),
+    "DoublePickInfeedConveyor": ("conveyor_types.double_pick_infeed", "DoublePickInfeedConveyor"),
+    "FollowerConveyor": ("conveyor_types.follower", "FollowerConveyor"),
+    "QueueingConveyor": ("conveyor_types.queueing", "QueueingConveyor"),
+    "TransferConveyor": ("conveyor_types.transfer", "TransferConveyor"),
+    "CustomConveyor": ("conveyor_types.custom", "CustomConveyor"),
+}
+
+# Conveyor types the following Follower, Queueing and Transfer conveyors are attached to
+PARENT_CONVEYOR_TYPES = ("SimpleConveyor", "InfeedConveyor", "AccumulatingConveyor",
+                         "ZoneAccumulatingConveyor", "DoublePickInfeedConveyor")
+CHILD_CONVEYOR_TYPES = ("FollowerConveyor", "QueueingConveyor", "TransferConveyor")
+
+# Number of conveyors resolving their devices at the same time, 1 builds them one after the other
+CONFIGURATION_WORKERS = 4
+
+_conveyor_classes = {}
 
 
 def get_conveyor_config():
@@ -21,44 +39,70 @@ def get_conveyor_config():
     return configuration_data
 
 
-def configure_conveyors(configuration_data, system, robot_is_picking):
-    parent = None
-    conveyors = []
+def load_conveyor_class(conveyor_type: str):
+    """ Imports the class of a conveyor type the first time it is used, None for an unknown type."""
+    if conveyor_type not in _conveyor_classes:
+        if conveyor_type not in CONVEYOR_TYPES:
+            return None
+        module_name, class_name = CONVEYOR_TYPES[conveyor_type]
+        _conveyor_classes[conveyor_type] = getattr(importlib.import_module(module_name), class_name)
+    return _conveyor_classes[conveyor_type]
+
+
+def build_conveyor(conveyor_type, system, robot_is_picking, robot_handshake, parent, index, conveyor_config):
+    """ Builds one conveyor, its devices are resolved by its constructor."""
+    conveyor_class = load_conveyor_class(conveyor_type)
+    if conveyor_type in ("InfeedConveyor", "AccumulatingConveyor", "ZoneAccumulatingConveyor"):
+        return conveyor_class(system, robot_is_picking, index, robot_handshake, **conveyor_config)
+    elif conveyor_type == "SimpleConveyor":
+        return conveyor_class(system, index, **conveyor_config)
+    elif conveyor_type in CHILD_CONVEYOR_TYPES:
+        return conveyor_class(system, parent, index, **conveyor_config)
+    elif conveyor_type in ("DoublePickInfeedConveyor", "CustomConveyor"):
+        return conveyor_class(system, robot_is_picking, index, **conveyor_config)
+
+
+def configure_conveyors(configuration_data, system, robot_is_picking, robot_handshake=None,
+                        max_workers=CONFIGURATION_WORKERS, robot_cells=None):
+    """
+    Builds the conveyors of a configuration, in the order of the configuration.
+    Only the conveyor types used by the configuration are imported. The conveyors resolve their devices
+    in parallel, first the conveyors others are attached to, then the Follower, Queueing and Transfer
+    conveyors once their parent exists.
+    With robot_cells, a conveyor with a ROBOT_CELL in its configuration gets the pick signals of that cell,
+    the others get robot_is_picking and robot_handshake.
+    """
+    planned = []
+    parent_position = None
     index = 1
     for key, conveyor_config in configuration_data[LIST_OF_ALL_CONVEYORS].items():
         print(conveyor_config)
 
         conveyor_type = conveyor_config[TYPE]
-
-        if conveyor_type == "SimpleConveyor":
-            simple_conveyor = SimpleConveyor(system, index, **conveyor_config)
-            parent = simple_conveyor
-            conveyors.append(simple_conveyor)
-        elif conveyor_type == "InfeedConveyor":
-            infeed_conveyor = InfeedConveyor(system, robot_is_picking, index, **conveyor_config)
-            parent = infeed_conveyor
-            conveyors.append(infeed_conveyor)
-        elif conveyor_type == "AccumulatingConveyor":
-            accumulating_conveyor = AccumulatingConveyor(system, robot_is_picking, index, **conveyor_config)
-            parent = accumulating_conveyor
-            conveyors.append(accumulating_conveyor)
-        elif conveyor_type == "DoublePickInfeedConveyor":
-            double_pick_infeed_conveyor = DoublePickInfeedConveyor(system, index, **conveyor_config)
-            parent = double_pick_infeed_conveyor
-            conveyors.append(double_pick_infeed_conveyor)
-        elif conveyor_type == "FollowerConveyor":
-            follower_conveyor = FollowerConveyor(system, parent, index, **conveyor_config)
-            conveyors.append(follower_conveyor)
-        elif conveyor_type == "QueueingConveyor":
-            queueing_conveyor = QueueingConveyor(system, parent, index, **conveyor_config)
-            conveyors.append(queueing_conveyor)
-        elif conveyor_type == "TransferConveyor":
-            transfer_conveyor = TransferConveyor(system, parent, index, **conveyor_config)
-            conveyors.append(transfer_conveyor)
-        elif conveyor_type == "CustomConveyor":
-            custom_conveyor = CustomConveyor(system, robot_is_picking, index, **conveyor_config)
-            conveyors.append(custom_conveyor)
+        if load_conveyor_class(conveyor_type) is not None:
+            cell_name = conveyor_config.get(ROBOT_CELL)
+            if robot_cells is not None and cell_name:
+                cell = robot_cells.cell(cell_name)
+                signals = (cell.robot_is_picking, cell.robot_handshake)
+            else:
+                signals = (robot_is_picking, robot_handshake)
+            planned.append((conveyor_type, index, conveyor_config, parent_position, signals))
+            if conveyor_type in PARENT_CONVEYOR_TYPES:
+                parent_position = len(planned) - 1
         index = index + 1
+
+    conveyors = [None] * len(planned)
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='conveyor-configure') as executor:
+        for children in (False, True):
+            futures = {}
+            for position, (conveyor_type, index, conveyor_config, parent_position, signals) in enumerate(planned):
+                if (conveyor_type in CHILD_CONVEYOR_TYPES) != children:
+                    continue
+                parent = conveyors[parent_position] if parent_position is not None else None
+                futures[position] = executor.submit(build_conveyor, conveyor_type, system, signals[0], signals[1],
+                                                    parent, index, conveyor_config)
+            for position, future in futures.items():
+                conveyors[position] = future.result()
     return conveyors
 
 
@@ -0,0 +1,153 @@
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+
+from helpers.command_dispatcher import DispatchedDevice
+from helpers.metrics import Histogram
+
+ESTOP_REACTION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+
+
+def raw_device(device):
+    """ The machine object behind a DispatchedDevice, the fast path does not wait for the next flush."""
+    return device.device if isinstance(device, DispatchedDevice) else device
+
+
+class StopCall:
+    """
+    StopCall is one stop or idle call of the fast path, with the time it was issued and the time it returned.
+    """
+
+    __slots__ = ('name', 'call', 'issued_time', 'completed_time', 'error')
+
+    def __init__(self, name: str, call):
+        self.name = name
+        self.call = call
+        self.issued_time = None
+        self.completed_time = None
+        self.error = None
+
+    def run(self):
+        self.issued_time = time.perf_counter()
+        try:
+            self.call()
+        except Exception as e:
+            self.error = e
+        self.completed_time = time.perf_counter()
+
+
+class EstopFastPath:
+    """
+    EstopFastPath stops the line from the estop callback instead of waiting for the conveyors to see the estop
+    on their next run(). When the estop triggers, every actuator is stopped and every pneumatic idled at once
+    on a pool of workers, without going through the CommandDispatcher, and the control loop is marked faulted:
+    ControlAllConveyor keeps every conveyor in INIT and drops the commands of the tick until the estop is released.
+    The CommandDispatcher reads faulted under lock while sending a tick, so once trigger marked the line faulted
+    no command is sent anymore. The jobs sent just before may still reach the devices after the stop calls,
+    ControlAllConveyor waits for them and stops the devices again on its first faulted tick.
+    The reaction time is measured from the estop message to the last stop command issued. It is kept in
+    last_reaction_time and reaction_time for the metrics and only logged, the estop callback never writes to stdout.
+    Attributes:
+        faulted: A boolean, True from the estop until it is released.
+        lock: The lock faulted is changed under, shared with the CommandDispatcher.
+        timeout: A float, time in seconds trigger waits for the stop calls to return before reporting.
+        trips: An int, number of times the estop triggered the fast path.
+        failures: An int, number of stop calls that raised an exception.
+        last_reaction_time: A float, time in seconds from the last estop message to the last stop command issued.
+        last_completion_time: A float, time in seconds from the last estop message to the last stop call returning,
+            None when a call had not returned within timeout.
+        reaction_time: A Histogram of the reaction times.
+    Methods:
+        configure: Builds the stop calls of the actuators and pneumatics of the conveyors.
+        trigger: Stops the line and marks the control loop faulted, called from the estop callback.
+        release: Clears the fault once the estop is released.
+        stop_devices: Issues every stop call concurrently.
+        report: A dictionary of the reaction times.
+    """
+
+    def __init__(self, system_state=None, max_workers=16, timeout=0.5):
+        self.timeout = timeout
+        self.faulted = False
+        self.trips = 0
+        self.failures = 0
+        self.last_reaction_time = None
+        self.last_completion_time = None
+        self.reaction_time = Histogram(ESTOP_REACTION_BUCKETS)
+        self.calls = []
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='conveyor-estop')
+        self.lock = threading.Lock()
+        if system_state is not None:
+            system_state.estop_fast_path = self
+
+    def configure(self, list_of_conveyors: list):
+        """ Builds one stop call per actuator and one idle call per pneumatic, a device shared by two is stopped once."""
+        calls = {}
+        for conveyor in list_of_conveyors:
+            actuators = [(conveyor.actuator, conveyor.actuator_is_vfd)]
+            actuators += [(zone.actuator, zone.actuator_is_vfd) for zone in getattr(conveyor, 'zones', ())]
+            for actuator, is_vfd in actuators:
+                device = raw_device(actuator)
+                if device is not None and id(device) not in calls:
+                    stop = device.stop if is_vfd else partial(device.stop, conveyor.actuator_deceleration)
+                    calls[id(device)] = (f"conveyor {conveyor.index} stop", stop)
+            for pneumatic in (conveyor.pusher, conveyor.stopper):
+                device = raw_device(pneumatic)
+                if device is not None and id(device) not in calls:
+                    calls[id(device)] = (f"conveyor {conveyor.index} idle", device.idle_async)
+        self.calls = list(calls.values())
+
+    def stop_devices(self):
+        """ Issues every stop call on the workers at once, returns the StopCall and the future of each."""
+        stop_calls = [StopCall(name, call) for name, call in self.calls]
+        return stop_calls, [self.executor.submit(stop_call.run) for stop_call in stop_calls]
+
+    def trigger(self, received=None):
+        """
+        Stops every actuator and idles every pneumatic concurrently and marks the control loop faulted.
+
+        Parameters
+        ----------
+        received : float, optional
+            time.perf_counter() when the estop message was received, defaults to now
+        """
+        received = time.perf_counter() if received is None else received
+        with self.lock:
+            first = not self.faulted
+            self.faulted = True
+        stop_calls, futures = self.stop_devices()
+        if not first:
+            return
+        wait(futures, timeout=self.timeout)
+
+        issued = [stop_call.issued_time for stop_call in stop_calls if stop_call.issued_time is not None]
+        completed = [stop_call.completed_time for stop_call in stop_calls]
+        self.trips += 1
+        self.last_reaction_time = max(issued) - received if issued else 0.0
+        if None in completed:
+            self.last_completion_time = None
+        else:
+            self.last_completion_time = max(completed) - received if completed else 0.0
+        self.reaction_time.observe(self.last_reaction_time)
+        for stop_call in stop_calls:
+            if stop_call.error is not None:
+                self.failures += 1
+                logging.error(f"Estop {stop_call.name} failed: {stop_call.error}")
+        logging.info(f"Estop: {len(stop_calls)} stop commands issued in {self.last_reaction_time * 1000:.1f} ms")
+
+    def release(self):
+        """ Clears the fault, the conveyors start over from INIT on the next tick."""
+        with self.lock:
+            self.faulted = False
+
+    def report(self):
+        return {
+            "faulted": self.faulted,
+            "trips": self.trips,
+            "failures": self.failures,
+            "devices": len(self.calls),
+            "lastReaction_sec": self.last_reaction_time,
+            "lastCompletion_sec": self.last_completion_time,
+        }
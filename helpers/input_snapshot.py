@@ -0,0 +1,63 @@
+
+class InputSnapshot:
+    """
+    InputSnapshot reads every distinct input of the line once per tick and gives all the conveyors
+    the same values for the rest of the tick. Inputs are read grouped by io-expander device, and
+    two conveyors configured on the same device and port share one read.
+    Reading an input that was not collected falls back to a live read.
+    Attributes:
+        inputs_by_device: A dictionary of {(device, port): input} by device.
+        keys: A dictionary of the (device, port) key of every collected input object, by id.
+        values: A dictionary of the values read by refresh, by (device, port) key.
+        read_count: An int, number of input reads done by the last refresh.
+    Methods:
+        configure: Collects the inputs of a list of conveyors.
+        refresh: Reads every collected input once, meant to be called at the start of each tick.
+        read: The value of an input for the current tick.
+    """
+
+    def __init__(self):
+        self.inputs_by_device = {}
+        self.keys = {}
+        self.values = {}
+        self.read_count = 0
+
+    @staticmethod
+    def input_key(sensor):
+        """ The (device, port) key of an input, the object itself when it has no configuration."""
+        configuration = getattr(sensor, 'configuration', None)
+        device = getattr(configuration, 'device', None)
+        port = getattr(configuration, 'port', None)
+        if device is None or port is None:
+            return id(sensor)
+        return device, port
+
+    def configure(self, list_of_conveyors: list):
+        """ Collects the inputs used by a list of conveyors, grouped by device."""
+        inputs_by_device = {}
+        keys = {}
+        for conveyor in list_of_conveyors:
+            for sensor in conveyor.inputs():
+                key = self.input_key(sensor)
+                device = key[0] if isinstance(key, tuple) else None
+                inputs_by_device.setdefault(device, {}).setdefault(key, sensor)
+                keys[id(sensor)] = key
+        self.inputs_by_device = inputs_by_device
+        self.keys = keys
+        self.values = {}
+
+    def refresh(self):
+        """ Reads every collected input once, the new values replace the previous ones at once."""
+        values = {}
+        for inputs in self.inputs_by_device.values():
+            for key, sensor in inputs.items():
+                values[key] = sensor.state.value
+        self.read_count = len(values)
+        self.values = values
+
+    def read(self, sensor):
+        """ The value of an input for the current tick, read live if it was not collected."""
+        key = self.keys.get(id(sensor))
+        if key is None or key not in self.values:
+            return sensor.state.value
+        return self.values[key]
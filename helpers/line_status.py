@@ -0,0 +1,69 @@
+
+from enum import Enum
+
+
+class LineStatus(Enum):
+    """
+    LineStatus is an enum that is used to label what is holding a conveyor back.
+        WORKING: The conveyor is moving a box, or pushing one.
+        STARVED: The belt runs but no box is on its sensor, it waits for boxes from upstream.
+        BLOCKED: The conveyor holds a box, it waits on the robot or on the conveyor downstream.
+        FAULTED: The conveyor is in INIT, after an estop, drives not ready or a watchdog recovery.
+        UNKNOWN: The belt runs but the conveyor has no box sensor, it cannot tell if it carries boxes.
+    """
+    WORKING = 0
+    STARVED = 1
+    BLOCKED = 2
+    FAULTED = 3
+    UNKNOWN = 4
+
+
+# Status of each ConveyorState name, RUNNING depends on the box sensor and is UNKNOWN without one,
+# PACING is only WORKING while the pacing timer runs
+STATE_STATUS = {
+    'INIT': LineStatus.FAULTED,
+    'STOPPING': LineStatus.BLOCKED,
+    'PUSHING': LineStatus.WORKING,
+    'RETRACT': LineStatus.WORKING,
+    'WAITING_FOR_PICK': LineStatus.BLOCKED,
+    'STARTUP': LineStatus.WORKING,
+    'PACING': LineStatus.WORKING,
+    'QUEUEING': LineStatus.BLOCKED,
+    'WAITING': LineStatus.BLOCKED,
+}
+
+
+def classify_state(state_name: str, box_present=None, pacing=True):
+    """
+    The LineStatus of a conveyor from the name of its state and its box sensor.
+
+    Parameters
+    ----------
+    state_name : str
+        Name of the ConveyorState of the conveyor
+    box_present : bool, optional
+        Logic corrected box sensor value, None when the conveyor has no box sensor
+    pacing : bool, optional
+        False when the conveyor is in PACING but its pacing timer does not run
+
+    Returns
+    ----------
+    LineStatus
+        RUNNING is STARVED while the box sensor is clear, WORKING while it is covered and UNKNOWN without one,
+        PACING is BLOCKED when its pacing timer does not run, nothing ends it
+    """
+    if state_name == 'RUNNING':
+        if box_present is None:
+            return LineStatus.UNKNOWN
+        return LineStatus.WORKING if box_present else LineStatus.STARVED
+    if state_name == 'PACING' and not pacing:
+        return LineStatus.BLOCKED
+    return STATE_STATUS.get(state_name, LineStatus.WORKING)
+
+
+def is_active(state_name: str, status: LineStatus):
+    """
+    True when the conveyor is working or holding a box for the robot, which is the robot working on it.
+    A running belt without a box sensor is not active, as nothing tells it carries a box.
+    """
+    return status == LineStatus.WORKING or state_name == 'WAITING_FOR_PICK'
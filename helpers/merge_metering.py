@@ -0,0 +1,114 @@
+
+import time
+from collections import deque
+
+
+class MergeMeter:
+    """
+    MergeMeter predicts the gaps between boxes on a main line so a TransferConveyor can time
+    its push into them instead of pushing whenever the main line is running.
+    It watches the box sensor of the main line (the transfer's parent). A box seen on that
+    sensor reaches the merge point merge_offset seconds later, which comes from the distance
+    between the sensor and the merge point and the speed of the main line.
+    The merge point is free for a push when the tail of the last box has passed it and the front
+    of the next box will not reach it for at least minimum_gap seconds. The next box is at least
+    merge_offset away while the sensor is clear, and is predicted from the average headway
+    between the boxes seen so far.
+    Attributes:
+        minimum_gap: A float, time in seconds the merge point must stay free to fit a push.
+        merge_offset: A float, time in seconds for a box to go from the main line sensor to the merge point.
+        headways: A deque of the last times between two boxes on the main line.
+        last_front_time: time.perf_counter() when the last box front reached the main line sensor.
+        last_tail_time: time.perf_counter() when the last box tail left the main line sensor.
+        gaps_used: An int, number of pushes made into a predicted gap.
+        gaps_missed: An int, number of main line gaps that went by while a box was waiting but were too short.
+    Methods:
+        observe: Feed the main line sensor, meant to be called once per run().
+        gap_available: True if a push now fits in the predicted gap.
+        record_push: Count a push into a gap.
+        report: A dictionary with the counters and the measured main line timing.
+    """
+
+    def __init__(self, minimum_gap: float, merge_offset=0.0, window=20):
+        self.minimum_gap = minimum_gap
+        self.merge_offset = merge_offset
+        self.headways = deque(maxlen=window)
+        self.last_front_time = None
+        self.last_tail_time = None
+        self.gaps_used = 0
+        self.gaps_missed = 0
+        self.main_line_box_present = False
+        self.__waiting_since_gap_opened = False
+
+    def observe(self, main_line_box_present: bool, box_waiting: bool, now=None):
+        """
+        Feed the main line sensor.
+
+        Parameters
+        ----------
+        main_line_box_present : bool
+            Current (logic corrected) value of the main line box sensor
+        box_waiting : bool
+            True while the transfer has a box ready to push
+        now : float, optional
+            Time stamp to use, defaults to time.perf_counter()
+
+        Returns
+        ----------
+        bool
+            True when a counter changed
+        """
+        now = time.perf_counter() if now is None else now
+        changed = False
+        if main_line_box_present and not self.main_line_box_present:
+            if self.last_front_time is not None:
+                self.headways.append(now - self.last_front_time)
+            self.last_front_time = now
+            if self.__waiting_since_gap_opened and box_waiting:
+                # The gap closed while a box was waiting, it was too short to be used
+                self.gaps_missed += 1
+                changed = True
+            self.__waiting_since_gap_opened = False
+        elif not main_line_box_present and self.main_line_box_present:
+            self.last_tail_time = now
+            self.__waiting_since_gap_opened = box_waiting
+        elif not main_line_box_present and box_waiting and self.last_tail_time is not None:
+            self.__waiting_since_gap_opened = True
+        self.main_line_box_present = main_line_box_present
+        return changed
+
+    def average_headway(self):
+        """ Average time between two boxes on the main line, None until two boxes were seen."""
+        if not self.headways:
+            return None
+        return sum(self.headways) / len(self.headways)
+
+    def gap_available(self, now=None):
+        """ True if the merge point is free now and stays free for at least minimum_gap seconds."""
+        now = time.perf_counter() if now is None else now
+        if self.main_line_box_present:
+            return False
+        if self.last_tail_time is not None and now < self.last_tail_time + self.merge_offset:
+            # The last box has not passed the merge point yet
+            return False
+        if self.merge_offset >= self.minimum_gap:
+            return True
+        headway = self.average_headway()
+        if headway is None or self.last_front_time is None:
+            return False
+        next_front_at_merge = self.last_front_time + headway + self.merge_offset
+        return next_front_at_merge - now >= self.minimum_gap
+
+    def record_push(self):
+        """ Count a push into a gap, the current gap is now taken."""
+        self.gaps_used += 1
+        self.__waiting_since_gap_opened = False
+
+    def report(self):
+        """ The gap counters and the measured main line timing."""
+        return {
+            "gapsUsed": self.gaps_used,
+            "gapsMissed": self.gaps_missed,
+            "averageHeadway_sec": self.average_headway(),
+            "minimumGap_sec": self.minimum_gap,
+        }
@@ -0,0 +1,234 @@
+
+import logging
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Environment variable holding the port of the metrics endpoint, the endpoint is not started when it is not set
+METRICS_PORT_ENV = "CONVEYOR_METRICS_PORT"
+METRICS_HOST = "127.0.0.1"
+
+TICK_PERIOD = 0.1
+TICK_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.25, 0.5, 1.0)
+COMMAND_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+RESTART_BUCKETS = (0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+
+
+def format_labels(labels: dict):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+
+class Histogram:
+    """
+    Histogram is a fixed bucket histogram, observing a value is a bisect and three additions.
+    Attributes:
+        buckets: A tuple of the upper bounds of the buckets, in increasing order.
+        counts: A list of the number of values in each bucket, the last one is above every bound.
+        sum: The sum of the observed values.
+        count: The number of observed values.
+    """
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name: str):
+        """ The lines of the histogram in the Prometheus text format."""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum {self.sum}')
+        lines.append(f'{name}_count {self.count}')
+        return lines
+
+
+class LineMetrics:
+    """
+    LineMetrics collects the metrics of the conveyor loop and serves them in the Prometheus text format
+    on an optional http endpoint bound to localhost.
+    The control loop only adds to counters and histograms. Everything that already exists elsewhere, such as
+    the states of the conveyors from the last snapshot of the StateStore, the box counts of the BoxTracker, the command counters of the CommandDispatcher
+    and the MQTT publish count of the SystemState, is read when the endpoint is scraped.
+    Attributes:
+        tick_duration: A Histogram of the time in seconds run_all took.
+        tick_overruns: An int, number of ticks that took longer than the tick period.
+        command_latency: A Histogram of the latencies of the commands sent by the CommandDispatcher.
+        restart_duration: A Histogram of the time in seconds a restart on a new configuration took.
+        state_seconds: A dictionary of the time in seconds spent in each state by (conveyor index, state name).
+        conveyor_states: A dictionary of (state name, time entered) by conveyor index.
+    Methods:
+        configure: Takes the conveyors and helpers of a new configuration.
+        observe_tick: Records the duration of one tick.
+        observe_conveyor: Records a change of state of a conveyor, meant to be called after its run().
+        observe_command_latencies: Records the latencies of the commands completed at a flush.
+        observe_restart: Records the duration of a restart.
+        render: The metrics in the Prometheus text format.
+        serve: Starts the http endpoint.
+    """
+
+    def __init__(self, system_state=None, tick_period=TICK_PERIOD):
+        self.system_state = system_state
+        self.tick_period = tick_period
+        self.tick_duration = Histogram(TICK_BUCKETS)
+        self.tick_overruns = 0
+        self.command_latency = Histogram(COMMAND_LATENCY_BUCKETS)
+        self.restart_duration = Histogram(RESTART_BUCKETS)
+        self.state_seconds = {}
+        self.conveyor_states = {}
+        self.list_of_conveyors = []
+        self.box_tracker = None
+        self.command_dispatcher = None
+        self.state_store = None
+        self.server = None
+
+    def configure(self, list_of_conveyors: list, box_tracker=None, command_dispatcher=None, state_store=None):
+        """ Takes the conveyors and helpers of a new configuration, the accumulated times are kept."""
+        self.list_of_conveyors = list_of_conveyors
+        self.box_tracker = box_tracker
+        self.command_dispatcher = command_dispatcher
+        self.state_store = state_store
+        self.conveyor_states = {}
+
+    def observe_tick(self, duration: float):
+        self.tick_duration.observe(duration)
+        if duration > self.tick_period:
+            self.tick_overruns += 1
+
+    def observe_conveyor(self, conveyor, now=None):
+        """ Adds the time spent in the previous state when the state of the conveyor changed."""
+        current = self.conveyor_states.get(conveyor.index)
+        state = conveyor.conveyor_state.name
+        if current is not None and current[0] == state:
+            return
+        now = time.perf_counter() if now is None else now
+        if current is not None:
+            key = (conveyor.index, current[0])
+            self.state_seconds[key] = self.state_seconds.get(key, 0.0) + now - current[1]
+        self.conveyor_states[conveyor.index] = (state, now)
+
+    def observe_command_latencies(self, latencies: list):
+        for latency in latencies:
+            if latency is not None:
+                self.command_latency.observe(latency)
+
+    def observe_restart(self, duration: float):
+        self.restart_duration.observe(duration)
+
+    def render(self, now=None):
+        """ The metrics in the Prometheus text format."""
+        now = time.perf_counter() if now is None else now
+        lines = [
+            '# HELP conveyor_tick_duration_seconds Time taken by one run of all the conveyors.',
+            '# TYPE conveyor_tick_duration_seconds histogram',
+        ]
+        lines += self.tick_duration.lines('conveyor_tick_duration_seconds')
+        lines += [
+            '# HELP conveyor_tick_overruns_total Ticks that took longer than the tick period.',
+            '# TYPE conveyor_tick_overruns_total counter',
+            f'conveyor_tick_overruns_total {self.tick_overruns}',
+        ]
+
+        if self.state_store is not None:
+            conveyors = [(conveyor.index, conveyor.type, conveyor.state)
+                         for conveyor in self.state_store.current.conveyors.values()]
+        else:
+            conveyors = [(conveyor.index, type(conveyor).__name__, conveyor.conveyor_state.name)
+                         for conveyor in list(self.list_of_conveyors)]
+        lines += ['# HELP conveyor_state Current state of each conveyor, 1 for the current state.',
+                  '# TYPE conveyor_state gauge']
+        for index, conveyor_type, state in conveyors:
+            labels = format_labels({"conveyor": index, "type": conveyor_type, "state": state})
+            lines.append(f'conveyor_state{labels} 1')
+
+        state_seconds = dict(self.state_seconds)
+        for index, (state, since) in list(self.conveyor_states.items()):
+            state_seconds[(index, state)] = state_seconds.get((index, state), 0.0) + now - since
+        lines += ['# HELP conveyor_state_seconds_total Time spent by each conveyor in each state.',
+                  '# TYPE conveyor_state_seconds_total counter']
+        for (index, state), seconds in sorted(state_seconds.items()):
+            lines.append(f'conveyor_state_seconds_total{format_labels({"conveyor": index, "state": state})} {seconds}')
+
+        if self.box_tracker is not None:
+            lines += ['# HELP conveyor_boxes_total Boxes that left each conveyor.',
+                      '# TYPE conveyor_boxes_total counter']
+            for index, tracked in sorted(list(self.box_tracker.conveyors.items())):
+                lines.append(f'conveyor_boxes_total{format_labels({"conveyor": index})} {tracked.box_count}')
+            lines += ['# HELP conveyor_line_boxes_total Boxes that left the line.',
+                      '# TYPE conveyor_line_boxes_total counter',
+                      f'conveyor_line_boxes_total {self.box_tracker.line_box_count}']
+
+        if self.command_dispatcher is not None:
+            lines += [
+                '# HELP conveyor_commands_sent_total Actuator and pneumatic commands sent.',
+                '# TYPE conveyor_commands_sent_total counter',
+                f'conveyor_commands_sent_total {self.command_dispatcher.commands_sent}',
+                '# HELP conveyor_commands_failed_total Actuator and pneumatic commands that failed.',
+                '# TYPE conveyor_commands_failed_total counter',
+                f'conveyor_commands_failed_total {self.command_dispatcher.commands_failed}',
+                '# HELP conveyor_commands_timed_out_total Command jobs still running when a flush returned.',
+                '# TYPE conveyor_commands_timed_out_total counter',
+                f'conveyor_commands_timed_out_total {self.command_dispatcher.commands_timed_out}',
+                '# HELP conveyor_commands_hung_total Commands that ran longer than the command timeout.',
+                '# TYPE conveyor_commands_hung_total counter',
+                f'conveyor_commands_hung_total {self.command_dispatcher.commands_hung}',
+            ]
+        lines += ['# HELP conveyor_command_latency_seconds Time from a command being issued to the call returning.',
+                  '# TYPE conveyor_command_latency_seconds histogram']
+        lines += self.command_latency.lines('conveyor_command_latency_seconds')
+
+        if self.system_state is not None:
+            lines += ['# HELP conveyor_mqtt_publish_total MQTT messages published.',
+                      '# TYPE conveyor_mqtt_publish_total counter',
+                      f'conveyor_mqtt_publish_total {self.system_state.mqtt_publish_count}']
+            estop_fast_path = getattr(self.system_state, 'estop_fast_path', None)
+            if estop_fast_path is not None:
+                lines += ['# HELP conveyor_estop_trips_total Estops handled by the estop fast path.',
+                          '# TYPE conveyor_estop_trips_total counter',
+                          f'conveyor_estop_trips_total {estop_fast_path.trips}',
+                          '# HELP conveyor_estop_reaction_seconds Time from the estop message to the last stop '
+                          'command issued.',
+                          '# TYPE conveyor_estop_reaction_seconds histogram']
+                lines += estop_fast_path.reaction_time.lines('conveyor_estop_reaction_seconds')
+
+        lines += ['# HELP conveyor_restart_duration_seconds Time taken by a restart on a new configuration.',
+                  '# TYPE conveyor_restart_duration_seconds histogram']
+        lines += self.restart_duration.lines('conveyor_restart_duration_seconds')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port: int, host=METRICS_HOST):
+        """ Starts the http endpoint in a daemon thread, the metrics are served on any path."""
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        except OSError as e:
+            logging.error(f"Metrics endpoint could not be started on {host}:{port}: {e}")
+            return None
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='conveyor-metrics', daemon=True).start()
+        return self.server
@@ -0,0 +1,276 @@
+
+import time
+from collections import deque
+
+from helpers.timer_helper import Timer
+
+# Fraction of the configured value a timer is never suggested below, when no minimum is configured for it
+DEFAULT_MINIMUM_FRACTION = 0.5
+
+
+def percentile(samples, fraction):
+    """
+    Nearest-rank percentile of a list of samples.
+
+    Parameters
+    ----------
+    samples : iterable of float
+        Samples to look at, does not need to be sorted
+    fraction : float
+        Percentile as a fraction between 0.0 and 1.0
+
+    Returns
+    ----------
+    float
+        The sample at the requested rank, None if there are no samples
+    """
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    rank = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[rank]
+
+
+def mean(samples):
+    """ Average of a list of samples, None if there are no samples """
+    samples = list(samples)
+    if not samples:
+        return None
+    return sum(samples) / len(samples)
+
+
+class PickCycleTuner:
+    """
+    PickCycleTuner watches the robot_is_picking edges and the box sensor edges of a
+    conveyor that presents boxes to a robot and builds a model of the robot's pick cycle.
+    From that model it suggests the smallest restartTime and accumulationTime that were
+    safe for every observed cycle (plus a safety margin) and, if allowed, applies them
+    to the conveyor's timers. By default it only suggests.
+
+    The restart timer also covers the robot arm clearing the belt, which neither signal can see:
+    the box usually leaves while the robot is still picking, so the clear lags are mostly 0.0.
+    The accumulation timer is only checked against the transients seen so far.
+    Both timers therefore have a floor: the configured minimum of the timer when it is not zero,
+    otherwise minimum_fraction of its configured value.
+
+    The model uses these measurements, all kept over a rolling window of cycles:
+        pick cycle: time between two robot_is_picking rising edges.
+        clear lag: time between robot_is_picking falling and the box sensor being clear.
+            This is how long the pick zone stays occupied after the robot reports it is done,
+            the restart timer must cover it.
+        box wait: time between a box reaching the box sensor and the next pick starting.
+            When it is short the robot was waiting on the conveyor, so any time saved on the
+            restart timer is time saved on the pick cycle.
+        transient accumulation: how long the box and accumulation sensors were both
+            covered while the belt kept running. The accumulation timer must be longer
+            than these or the conveyor stops with gaps still in the queue.
+
+    Attributes:
+        restart_timer: The Timer used by the conveyor before restarting after a pick.
+        accumulation_timer: The Timer used by the conveyor to detect a full queue, or None.
+        apply: A boolean, when True the suggested values are written to the timers.
+        safety_margin: A float, fraction added on top of the worst observed value.
+        minimum_samples: An int, number of pick cycles needed before suggesting anything.
+        minimum_restart_time: A float, restartTime is never suggested below this value, None or 0.0 to use
+            minimum_fraction of the configured restartTime.
+        minimum_accumulation_time: A float, accumulationTime is never suggested below this value, None or 0.0 to
+            use minimum_fraction of the configured accumulationTime.
+        minimum_fraction: A float, fraction of the configured value a timer without a minimum is never suggested
+            below.
+        starved_threshold: A float, box wait below this means the robot was waiting for the box.
+    Methods:
+        observe: Feed the current signal values, returns True when a new report is ready.
+        suggested_restart_time: The smallest safe restartTime, None until enough samples.
+        suggested_accumulation_time: The smallest safe accumulationTime, None if unknown.
+        report: A dictionary describing the model, the suggestions and the expected gain.
+    """
+
+    def __init__(self, restart_timer: Timer, accumulation_timer: Timer = None, apply=False,
+                 safety_margin=0.2, minimum_samples=10, minimum_restart_time=None,
+                 minimum_accumulation_time=None, minimum_fraction=DEFAULT_MINIMUM_FRACTION,
+                 starved_threshold=0.5, window=50):
+        self.restart_timer = restart_timer
+        self.accumulation_timer = accumulation_timer
+        self.apply = apply
+        self.safety_margin = safety_margin
+        self.minimum_samples = minimum_samples
+        self.minimum_restart_time = minimum_restart_time
+        self.minimum_accumulation_time = minimum_accumulation_time
+        self.minimum_fraction = minimum_fraction
+        self.starved_threshold = starved_threshold
+        self.original_restart_time = restart_timer.delay
+        self.original_accumulation_time = accumulation_timer.delay if accumulation_timer else None
+        self.pick_cycles = deque(maxlen=window)
+        self.pick_durations = deque(maxlen=window)
+        self.clear_lags = deque(maxlen=window)
+        self.box_waits = deque(maxlen=window)
+        self.transient_accumulations = deque(maxlen=window)
+        self.applied = False
+        self.__robot_was_picking = False
+        self.__box_was_present = False
+        self.__pick_start_time = None
+        self.__pick_end_time = None
+        self.__box_arrival_time = None
+        self.__both_covered_since = None
+
+    def observe(self, robot_is_picking: bool, box_present: bool, accumulation_present=None,
+                belt_running=False, now=None):
+        """
+        Feed the current value of the signals to the model. Meant to be called once per run().
+
+        Parameters
+        ----------
+        robot_is_picking : bool
+            Current value of the robot_is_picking signal
+        box_present : bool
+            Current (logic corrected) value of the box sensor
+        accumulation_present : bool, optional
+            Current (logic corrected) value of the accumulation sensor, None if there is none
+        belt_running : bool, optional
+            True while the conveyor is in RUNNING
+        now : float, optional
+            Time stamp to use, defaults to time.perf_counter()
+
+        Returns
+        ----------
+        bool
+            True when a pick cycle was completed and a new report is available
+        """
+        now = time.perf_counter() if now is None else now
+        cycle_completed = False
+
+        if box_present and not self.__box_was_present:
+            self.__box_arrival_time = now
+        if not box_present and self.__pick_end_time is not None:
+            self.clear_lags.append(now - self.__pick_end_time)
+            self.__pick_end_time = None
+
+        if robot_is_picking and not self.__robot_was_picking:
+            if self.__pick_start_time is not None:
+                self.pick_cycles.append(now - self.__pick_start_time)
+                cycle_completed = True
+            if self.__box_arrival_time is not None:
+                self.box_waits.append(now - self.__box_arrival_time)
+                self.__box_arrival_time = None
+            self.__pick_start_time = now
+        elif not robot_is_picking and self.__robot_was_picking:
+            if self.__pick_start_time is not None:
+                self.pick_durations.append(now - self.__pick_start_time)
+            if box_present:
+                self.__pick_end_time = now
+            else:
+                self.clear_lags.append(0.0)
+
+        if accumulation_present is not None:
+            if box_present and accumulation_present:
+                if self.__both_covered_since is None:
+                    self.__both_covered_since = now
+                if not belt_running:
+                    # The queue really was full, this interval tells nothing about the gaps
+                    self.__both_covered_since = None
+            elif self.__both_covered_since is not None:
+                self.transient_accumulations.append(now - self.__both_covered_since)
+                self.__both_covered_since = None
+
+        self.__robot_was_picking = robot_is_picking
+        self.__box_was_present = box_present
+
+        if cycle_completed and self.apply:
+            self.apply_suggestions()
+        return cycle_completed
+
+    def timer_floor(self, minimum, configured):
+        """ The minimum when it is not zero, minimum_fraction of the configured value otherwise """
+        if minimum:
+            return minimum
+        if configured is None:
+            return None
+        return configured * self.minimum_fraction
+
+    def restart_time_floor(self):
+        return self.timer_floor(self.minimum_restart_time, self.original_restart_time)
+
+    def accumulation_time_floor(self):
+        return self.timer_floor(self.minimum_accumulation_time, self.original_accumulation_time)
+
+    def suggested_restart_time(self):
+        """ The smallest restartTime covering every observed clear lag plus the safety margin, not below the floor """
+        floor = self.restart_time_floor()
+        if len(self.pick_cycles) < self.minimum_samples or not self.clear_lags or floor is None:
+            return None
+        worst_lag = max(self.clear_lags)
+        return max(floor, worst_lag * (1.0 + self.safety_margin))
+
+    def suggested_accumulation_time(self):
+        """ The smallest accumulationTime longer than every observed transient plus the margin, not below the floor """
+        floor = self.accumulation_time_floor()
+        if (self.accumulation_timer is None or len(self.pick_cycles) < self.minimum_samples or
+                not self.transient_accumulations or floor is None):
+            return None
+        return max(floor, max(self.transient_accumulations) * (1.0 + self.safety_margin))
+
+    def apply_suggestions(self):
+        """ Write the suggested values to the timers, they take effect on the next start() """
+        restart_time = self.suggested_restart_time()
+        if restart_time is not None:
+            self.restart_timer.set_delay(restart_time)
+            self.applied = True
+        accumulation_time = self.suggested_accumulation_time()
+        if accumulation_time is not None:
+            self.accumulation_timer.set_delay(accumulation_time)
+            self.applied = True
+
+    def starved_ratio(self):
+        """ Fraction of the picks where the robot had to wait for the box """
+        if not self.box_waits:
+            return None
+        starved = [wait for wait in self.box_waits if wait < self.starved_threshold]
+        return len(starved) / len(self.box_waits)
+
+    def report(self):
+        """
+        Build a report of the model.
+        The expected gain assumes every second removed from the restart timer is a second
+        removed from the pick cycle whenever the robot was waiting on the box.
+
+        Returns
+        ----------
+        dict
+            The measured pick cycle, the current and suggested timer values and the
+            expected picks per hour with each of them
+        """
+        average_cycle = mean(self.pick_cycles)
+        current_restart_time = self.original_restart_time
+        suggested_restart_time = self.suggested_restart_time()
+        starved_ratio = self.starved_ratio()
+
+        current_picks_per_hour = None
+        suggested_picks_per_hour = None
+        if average_cycle:
+            current_picks_per_hour = 3600.0 / average_cycle
+            suggested_picks_per_hour = current_picks_per_hour
+            if suggested_restart_time is not None and current_restart_time is not None and starved_ratio:
+                saved_per_cycle = max(0.0, current_restart_time - suggested_restart_time) * starved_ratio
+                suggested_cycle = max(average_cycle - saved_per_cycle, 1e-3)
+                suggested_picks_per_hour = 3600.0 / suggested_cycle
+
+        return {
+            "samples": len(self.pick_cycles),
+            "pickCycle_sec": average_cycle,
+            "pickDuration_sec": mean(self.pick_durations),
+            "clearLag95_sec": percentile(self.clear_lags, 0.95),
+            "robotStarvedRatio": starved_ratio,
+            "restartTime": {
+                "current": current_restart_time,
+                "suggested": suggested_restart_time,
+            },
+            "accumulationTime": {
+                "current": self.original_accumulation_time,
+                "suggested": self.suggested_accumulation_time(),
+            },
+            "picksPerHour": {
+                "current": current_picks_per_hour,
+                "suggested": suggested_picks_per_hour,
+            },
+            "applied": self.applied,
+        }
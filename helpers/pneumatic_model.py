@@ -0,0 +1,150 @@
+
+import logging
+import time
+from collections import deque
+
+PUSHED = "pushed"
+PULLED = "pulled"
+TRANSITION = "transition"
+UNKNOWN = "unknown"
+
+# Stroke time used when the configuration has no extend or retract delay
+DEFAULT_STROKE_TIME = 1.0
+# Fraction of the retract stroke after which an overlapped pusher is clear of the boxes
+DEFAULT_RETRACT_CLEARANCE = 0.5
+
+
+class PneumaticModel:
+    """
+    PneumaticModel stands in for the pneumatic of a pusher or stopper and predicts its position from the time since
+    the last push or pull command, so a cylinder without position sensors still goes through its strokes.
+    A stroke takes the configured extendDelay_sec or retractDelay_sec. Idling the valve keeps the cylinder where
+    it was commanded, a cylinder never commanded is in an unknown position.
+    With sensors, the sensed position is the position and the model measures every stroke, from the command being
+    sent to the sensors reaching the commanded position. Once minimum_samples strokes are measured in a direction,
+    the stroke time of that direction is the slowest measured stroke plus the margin instead of the configured delay.
+    The measurements include up to one tick of polling, so the calibrated stroke times are on the safe side.
+    A sensored cycle still waits for the sensors, the calibrated stroke times set the watchdog timeouts of the
+    states waiting on the pusher and the clearance of an overlapped retract.
+    Command methods are forwarded to the real pneumatic, every other attribute is read from it.
+    Attributes:
+        pneumatic: The real machine object.
+        name: A string used in the messages of the model.
+        sensors_present: A boolean, True when the pneumatic reports its position.
+        delays: A dictionary of the configured stroke time by direction.
+        calibrate: A boolean, True to replace the configured stroke times by the measured ones.
+        margin: A float, fraction added on top of the slowest measured stroke.
+        minimum_samples: An int, number of strokes measured before a direction is calibrated.
+        strokes: A dictionary of the recent measured stroke times by direction.
+    Methods:
+        push_async, pull_async, idle_async: Send the command and record the push and pull.
+        state: The sensed position with sensors, the predicted one without.
+        predicted_state: The position predicted from the time since the last command.
+        commanded: The direction of the last push or pull, None before the first one.
+        stroke_time: The calibrated or configured stroke time of a direction.
+        remaining: Time in seconds until the current stroke is predicted to be done.
+        progress: The predicted fraction of the stroke done towards a direction.
+        report: A dictionary of the configured and calibrated stroke times.
+    """
+
+    def __init__(self, pneumatic, name: str, sensors_present=False, extend_delay=None, retract_delay=None,
+                 calibrate=True, margin=0.2, minimum_samples=5, window=20):
+        self.pneumatic = pneumatic
+        self.name = name
+        self.sensors_present = bool(sensors_present)
+        self.delays = {
+            PUSHED: float(extend_delay) if extend_delay is not None else DEFAULT_STROKE_TIME,
+            PULLED: float(retract_delay) if retract_delay is not None else DEFAULT_STROKE_TIME,
+        }
+        self.calibrate = calibrate
+        self.margin = margin
+        self.minimum_samples = minimum_samples
+        self.strokes = {PUSHED: deque(maxlen=window), PULLED: deque(maxlen=window)}
+        self.__calibrated = {PUSHED: None, PULLED: None}
+        # Direction, time sent and number of the last push or pull, replaced at once
+        self.__command = (None, 0.0, 0)
+        self.__measured = 0
+
+    def __getattr__(self, name):
+        return getattr(self.pneumatic, name)
+
+    def record_command(self, direction: str):
+        direction_now, _, number = self.__command
+        if direction == direction_now:
+            return
+        if self.sensors_present and self.pneumatic.state == direction:
+            # Already there, nothing to measure
+            self.__measured = number + 1
+        self.__command = (direction, time.perf_counter(), number + 1)
+
+    def push_async(self):
+        self.pneumatic.push_async()
+        self.record_command(PUSHED)
+
+    def pull_async(self):
+        self.pneumatic.pull_async()
+        self.record_command(PULLED)
+
+    def idle_async(self):
+        self.pneumatic.idle_async()
+
+    @property
+    def state(self):
+        """ The sensed position with sensors, measuring the stroke on the way, the predicted one without."""
+        if not self.sensors_present:
+            return self.predicted_state()
+        state = self.pneumatic.state
+        direction, sent, number = self.__command
+        if direction is not None and state == direction and number != self.__measured:
+            self.__measured = number
+            self.observe_stroke(direction, time.perf_counter() - sent)
+        return state
+
+    @property
+    def commanded(self):
+        return self.__command[0]
+
+    def predicted_state(self, now=None):
+        direction, sent, _ = self.__command
+        if direction is None:
+            return UNKNOWN
+        now = time.perf_counter() if now is None else now
+        return direction if now - sent >= self.stroke_time(direction) else TRANSITION
+
+    def observe_stroke(self, direction: str, duration: float):
+        strokes = self.strokes[direction]
+        strokes.append(duration)
+        if self.calibrate and len(strokes) >= self.minimum_samples:
+            first = self.__calibrated[direction] is None
+            self.__calibrated[direction] = max(strokes) * (1.0 + self.margin)
+            if first:
+                logging.info(f"{self.name} calibrated to {self.__calibrated[direction]:.2f} s to be {direction}, "
+                             f"configured {self.delays[direction]:.2f} s")
+
+    def stroke_time(self, direction: str):
+        """ The calibrated stroke time of a direction, the configured one until it is calibrated."""
+        calibrated = self.__calibrated[direction]
+        return calibrated if calibrated is not None else self.delays[direction]
+
+    def remaining(self, now=None):
+        """ Time in seconds until the current stroke is predicted to be done, None before the first command."""
+        direction, sent, _ = self.__command
+        if direction is None:
+            return None
+        now = time.perf_counter() if now is None else now
+        return max(0.0, self.stroke_time(direction) - (now - sent))
+
+    def progress(self, direction: str, now=None):
+        """ Predicted fraction of the stroke done towards direction, 0.0 while the last command is another one."""
+        remaining = self.remaining(now)
+        if self.commanded != direction or remaining is None:
+            return 0.0
+        return 1.0 - remaining / self.stroke_time(direction)
+
+    def report(self):
+        return {
+            "sensorsPresent": self.sensors_present,
+            "configured": dict(self.delays),
+            "calibrated": dict(self.__calibrated),
+            "samples": {direction: len(strokes) for direction, strokes in self.strokes.items()},
+        }
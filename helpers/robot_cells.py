@@ -0,0 +1,77 @@
+
+import threading
+
+from conveyor_types.definitions.ipc_mqtt_definitions import mqtt_topics, mqtt_messages, format_message
+from helpers.robot_handshake import RobotHandshake
+from helpers.thread_helpers import InterThreadBool
+
+
+class RobotCell:
+    """
+    RobotCell holds the pick signals of one robot cell, each cell has its own MQTT topics:
+        robot/{cell}/picking: "true" while the robot of the cell is picking, anything else when it is not.
+        robot/{cell}/pick/imminent, robot/{cell}/pick/gripped, robot/{cell}/pick/clear: the pick handshake.
+    Attributes:
+        name: A string, the name of the cell, None for the default cell on the robot/picking topics.
+        robot_is_picking: An InterThreadBool set from the picking topic of the cell.
+        robot_handshake: A RobotHandshake subscribed to the handshake topics of the cell.
+    Methods:
+        subscribe: Subscribes to the topics of the cell.
+        on_picking: Callback of the picking topic.
+    """
+
+    def __init__(self, machine, name=None, robot_is_picking=None, robot_handshake=None):
+        self.machine = machine
+        self.name = name
+        self.robot_is_picking = robot_is_picking if robot_is_picking is not None else InterThreadBool()
+        self.robot_handshake = robot_handshake if robot_handshake is not None else RobotHandshake(machine)
+
+    def subscribe(self):
+        """ Subscribes to the picking and handshake topics of the cell."""
+        if self.name is None:
+            self.machine.on_mqtt_event(mqtt_topics['robotPick'], self.on_picking)
+            return
+        self.machine.on_mqtt_event(format_message(mqtt_topics['robotCellPick'], cell=self.name), self.on_picking)
+        self.robot_handshake.subscribe(format_message(mqtt_topics['robotCellPickImminent'], cell=self.name),
+                                       format_message(mqtt_topics['robotCellPickGripped'], cell=self.name),
+                                       format_message(mqtt_topics['robotCellPickClear'], cell=self.name))
+
+    def on_picking(self, topic: str, payload: str):
+        self.robot_is_picking.set(payload.strip().lower() == mqtt_messages['robotPicking'])
+
+
+class RobotCells:
+    """
+    RobotCells maps the robotCell name in the configuration of a conveyor to the pick signals of that cell,
+    so several robot cells on one controller run on their own schedules.
+    Conveyors without a robotCell use the default cell, on the robot/picking and robot/pick/* topics.
+    A cell is created and subscribed the first time a configuration uses it and kept across restarts.
+    Attributes:
+        machine: The machine used to subscribe to the topics of the cells.
+        default: The RobotCell used by the conveyors without a robotCell.
+        cells: A dictionary of RobotCell by name.
+    Methods:
+        subscribe: Subscribes to the topics of the default cell.
+        cell: The RobotCell of a name, created and subscribed on first use.
+    """
+
+    def __init__(self, machine, robot_is_picking=None, robot_handshake=None):
+        self.machine = machine
+        self.default = RobotCell(machine, None, robot_is_picking, robot_handshake)
+        self.cells = {}
+        self.__lock = threading.Lock()
+
+    def subscribe(self):
+        """ Subscribes to the picking topic of the default cell, its handshake is subscribed by its owner."""
+        self.default.subscribe()
+
+    def cell(self, name=None):
+        """ The RobotCell of a name, the default cell for None or an empty name."""
+        if not name:
+            return self.default
+        with self.__lock:
+            if name not in self.cells:
+                cell = RobotCell(self.machine, str(name))
+                cell.subscribe()
+                self.cells[name] = cell
+            return self.cells[name]
@@ -0,0 +1,122 @@
+
+import threading
+import time
+from enum import Enum
+
+from conveyor_types.definitions.ipc_mqtt_definitions import mqtt_topics
+
+
+class RobotPhase(Enum):
+    """
+    RobotPhase is an enum that is used to keep track of where the robot is in its pick.
+    """
+    IDLE = 0
+    IMMINENT = 1
+    GRIPPED = 2
+    CLEAR = 3
+
+
+class RobotHandshake:
+    """
+    RobotHandshake keeps track of the anticipatory pick handshake sent by the robot.
+    The robot publishes on three topics, each payload being an optional estimate in seconds
+    of how long until the robot is clear of the conveyor:
+        robot/pick/imminent: the robot is about to come down on the conveyor.
+        robot/pick/gripped: the robot has the box, it will be clear after the estimate.
+        robot/pick/clear: the robot is clear of the conveyor, the payload is ignored.
+    Every imminent (or gripped without a preceding imminent) starts a new pick cycle, so a
+    conveyor can tell a clear of the pick it is waiting on from a stale one.
+    The robot_is_picking boolean stays the fallback, conveyors keep using it when the
+    robot never sends the handshake.
+    Attributes:
+        machine: The machine used to subscribe to the handshake topics.
+        phase: A RobotPhase, the last phase reported by the robot.
+        cycle: An int incremented at the start of every pick cycle.
+        phase_time: A float, time.perf_counter() when the phase was received.
+        estimated_clear_time: A float, time.perf_counter() when the robot expects to be clear, or None.
+    Methods:
+        subscribe: Subscribes to the handshake topics on the mqtt broker.
+        on_pick_imminent, on_gripped, on_clear: Callbacks of the handshake topics.
+        pick_pending: True while the robot is on its way down or holding the box over the conveyor.
+        safe_to_advance: True when the next box can be brought forward.
+    """
+
+    def __init__(self, machine=None):
+        self.machine = machine
+        self.phase = RobotPhase.IDLE
+        self.cycle = 0
+        self.phase_time = 0.0
+        self.estimated_clear_time = None
+        self.__lock = threading.Lock()
+
+    def subscribe(self, topic_imminent=None, topic_gripped=None, topic_clear=None):
+        """ Subscribes to the handshake topics on the mqtt broker, defaulting to the robot/pick/* topics."""
+        self.machine.on_mqtt_event(topic_imminent or mqtt_topics['robotPickImminent'], self.on_pick_imminent)
+        self.machine.on_mqtt_event(topic_gripped or mqtt_topics['robotPickGripped'], self.on_gripped)
+        self.machine.on_mqtt_event(topic_clear or mqtt_topics['robotPickClear'], self.on_clear)
+
+    @staticmethod
+    def parse_estimate(payload: str):
+        """ Reads the estimated time in seconds from a payload, None if there is none."""
+        try:
+            estimate = float(payload)
+        except (TypeError, ValueError):
+            return None
+        return estimate if estimate >= 0 else None
+
+    def set_phase(self, phase: RobotPhase, estimate=None, now=None):
+        """ Records a phase received from the robot."""
+        now = time.perf_counter() if now is None else now
+        with self.__lock:
+            if phase == RobotPhase.IMMINENT or (phase == RobotPhase.GRIPPED and self.phase != RobotPhase.IMMINENT):
+                self.cycle += 1
+            self.phase = phase
+            self.phase_time = now
+            if phase == RobotPhase.CLEAR:
+                self.estimated_clear_time = now
+            elif estimate is not None:
+                self.estimated_clear_time = now + estimate
+            else:
+                self.estimated_clear_time = None
+
+    def on_pick_imminent(self, topic: str, payload: str):
+        """ This function is called when a message is received on the robot/pick/imminent topic."""
+        self.set_phase(RobotPhase.IMMINENT, self.parse_estimate(payload))
+
+    def on_gripped(self, topic: str, payload: str):
+        """ This function is called when a message is received on the robot/pick/gripped topic."""
+        self.set_phase(RobotPhase.GRIPPED, self.parse_estimate(payload))
+
+    def on_clear(self, topic: str, payload: str):
+        """ This function is called when a message is received on the robot/pick/clear topic."""
+        self.set_phase(RobotPhase.CLEAR)
+
+    def pick_pending(self, now=None):
+        """
+        True while the robot is coming down on the conveyor or holding the box over it.
+        A gripped phase with an estimate stops being pending once the estimate is reached,
+        so a robot that never sends clear does not hold the conveyors forever.
+        """
+        now = time.perf_counter() if now is None else now
+        if self.phase == RobotPhase.IMMINENT:
+            return True
+        if self.phase == RobotPhase.GRIPPED:
+            return self.estimated_clear_time is None or now < self.estimated_clear_time
+        return False
+
+    def safe_to_advance(self, last_cycle: int, lead_time=0.0, now=None):
+        """
+        True when the next box can be brought forward for a pick cycle not yet used by the caller.
+        That is when the robot reported clear, or when it reported gripped with an estimate and
+        the estimated clear time is less than lead_time away. lead_time is how long the next box
+        takes to reach the pick point, so it arrives just as the robot is out of the way.
+        """
+        now = time.perf_counter() if now is None else now
+        with self.__lock:
+            if self.cycle == last_cycle or self.cycle == 0:
+                return False
+            if self.phase == RobotPhase.CLEAR:
+                return True
+            if self.phase == RobotPhase.GRIPPED and self.estimated_clear_time is not None:
+                return now >= self.estimated_clear_time - lead_time
+            return False
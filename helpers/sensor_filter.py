@@ -0,0 +1,139 @@
+
+import time
+
+from helpers.timer_helper import Timer
+
+
+class FilteredSensor:
+    """
+    FilteredSensor is the filtered value of one sensor.
+    A change of the raw value is only accepted once it stayed stable for the debounce time,
+    and once accepted the value is held for at least the minimum on or off time.
+    A raw change that goes back before being accepted is counted as a glitch.
+    Attributes:
+        sensor: The machine input being filtered.
+        reverse_logic: A boolean used to keep track of whether the sensor logic is reverse.
+        debounce_on: A float, time in seconds the sensor must stay on before the value turns on.
+        debounce_off: A float, time in seconds the sensor must stay off before the value turns off.
+        minimum_on: A float, time in seconds the value stays on once it turned on.
+        minimum_off: A float, time in seconds the value stays off once it turned off.
+        state: The filtered, logic corrected value, None before the first update.
+        glitch_count: An int, number of raw changes rejected by the filter.
+    Methods:
+        update: Reads the sensor and updates the filtered value.
+    """
+
+    def __init__(self, sensor, reverse_logic=False, debounce_on=0.0, debounce_off=0.0,
+                 minimum_on=0.0, minimum_off=0.0):
+        self.sensor = sensor
+        self.reverse_logic = reverse_logic
+        self.debounce_on = debounce_on
+        self.debounce_off = debounce_off
+        self.minimum_on = minimum_on
+        self.minimum_off = minimum_off
+        self.state = None
+        self.glitch_count = 0
+        self.__candidate = None
+        self.__candidate_since = 0.0
+        self.__changed_at = 0.0
+
+    def read(self, read_input=None):
+        """ Reads the logic corrected raw value of the sensor, through read_input when given."""
+        state = read_input(self.sensor) if read_input is not None else self.sensor.state.value
+        return not state if self.reverse_logic else state
+
+    def update(self, now=None, read_input=None):
+        """
+        Reads the sensor and updates the filtered value.
+
+        Parameters
+        ----------
+        now : float, optional
+            Time stamp to use, defaults to time.perf_counter()
+        read_input : callable, optional
+            Function reading an input, such as InputSnapshot.read, defaults to a live read
+
+        Returns
+        ----------
+        bool
+            True when a glitch was counted
+        """
+        now = time.perf_counter() if now is None else now
+        raw = self.read(read_input)
+        if self.state is None:
+            self.state = raw
+            self.__candidate = raw
+            self.__candidate_since = now
+            self.__changed_at = now
+            return False
+
+        glitch = False
+        if raw != self.__candidate:
+            if self.__candidate != self.state:
+                # The pending change went back before it was accepted
+                self.glitch_count += 1
+                glitch = True
+            self.__candidate = raw
+            self.__candidate_since = now
+
+        if self.__candidate != self.state:
+            debounce = self.debounce_on if self.__candidate else self.debounce_off
+            hold = self.minimum_on if self.state else self.minimum_off
+            if now - self.__candidate_since >= debounce and now - self.__changed_at >= hold:
+                self.state = self.__candidate
+                self.__changed_at = now
+        return glitch
+
+
+class SensorFilterBank:
+    """
+    SensorFilterBank updates every filtered sensor of the line in a single batch, once per tick,
+    so all the conveyors see values filtered at the same instant.
+    Attributes:
+        system_state: A SystemState used to publish the glitch counters, None to not publish.
+        filters: A list of (conveyor index, sensor role, FilteredSensor).
+    Methods:
+        configure: Collects the filtered sensors of a list of conveyors.
+        update_all: Updates every filtered sensor, meant to be called once per tick.
+        report: A dictionary of the glitch counters by conveyor and sensor role.
+    """
+
+    def __init__(self, system_state=None, report_period=1.0):
+        self.system_state = system_state
+        self.filters = []
+        self.report_timer = Timer(report_period)
+        self.__glitches_to_report = False
+
+    def configure(self, list_of_conveyors: list):
+        """ Collects the filtered sensors of a list of conveyors."""
+        self.filters = []
+        for conveyor in list_of_conveyors:
+            for role, sensor_filter in conveyor.sensor_filters.items():
+                self.filters.append((conveyor.index, role, sensor_filter))
+
+    def update_all(self, now=None, read_input=None):
+        """
+        Updates every filtered sensor and publishes the glitch counters when they changed.
+        The sensors are read through read_input when given, such as InputSnapshot.read.
+        """
+        if not self.filters:
+            return
+        now = time.perf_counter() if now is None else now
+        for _, _, sensor_filter in self.filters:
+            if sensor_filter.update(now, read_input):
+                self.__glitches_to_report = True
+
+        if self.__glitches_to_report and self.system_state is not None:
+            if not self.report_timer.started:
+                self.report_timer.start()
+            if self.report_timer.done():
+                self.report_timer.stop()
+                self.__glitches_to_report = False
+                self.system_state.publish_sensor_report(self.report())
+
+    def report(self):
+        """ The glitch counters by conveyor index and sensor role."""
+        report = {}
+        for index, role, sensor_filter in self.filters:
+            report.setdefault(index, {})[role] = sensor_filter.glitch_count
+        return report
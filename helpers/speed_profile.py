@@ -0,0 +1,98 @@
+
+import time
+
+
+class SpeedProfile:
+    """
+    SpeedProfile is a two step speed profile, full speed then slow speed before the stop point,
+    so the box reaches the sensor slowly and settles right away when the belt stops.
+    The belt slows down when the optional pre-stop sensor sees the box, or when slow_down_time
+    seconds have passed since the belt started, which is the time based estimate of the box
+    being close to the stop point.
+    Attributes:
+        slow_speed: A float, speed of the axis once slowed down.
+        slow_acceleration: A float, acceleration used by the axis to reach the slow speed.
+        slow_down_time: A float, time in seconds after the start before slowing down, None if not used.
+        slow_down_sensor: A machine object, the pre-stop sensor, None if not used.
+        reverse_sensor_logic: A boolean used to keep track of whether the pre-stop sensor logic is reverse.
+        slow_speed_output: A machine object, the output selecting the slow preset speed of a vfd, None if not used.
+        slow: A boolean, True once the belt was slowed down since the last start.
+        start_time: time.perf_counter() when the belt was last started at full speed.
+    Methods:
+        start: Resets the profile to full speed, called every time the belt starts.
+        should_slow_down: True when the belt should switch to the slow speed.
+    """
+
+    def __init__(self, slow_speed=None, slow_acceleration=None, slow_down_time=None, slow_down_sensor=None,
+                 reverse_sensor_logic=False, slow_speed_output=None):
+        self.slow_speed = slow_speed
+        self.slow_acceleration = slow_acceleration
+        self.slow_down_time = slow_down_time
+        self.slow_down_sensor = slow_down_sensor
+        self.reverse_sensor_logic = reverse_sensor_logic
+        self.slow_speed_output = slow_speed_output
+        self.slow = False
+        self.start_time = None
+
+    def start(self, now=None):
+        """ Resets the profile to full speed."""
+        self.slow = False
+        self.start_time = time.perf_counter() if now is None else now
+
+    def pre_stop_sensor_state(self, read_input=None):
+        """ The logic corrected value of the pre-stop sensor, read through read_input when given."""
+        if self.slow_down_sensor is None:
+            return False
+        if read_input is not None:
+            state = read_input(self.slow_down_sensor)
+        else:
+            state = self.slow_down_sensor.state.value
+        return not state if self.reverse_sensor_logic else state
+
+    def should_slow_down(self, now=None, read_input=None):
+        """ True when the belt runs at full speed and the box is close to the stop point."""
+        if self.slow or self.start_time is None:
+            return False
+        if self.pre_stop_sensor_state(read_input):
+            return True
+        if self.slow_down_time is not None:
+            now = time.perf_counter() if now is None else now
+            return now - self.start_time >= self.slow_down_time
+        return False
+
+
+class DemandSpeed:
+    """
+    DemandSpeed maps how full the downstream buffer is to a belt speed.
+    An empty buffer gives the maximum speed to refill it quickly, a full buffer the minimum speed,
+    with a linear ramp in between. Speeds are rounded to steps so small changes in the buffer
+    do not send a new setpoint to the drive every tick.
+    Attributes:
+        minimum_speed: A float, speed when the downstream buffer is full.
+        maximum_speed: A float, speed when the downstream buffer is empty.
+        step: A float, speeds are rounded to multiples of this step above the minimum speed.
+        slow_speed_output: A machine object, the output selecting the slow preset speed of a vfd, None if not used.
+    Methods:
+        speed_for: The speed for a buffer fill between 0.0 and 1.0.
+        is_slow: True if a speed is in the lower half of the range, used for vfds with two preset speeds.
+    """
+
+    def __init__(self, minimum_speed: float, maximum_speed: float, step=None, slow_speed_output=None):
+        self.minimum_speed = minimum_speed
+        self.maximum_speed = maximum_speed
+        self.step = step if step else (maximum_speed - minimum_speed) / 20.0
+        self.slow_speed_output = slow_speed_output
+
+    def speed_for(self, fill):
+        """ The speed for a buffer fill between 0.0 and 1.0, maximum speed when the fill is unknown."""
+        if fill is None:
+            return self.maximum_speed
+        fill = min(1.0, max(0.0, fill))
+        speed = self.maximum_speed - fill * (self.maximum_speed - self.minimum_speed)
+        if self.step > 0:
+            speed = self.minimum_speed + round((speed - self.minimum_speed) / self.step) * self.step
+        return min(self.maximum_speed, max(self.minimum_speed, speed))
+
+    def is_slow(self, speed):
+        """ True if the speed is in the lower half of the range."""
+        return speed < (self.minimum_speed + self.maximum_speed) / 2.0
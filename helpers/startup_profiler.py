@@ -0,0 +1,59 @@
+
+import time
+from contextlib import contextmanager
+
+
+def system_uptime():
+    """ Time in seconds since the controller booted, None where /proc/uptime is not available."""
+    try:
+        with open('/proc/uptime') as uptime_file:
+            return float(uptime_file.read().split()[0])
+    except (IOError, ValueError, IndexError):
+        return None
+
+
+class StartupProfiler:
+    """
+    StartupProfiler times each phase of the startup of the conveyor process, and the time until
+    the first conveyor reaches RUNNING, which is what recovery after a power cycle is measured on.
+    Attributes:
+        start_time: time.perf_counter() when the process started its startup.
+        phases: A list of (name, duration in seconds) in the order the phases ran.
+        first_running: Time in seconds from start_time to the first RUNNING conveyor, None until then.
+        uptime_at_first_running: Time in seconds from the boot of the controller to the first RUNNING conveyor.
+    Methods:
+        phase: A context manager timing one phase of the startup.
+        mark_first_running: Records the first RUNNING conveyor, only the first call counts.
+        report: A dictionary of the phase durations and totals.
+    """
+
+    def __init__(self, start_time=None):
+        self.start_time = time.perf_counter() if start_time is None else start_time
+        self.phases = []
+        self.first_running = None
+        self.uptime_at_first_running = None
+
+    @contextmanager
+    def phase(self, name: str):
+        phase_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - phase_start))
+
+    def mark_first_running(self, now=None):
+        """ Records the time of the first RUNNING conveyor, returns True on the first call only."""
+        if self.first_running is not None:
+            return False
+        now = time.perf_counter() if now is None else now
+        self.first_running = now - self.start_time
+        self.uptime_at_first_running = system_uptime()
+        return True
+
+    def report(self):
+        return {
+            "phases_sec": {name: duration for name, duration in self.phases},
+            "startup_sec": sum(duration for _, duration in self.phases),
+            "firstRunning_sec": self.first_running,
+            "bootToFirstRunning_sec": self.uptime_at_first_running,
+        }
@@ -0,0 +1,207 @@
+
+import json
+import time
+from types import MappingProxyType
+from typing import NamedTuple
+
+from conveyor_types.definitions.ipc_mqtt_definitions import mqtt_topics
+
+
+class ConveyorSnapshot(NamedTuple):
+    """
+    ConveyorSnapshot is the state of one conveyor at the end of a tick. It is never changed once published,
+    a conveyor that did not change keeps the same ConveyorSnapshot from one LineSnapshot to the next.
+    """
+    index: int
+    type: str
+    state: str
+    state_since: float
+    box_present: object
+    accumulation_present: object
+    commanded_speed: object
+    command_failures: int
+    fault_latched: bool
+    details: MappingProxyType
+
+    def summary(self):
+        return {
+            "type": self.type,
+            "state": self.state,
+            "stateSince": self.state_since,
+            "boxPresent": self.box_present,
+            "accumulationPresent": self.accumulation_present,
+        }
+
+    def to_dict(self):
+        entry = self.summary()
+        entry.update(self.details)
+        entry.update({
+            "index": self.index,
+            "commandedSpeed": self.commanded_speed,
+            "commandFailures": self.command_failures,
+            "faultLatched": self.fault_latched,
+        })
+        return entry
+
+
+class LineSnapshot(NamedTuple):
+    """
+    LineSnapshot is the state of the whole line at the end of a tick, the conveyors and the system values
+    are read-only mappings.
+    """
+    time: float
+    tick: int
+    system: MappingProxyType
+    conveyors: MappingProxyType
+
+    def to_dict(self):
+        return {
+            "time": self.time,
+            "tick": self.tick,
+            "system": dict(self.system),
+            "conveyors": {index: conveyor.summary() for index, conveyor in self.conveyors.items()},
+        }
+
+
+class StateStore:
+    """
+    StateStore keeps the latest state of the line in memory, so a client connecting late gets it with a single
+    request instead of waiting for the next publish of every topic.
+    At the end of every tick the control thread publishes an immutable LineSnapshot by replacing the current one,
+    readers take the current snapshot once and always see the line as it was at the end of one tick. Neither side
+    takes a lock, so status requests and metrics scrapes never hold up the control thread.
+    SystemState updates the estop, the drive readiness and program_run when they change, they are part of the
+    next snapshot. A request on conveyors/status/request is answered on conveyors/status/response,
+    or on the replyTo topic of the request when it is under conveyors/status/response/. Any other replyTo
+    is ignored, so a request cannot publish on the control or configuration topics.
+    A request is either empty for the full snapshot, a conveyor index for the details of one conveyor, or a json
+    object with the optional keys "conveyor", "replyTo" and "requestId", the request id is sent back in the answer.
+    Attributes:
+        system_state: The SystemState the store publishes through.
+        system: A read-only mapping of the estop, drives_are_ready and program_run values.
+        current: The LineSnapshot published last.
+        tick: An int, number of ticks the conveyors ran.
+    Methods:
+        subscribe: Subscribes to the status request topic.
+        configure: Takes the conveyors of a new configuration and publishes them.
+        update_system: Copies the values of the SystemState.
+        end_tick: Counts a tick and publishes the snapshot, meant to be called once the conveyors ran.
+        publish: Publishes a new snapshot of the line.
+        snapshot: The full state of the line.
+        conveyor_details: The details of one conveyor.
+        reply_topic: The topic a request is answered on.
+        on_status_request: Answers a status request.
+    """
+
+    def __init__(self, system_state):
+        self.system_state = system_state
+        self.system = MappingProxyType({})
+        self.tick = 0
+        self.__conveyor_objects = ()
+        self.__details = {}
+        self.update_system(system_state)
+        self.current = LineSnapshot(time.time(), self.tick, self.system, MappingProxyType({}))
+
+    def subscribe(self, topic=None):
+        self.system_state.state_store = self
+        self.update_system(self.system_state)
+        self.system_state.machine.on_mqtt_event(topic or mqtt_topics['statusRequest'], self.on_status_request)
+
+    def configure(self, list_of_conveyors: list):
+        """ Takes the conveyors of a new configuration and publishes them, the previous ones are forgotten."""
+        self.__conveyor_objects = tuple(list_of_conveyors)
+        self.__details = {conveyor.index: MappingProxyType({
+            "actuator": conveyor.actuator_name,
+            "actuatorIsVfd": conveyor.actuator_is_vfd,
+            "pusherPresent": conveyor.pusher_present,
+            "stopperPresent": conveyor.stopper_present,
+            "stateTimeouts": {state.name: timeout for state, timeout in conveyor.state_timeouts.items()
+                              if state not in conveyor.stroke_timeouts},
+            "strokeTimeouts": {state.name: direction for state, direction in conveyor.stroke_timeouts.items()},
+            "recoveryLimit": conveyor.recovery_limit,
+        }) for conveyor in list_of_conveyors}
+        self.current = LineSnapshot(time.time(), self.tick, self.system, MappingProxyType({}))
+        self.publish()
+
+    def update_system(self, system_state):
+        """ Copies the estop, drive readiness and program_run values of the SystemState."""
+        self.system = MappingProxyType({
+            "estop": system_state.estop,
+            "drivesAreReady": system_state.drives_are_ready,
+            "programRun": getattr(system_state, 'program_run', False),
+        })
+
+    def end_tick(self):
+        self.tick += 1
+        self.publish()
+
+    def publish(self, now=None):
+        """ Publishes a new LineSnapshot, only the conveyors that changed get a new ConveyorSnapshot."""
+        now = time.time() if now is None else now
+        previous = self.current.conveyors
+        conveyors = {}
+        for conveyor in self.__conveyor_objects:
+            state = conveyor.conveyor_state.name
+            box_present = conveyor.get_box_sensor_state() if conveyor.box_sensor is not None else None
+            accumulation_present = (conveyor.get_accumulation_sensor_state()
+                                    if conveyor.accumulation_sensor is not None else None)
+            entry = previous.get(conveyor.index)
+            if (entry is None or entry.state != state or entry.box_present != box_present or
+                    entry.accumulation_present != accumulation_present or
+                    entry.commanded_speed != conveyor.commanded_speed or
+                    entry.command_failures != conveyor.command_failures or
+                    entry.fault_latched != conveyor.fault_latched):
+                entry = ConveyorSnapshot(conveyor.index, type(conveyor).__name__, state,
+                                         now if entry is None or entry.state != state else entry.state_since,
+                                         box_present, accumulation_present, conveyor.commanded_speed,
+                                         conveyor.command_failures, conveyor.fault_latched,
+                                         self.__details[conveyor.index])
+            conveyors[conveyor.index] = entry
+        # Replacing the reference is atomic, a reader holds either the previous snapshot or this one
+        self.current = LineSnapshot(now, self.tick, self.system, MappingProxyType(conveyors))
+
+    def snapshot(self):
+        """ The full state of the line, as published at the end of the last tick."""
+        return self.current.to_dict()
+
+    def conveyor_details(self, index: int):
+        """ The details of one conveyor, None if there is no conveyor with this index."""
+        conveyor = self.current.conveyors.get(index)
+        return conveyor.to_dict() if conveyor is not None else None
+
+    @staticmethod
+    def reply_topic(reply_to):
+        """ The replyTo of a request when it is under the status response topic, the status response topic if not."""
+        default = mqtt_topics['statusResponse']
+        if reply_to is None:
+            return default
+        if (not isinstance(reply_to, str) or not reply_to.startswith(default + '/') or
+                '+' in reply_to or '#' in reply_to):
+            print(f"Ignoring replyTo outside of {default}/ in status request: {reply_to}")
+            return default
+        return reply_to
+
+    def on_status_request(self, topic: str, payload: str):
+        """ Answers a status request with the full snapshot or the details of one conveyor."""
+        request = {}
+        if payload and payload.strip():
+            try:
+                request = json.loads(payload)
+            except json.JSONDecodeError:
+                print(f"Unexpected payload received in on_status_request: {payload}")
+                return
+            if isinstance(request, int):
+                request = {"conveyor": request}
+            elif not isinstance(request, dict):
+                request = {}
+
+        if request.get("conveyor") is not None:
+            try:
+                response = {"conveyor": self.conveyor_details(int(request["conveyor"]))}
+            except (TypeError, ValueError):
+                response = {"conveyor": None}
+        else:
+            response = self.snapshot()
+        if "requestId" in request:
+            response["requestId"] = request["requestId"]
+        self.system_state.publish_mqtt_event(self.reply_topic(request.get("replyTo")), json.dumps(response))
@@ -0,0 +1,96 @@
+
+import time
+
+
+class WatchedConveyor:
+    """
+    WatchedConveyor is what the StateWatchdog knows about one conveyor.
+    Attributes:
+        state: The state the conveyor was in at the last check.
+        entered_time: time.perf_counter() when the conveyor entered that state, or was last retried.
+        retries: An int, number of retries done since the conveyor entered that state.
+    """
+
+    def __init__(self, state, now: float):
+        self.state = state
+        self.entered_time = now
+        self.retries = 0
+
+
+class StateWatchdog:
+    """
+    StateWatchdog checks how long each conveyor stays in a state against the maximum dwell time
+    configured for that state and that conveyor. When a conveyor stays too long, a fault is published
+    and the conveyor retries the pneumatic of the state. Once the retries are used up, only that conveyor
+    is brought back to a safe state, the rest of the line keeps running. A conveyor that keeps being
+    recovered latches its fault and is no longer checked until an operator resets it.
+    The maximum dwell times come from the watchdog_timeout method and the number of retries from the
+    watchdog_retries attribute of each conveyor. The dwell of a state that is not watched is not counted.
+    Attributes:
+        system_state: A SystemState used to publish the faults.
+        watched: A dictionary of WatchedConveyor by conveyor index.
+        fault_count: An int, number of timeouts seen.
+        recovery_count: An int, number of conveyors brought back to a safe state.
+    Methods:
+        configure: Forgets the conveyors of the previous configuration.
+        check: Checks one conveyor, meant to be called after its run().
+    """
+
+    def __init__(self, system_state=None):
+        self.system_state = system_state
+        self.watched = {}
+        self.fault_count = 0
+        self.recovery_count = 0
+
+    def configure(self, list_of_conveyors: list):
+        """ Forgets the conveyors of the previous configuration."""
+        self.watched = {}
+
+    def check(self, conveyor, now=None):
+        """
+        Checks how long the conveyor has been in its state and acts on a timeout.
+
+        Returns
+        ----------
+        bool
+            True when the conveyor timed out at this check
+        """
+        now = time.perf_counter() if now is None else now
+        if conveyor.fault_latched:
+            self.watched.pop(conveyor.index, None)
+            return False
+        watched = self.watched.get(conveyor.index)
+        if watched is None or watched.state != conveyor.conveyor_state:
+            self.watched[conveyor.index] = WatchedConveyor(conveyor.conveyor_state, now)
+            return False
+
+        timeout = conveyor.watchdog_timeout()
+        if timeout is None:
+            watched.entered_time = now
+            return False
+        if now - watched.entered_time < timeout:
+            return False
+
+        self.fault_count += 1
+        dwell = now - watched.entered_time
+        if watched.retries < conveyor.watchdog_retries:
+            watched.retries += 1
+            watched.entered_time = now
+            self.publish_fault(conveyor, watched.state, dwell, "retry", watched.retries)
+            conveyor.retry_stuck_state()
+        else:
+            self.recovery_count += 1
+            self.publish_fault(conveyor, watched.state, dwell, "recover", watched.retries)
+            conveyor.recover_to_safe_state()
+            self.watched[conveyor.index] = WatchedConveyor(conveyor.conveyor_state, now)
+        return True
+
+    def publish_fault(self, conveyor, state, dwell: float, action: str, retries: int):
+        if self.system_state is None:
+            return
+        self.system_state.publish_conv_fault(conveyor.index, {
+            "state": state.name,
+            "dwell_sec": dwell,
+            "action": action,
+            "retries": retries,
+        })
@@ -17,6 +17,25 @@ class Timer:
         self.started = False
         self.paused = False
 
+    @property
+    def delay(self):
+        """
+        Time in seconds until done() returns true
+        """
+        return self.__delay
+
+    def set_delay(self, delay: float):
+        """
+        Change the time in seconds until done() returns true.
+        Takes effect immediately, including on a running timer.
+
+        Parameters
+        ----------
+        delay : float
+            New delay in seconds
+        """
+        self.__delay = delay
+
     def start(self):
         """
         Start (or restart) timer execution
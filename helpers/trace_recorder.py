@@ -0,0 +1,132 @@
+
+import json
+import logging
+import os
+import time
+
+# Environment variable holding the path of the trace file, nothing is recorded when it is not set
+TRACE_PATH_ENV = "CONVEYOR_TRACE_PATH"
+TRACE_MAX_BYTES = 100 * 1024 * 1024
+TRACE_BACKUPS = 5
+
+
+class TraceRecorder:
+    """
+    TraceRecorder writes the changes of the line to a json lines file, for tools/trace_analyzer.py.
+    Only changes are written, so a line that is idle costs nothing and a shift stays small. Each line is
+    one event with the wall clock time "t", the conveyor index "c", the event "e" and its value "v":
+        config: written when the conveyors are configured, "conveyors" maps each index to its type and parent.
+        state: the conveyor entered the ConveyorState named in "v".
+        box: the logic corrected box sensor changed to "v".
+        pick: the robot_is_picking signal of the conveyor changed to "v".
+        cmd: a command "v" completed, "ok" tells if it succeeded and "lat" is its latency in seconds.
+    The file is rotated to path.1, path.2, ... once it grows past max_bytes.
+    The trace is written from the control thread, an error writing or rotating it, such as a full disk,
+    is logged and stops the recording instead of stopping the line.
+    Attributes:
+        path: A string, the path of the trace file.
+        max_bytes: An int, size of the file before it is rotated.
+        backups: An int, number of rotated files kept.
+        events_written: An int, number of events written.
+    Methods:
+        configure: Writes the config event and forgets the previous conveyors.
+        record_conveyor: Writes the changes of a conveyor, meant to be called after its run().
+        record_commands: Writes the commands completed at a flush of the CommandDispatcher.
+        disable: Stops the recording.
+        close: Closes the trace file.
+    """
+
+    def __init__(self, path: str, max_bytes=TRACE_MAX_BYTES, backups=TRACE_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.events_written = 0
+        self.__last = {}
+        self.__file = None
+        self.__bytes_written = 0
+        self.open()
+
+    def open(self):
+        try:
+            self.__file = open(self.path, 'a')
+            self.__bytes_written = self.__file.tell()
+        except IOError as e:
+            logging.error(f"Trace file {self.path} could not be opened: {e}")
+            self.__file = None
+
+    def rotate(self):
+        self.__file.close()
+        for number in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{number}"):
+                os.replace(f"{self.path}.{number}", f"{self.path}.{number + 1}")
+        os.replace(self.path, f"{self.path}.1")
+        self.open()
+
+    def write(self, event: dict):
+        if self.__file is None:
+            return
+        line = json.dumps(event, separators=(',', ':')) + '\n'
+        try:
+            self.__file.write(line)
+            self.__bytes_written += len(line)
+            self.events_written += 1
+            if self.__bytes_written >= self.max_bytes:
+                self.rotate()
+        except OSError as e:
+            logging.error(f"Trace file {self.path} could not be written, recording stopped: {e}")
+            self.disable()
+
+    def disable(self):
+        """ Stops the recording, the events are dropped from now on."""
+        trace_file, self.__file = self.__file, None
+        if trace_file is not None:
+            try:
+                trace_file.close()
+            except OSError:
+                pass
+
+    def configure(self, list_of_conveyors: list):
+        """ Writes the config event, with the type and parent of every conveyor, and forgets the previous ones."""
+        self.__last = {}
+        conveyors = {}
+        for conveyor in list_of_conveyors:
+            parent = getattr(conveyor, 'parentConveyor', None)
+            conveyors[conveyor.index] = {
+                "type": type(conveyor).__name__,
+                "parent": parent.index if parent is not None else None,
+            }
+        self.write({"t": time.time(), "e": "config", "conveyors": conveyors})
+
+    def record_conveyor(self, conveyor, now=None):
+        """ Writes the state, box sensor and robot pick changes of a conveyor."""
+        last = self.__last.get(conveyor.index)
+        if last is None:
+            last = self.__last[conveyor.index] = [None, None, None]
+        state = conveyor.conveyor_state.name
+        box = conveyor.get_box_sensor_state() if conveyor.box_sensor is not None else None
+        robot_is_picking = getattr(conveyor, 'robot_is_picking', None)
+        pick = robot_is_picking.get() if robot_is_picking is not None else None
+        if state == last[0] and box == last[1] and pick == last[2]:
+            return
+
+        now = time.time() if now is None else now
+        if state != last[0]:
+            self.write({"t": now, "c": conveyor.index, "e": "state", "v": state})
+        if box != last[1] and box is not None:
+            self.write({"t": now, "c": conveyor.index, "e": "box", "v": bool(box)})
+        if pick != last[2] and pick is not None:
+            self.write({"t": now, "c": conveyor.index, "e": "pick", "v": bool(pick)})
+        last[0], last[1], last[2] = state, box, pick
+
+    def record_commands(self, commands: list):
+        """ Writes the commands completed at a flush of the CommandDispatcher."""
+        now = time.time()
+        for command in commands:
+            owner = command.device.owner
+            self.write({"t": now, "c": getattr(owner, 'index', None), "e": "cmd", "v": command.method,
+                        "ok": command.error is None, "lat": command.latency()})
+
+    def close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
@@ -0,0 +1,57 @@
+"""
+Deterministic checks of tools/line_simulator.py, they run without the machine SDK.
+
+Usage: python3 -m pytest tests/test_line_simulator.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from conveyor_types.definitions.conveyor_definitions import *
+from tools.line_simulator import DEFAULT_BOX_PITCH, DEFAULT_PICK_TIME, simulate
+
+EXTEND_DELAY = 0.5
+RETRACT_DELAY = 0.4
+
+
+def infeed_line(*attached_types):
+    """ One InfeedConveyor with a pusher, and the conveyors attached to it in order."""
+    conveyors = {"1": {TYPE: "InfeedConveyor",
+                       PUSHER_CONFIG: {PUSHER_PRESENT: True, EXTEND_DELAY_SEC: EXTEND_DELAY,
+                                       RETRACT_DELAY_SEC: RETRACT_DELAY}}}
+    for index, conveyor_type in enumerate(attached_types, start=2):
+        conveyors[str(index)] = {TYPE: conveyor_type}
+    return {LIST_OF_ALL_CONVEYORS: conveyors}
+
+
+def without_wall_time(report):
+    report["simulation"].pop("wallTime_sec")
+    return report
+
+
+def test_infeed_throughput_matches_its_cycle():
+    # The next box is one pitch away when the conveyor restarts, then it is pushed, picked and the pusher retracts
+    cycle = DEFAULT_BOX_PITCH + EXTEND_DELAY + RETRACT_DELAY + DEFAULT_PICK_TIME + RETRACT_DELAY
+    report = simulate(infeed_line(), 3600.0, warmup=60.0)
+    assert abs(report["line"]["boxesPerHour"] - 3600.0 / cycle) <= 1.0
+    assert abs(report["robots"]["default"]["utilization"] - DEFAULT_PICK_TIME / cycle) < 0.01
+    assert report["line"]["stalled"] == {}
+
+
+def test_follower_runs_with_its_parent():
+    report = simulate(infeed_line("FollowerConveyor"), 3600.0, warmup=60.0)
+    infeed, follower = report["conveyors"][1], report["conveyors"][2]
+    assert follower["parent"] == 1
+    assert abs(follower["stateShare"]["RUNNING"] - infeed["stateShare"]["RUNNING"]) < 1e-6
+    assert follower["boxes"] == infeed["boxes"]
+
+
+def test_same_seed_gives_the_same_report():
+    parameters = dict(pick_jitter=0.3, arrival_interval=4.0, poisson=True)
+    line = infeed_line("QueueingConveyor", "TransferConveyor")
+    first = without_wall_time(simulate(line, 3600.0, seed=7, **parameters))
+    second = without_wall_time(simulate(line, 3600.0, seed=7, **parameters))
+    other = without_wall_time(simulate(line, 3600.0, seed=8, **parameters))
+    assert first == second
+    assert first != other
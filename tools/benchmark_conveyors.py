@@ -0,0 +1,168 @@
+"""
+Benchmark of the memory and attribute access cost of the conveyor objects on a large line.
+
+The conveyors are built on an in-memory machine, so no hardware is needed, only the machine-logic-sdk.
+The slotted conveyors are compared with the same attribute values stored in a per-instance __dict__,
+which is how the conveyors were stored before they used __slots__.
+
+Usage: python3 tools/benchmark_conveyors.py [--conveyors 500] [--repeat 200]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from machinelogic import MachineException
+
+from conveyor_types.conveyors import ControlAllConveyor
+from conveyor_types.system import SystemState
+from helpers.conveyor_configuration import configure_conveyors
+from helpers.input_snapshot import InputSnapshot
+from helpers.thread_helpers import InterThreadBool
+
+# Attributes read by every conveyor on every tick
+HOT_ATTRIBUTES = ('conveyor_state', 'system_state', 'box_sensor', 'reverse_box_logic', 'sensor_filters',
+                  'input_snapshot', 'actuator', 'actuator_is_vfd', 'pusher_present', 'speed_profile',
+                  'commanded_speed', 'index')
+
+
+class BenchmarkValue:
+    def __init__(self):
+        self.value = False
+
+
+class BenchmarkConfiguration:
+    def __init__(self, name, port):
+        self.name = name
+        self.device = 1 + port // 4
+        self.port = port % 4
+
+
+class BenchmarkDevice:
+    """ An input, output, pneumatic or actuator of the in-memory machine, every command is accepted."""
+
+    def __init__(self, name, port):
+        self.configuration = BenchmarkConfiguration(name, port)
+        self.state = BenchmarkValue()
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class BenchmarkMachine:
+    """ An in-memory machine, actuators named vfd... are ac motors, the others are axes."""
+
+    def __init__(self):
+        self.devices = {}
+
+    def get_device(self, name):
+        if name is None:
+            raise MachineException('No device name')
+        if name not in self.devices:
+            self.devices[name] = BenchmarkDevice(name, len(self.devices))
+        return self.devices[name]
+
+    def get_ac_motor(self, name):
+        if not name or not name.startswith('vfd'):
+            raise MachineException(name)
+        return self.get_device(name)
+
+    get_actuator = get_input = get_output = get_pneumatic = get_device
+
+    def on_mqtt_event(self, topic, callback):
+        pass
+
+    def publish_mqtt_event(self, topic, payload):
+        pass
+
+
+def line_configuration(number_of_conveyors: int):
+    """ A line of Infeed conveyors, each fed by a Queueing conveyor."""
+    conveyors = {}
+    for i in range(number_of_conveyors):
+        if i % 2 == 0:
+            conveyors[f"infeed{i}"] = {
+                "type": "InfeedConveyor",
+                "conveyorName": f"vfd{i}",
+                "boxSensorConfig": {"boxSensorPresent": True, "boxSensorName": f"box{i}"},
+            }
+        else:
+            conveyors[f"queueing{i}"] = {
+                "type": "QueueingConveyor",
+                "conveyorName": f"axis{i}",
+                "boxSensorConfig": {"boxSensorPresent": True, "boxSensorName": f"box{i}"},
+                "axisParameters": {"speed": 100, "acceleration": 100, "decceleration": 100},
+            }
+    return {"ListOfAllConveyors": conveyors}
+
+
+def slot_names(conveyor):
+    names = []
+    for cls in type(conveyor).__mro__:
+        names.extend(name for name in getattr(cls, '__slots__', ()) if name != '__dict__')
+    return names
+
+
+class DictLayout:
+    """ The attributes of a conveyor stored in a per-instance __dict__."""
+
+
+def dict_layout(conveyor):
+    copy = DictLayout()
+    for name in slot_names(conveyor):
+        setattr(copy, name, getattr(conveyor, name))
+    return copy
+
+
+def instance_size(obj):
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+
+def time_attribute_reads(objects: list, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for obj in objects:
+            for name in HOT_ATTRIBUTES:
+                getattr(obj, name)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--conveyors', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    system = SystemState(BenchmarkMachine())
+    system.drives_are_ready = True
+    system.program_run = True
+    conveyors = configure_conveyors(line_configuration(args.conveyors), system, InterThreadBool(), max_workers=1)
+    copies = [dict_layout(conveyor) for conveyor in conveyors]
+
+    slotted_bytes = sum(instance_size(conveyor) for conveyor in conveyors)
+    dict_bytes = sum(instance_size(copy) for copy in copies)
+    slotted_time = time_attribute_reads(conveyors, args.repeat)
+    dict_time = time_attribute_reads(copies, args.repeat)
+    reads = args.repeat * len(conveyors) * len(HOT_ATTRIBUTES)
+
+    control = ControlAllConveyor(conveyors, input_snapshot=InputSnapshot())
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        control.run_all()
+    tick_time = (time.perf_counter() - start) / args.repeat
+
+    print(f"Conveyors: {len(conveyors)}")
+    print(f"Instance memory, __slots__: {slotted_bytes / len(conveyors):.0f} bytes per conveyor")
+    print(f"Instance memory, __dict__:  {dict_bytes / len(conveyors):.0f} bytes per conveyor")
+    print(f"Attribute read, __slots__: {slotted_time / reads * 1e9:.1f} ns")
+    print(f"Attribute read, __dict__:  {dict_time / reads * 1e9:.1f} ns")
+    print(f"Tick duration: {tick_time * 1000:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
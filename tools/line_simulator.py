@@ -0,0 +1,1202 @@
+"""
+Discrete-event simulator of a configured line, to predict its throughput before it is commissioned.
+
+The line is read from configured_conveyors.json. Follower, Queueing and Transfer conveyors are attached to the
+conveyor before them like configure_conveyors does: the Follower and Queueing conveyors after a conveyor feed it in
+series, the first one after it being the closest, and each Transfer conveyor pushes onto it from the side.
+Each conveyor type goes through the states of its run() with the timers of its configuration: restartTime,
+accumulationTime, sustainTime, pacingTime and the pusher extendDelay_sec and retractDelay_sec, the retract of an
+AccumulatingConveyor overlapped with retractOverlapEnabled lasts its retractClearance fraction of retractDelay_sec.
+A box crosses a belt in beltLength / beltSpeed seconds, the axis speed being used without a beltSpeed, and the
+boxes queue one box pitch apart at the discharge end. One robot per robotCell picks the boxes, one pick at a time,
+the restart timers wait for the robot of the cell like they wait for robot_is_picking on the line.
+Boxes enter at the upstream end of every series and on every Transfer conveyor, as fast as there is room or
+every --arrival-interval seconds.
+Time jumps from one event to the next instead of ticking, a run takes time per box moved, not per simulated second.
+The robot handshake, the speed profiles and the sensor filters are not simulated.
+The conveyors are simulated as their controller behaves, not as intended. A conveyor its controller leaves stuck in
+a state is reported as stalled, with the reason, and the line then has no throughput.
+
+Usage: python3 tools/line_simulator.py [configured_conveyors.json] [--hours 8] [--pick-time 5] [--json report.json]
+"""
+import argparse
+import heapq
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from conveyor_types.definitions.conveyor_definitions import *
+from helpers.conveyor_configuration import CONVEYOR_TYPES, PARENT_CONVEYOR_TYPES, get_conveyor_config
+from helpers.line_status import LineStatus, classify_state, is_active
+from helpers.pneumatic_model import DEFAULT_RETRACT_CLEARANCE
+from tools.trace_analyzer import StreamingHistogram
+
+EPSILON = 1e-6
+INFINITY = float('inf')
+
+# Used for the belts and robots the configuration does not describe
+DEFAULT_TRANSIT_TIME = 3.0
+DEFAULT_BOX_PITCH = 0.6
+DEFAULT_PICK_TIME = 5.0
+DEFAULT_HOURS = 8.0
+
+# Number of passes over the line at one instant before the simulation is considered stuck in a loop
+SETTLE_PASSES = 100
+
+# Conveyor types restarting once the retracting pusher is clear when retractOverlapEnabled is set, the others wait
+# for the pick and restart on their full timers
+OVERLAPPED_RETRACT_TYPES = ("AccumulatingConveyor",)
+
+
+def transit_time_of(config: dict, default=DEFAULT_TRANSIT_TIME):
+    """ Time for a box to cross the conveyor, from beltLength and beltSpeed or the speed of the axis."""
+    belt_length = config.get(BELT_LENGTH)
+    belt_speed = config.get(BELT_SPEED) or config.get(AXIS_PARAMETERS, {}).get(SPEED)
+    if belt_length and belt_speed:
+        return belt_length / belt_speed
+    return default
+
+
+def delay_of(value, default=0.0):
+    """ A timer delay of the configuration, default when it is not set."""
+    return float(value) if value is not None else default
+
+
+class SimulatedBelt:
+    """
+    SimulatedBelt holds the boxes on a belt, discharge end first. Each box is the travel time left before it reaches
+    the discharge end and the time it entered the line. The boxes stay one pitch apart, a box at the end waits there
+    while the belt runs under it.
+    """
+
+    def __init__(self, transit_time: float, pitch: float):
+        self.transit_time = max(transit_time, EPSILON)
+        self.pitch = min(pitch, self.transit_time)
+        self.running = False
+        self.boxes = []
+
+    def advance(self, elapsed: float):
+        if not self.running or elapsed <= 0.0:
+            return
+        limit = 0.0
+        pitch = self.pitch
+        for box in self.boxes:
+            remaining = box[0] - elapsed
+            box[0] = remaining if remaining > limit else limit
+            limit = box[0] + pitch
+
+    def head_at_end(self):
+        boxes = self.boxes
+        return bool(boxes) and boxes[0][0] <= EPSILON
+
+    def second_at_end(self):
+        """ A second box queued behind the one at the end, where the accumulation sensor is."""
+        return len(self.boxes) > 1 and self.boxes[1][0] <= self.pitch + EPSILON
+
+    def has_room(self, gap=0.0):
+        """ True when a box fits at the entry, gap seconds of belt after the last box are kept free."""
+        boxes = self.boxes
+        return not boxes or boxes[-1][0] <= self.transit_time - (gap if gap > self.pitch else self.pitch) + EPSILON
+
+    def add(self, entered: float, remaining=None):
+        remaining = self.transit_time if remaining is None else remaining
+        position = len(self.boxes)
+        while position > 0 and self.boxes[position - 1][0] > remaining:
+            position -= 1
+        self.boxes.insert(position, [remaining, entered])
+
+    def remove_head(self):
+        return self.boxes.pop(0)
+
+    def next_event(self):
+        """ Time until a box reaches the end, the accumulation sensor or leaves room at the entry."""
+        boxes = self.boxes
+        if not self.running or not boxes:
+            return INFINITY
+        pitch = self.pitch
+        # A box moves when it has room ahead of it, the boxes behind the first one that moves all move with it
+        limit = 0.0
+        for moving, box in enumerate(boxes):
+            if box[0] > limit + EPSILON:
+                break
+            limit = box[0] + pitch
+        else:
+            return INFINITY
+        event = INFINITY
+        if moving == 0 and boxes[0][0] > EPSILON:
+            event = boxes[0][0]
+        if moving <= 1 and len(boxes) > 1 and EPSILON < boxes[1][0] - pitch < event:
+            event = boxes[1][0] - pitch
+        room = boxes[-1][0] - (self.transit_time - pitch)
+        return room if EPSILON < room < event else event
+
+
+class SimulatedElement:
+    """
+    SimulatedElement is a robot, a source or a conveyor of the simulated line. It is only stepped when an event
+    touches it or one of its neighbours, and its statistics are brought up to date when it is, or before another
+    element reads its belt, so the cost of an event does not grow with the length of the line.
+    Attributes:
+        neighbours: The elements whose decisions depend on this one, or that this one depends on.
+        watchers: The elements whose decisions read this one, stepped again when it changes.
+        last_sync: The simulated time the statistics of the element are up to date at.
+        wake: The simulated time of the next event of the element.
+    """
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+        self.neighbours = []
+        self.watchers = ()
+        self.last_sync = simulator.now
+        self.wake = INFINITY
+
+    def sync(self, now: float):
+        elapsed = now - self.last_sync
+        if elapsed > 0.0:
+            self.account(elapsed)
+        self.last_sync = now
+
+    def account(self, elapsed: float):
+        pass
+
+    def update(self, now: float):
+        """ Steps the element, True when it changed anything."""
+        return False
+
+    def next_event(self, now: float):
+        """ The simulated time of the next event of the element, now being the current one."""
+        return INFINITY
+
+
+class SimulatedRobot(SimulatedElement):
+    """
+    SimulatedRobot picks the boxes of the conveyors of one robot cell, in the order they became ready.
+    """
+
+    def __init__(self, simulator, name, pick_time: float, jitter: float, generator: random.Random):
+        super().__init__(simulator)
+        self.name = name
+        self.pick_time = pick_time
+        self.jitter = jitter
+        self.random = generator
+        self.waiting = []
+        self.blocked = []
+        self.picking = None
+        self.done_time = INFINITY
+        self.picks = 0
+        self.busy_seconds = 0.0
+
+    def is_picking(self):
+        return self.picking is not None
+
+    def wait_until_done(self, conveyor):
+        """ Steps a conveyor again when the current pick is done."""
+        if conveyor not in self.blocked:
+            self.blocked.append(conveyor)
+
+    def request(self, conveyor):
+        if conveyor is not self.picking:
+            if conveyor not in self.waiting:
+                self.waiting.append(conveyor)
+            self.simulator.touch(self)
+
+    def pick_duration(self):
+        if not self.jitter:
+            return self.pick_time
+        return max(EPSILON, self.pick_time * (1.0 + self.random.uniform(-self.jitter, self.jitter)))
+
+    def update(self, now: float):
+        if self.picking is not None and now >= self.done_time - EPSILON:
+            conveyor = self.picking
+            conveyor.sync(now)
+            self.picking = None
+            self.done_time = INFINITY
+            self.picks += 1
+            conveyor.picked(now)
+            self.simulator.changed(conveyor)
+            for blocked in self.blocked:
+                self.simulator.touch(blocked)
+            self.blocked.clear()
+            # The next pick starts on the next pass, after the conveyors saw the robot stop picking
+            if self.waiting:
+                self.simulator.touch(self)
+            return True
+        if self.picking is None:
+            for conveyor in self.waiting:
+                conveyor.sync(now)
+            for conveyor in self.waiting:
+                if conveyor.ready_for_pick():
+                    self.waiting.remove(conveyor)
+                    self.picking = conveyor
+                    self.done_time = now + self.pick_duration()
+                    conveyor.pick_started(now)
+                    return True
+            # Conveyors that stopped being ready are forgotten, they ask again when they are
+            if self.waiting:
+                self.waiting = [conveyor for conveyor in self.waiting if conveyor.ready_for_pick()]
+        return False
+
+    def next_event(self, now: float):
+        return self.done_time
+
+    def account(self, elapsed: float):
+        if self.picking is not None:
+            self.busy_seconds += elapsed
+
+    def reset_statistics(self):
+        self.picks = 0
+        self.busy_seconds = 0.0
+
+
+class SimulatedSource(SimulatedElement):
+    """
+    SimulatedSource feeds boxes at the entry of a conveyor, as fast as there is room without an interval,
+    every interval seconds otherwise. Boxes that do not fit wait in front of the conveyor.
+    """
+
+    def __init__(self, simulator, conveyor, interval: float, poisson: bool):
+        super().__init__(simulator)
+        self.conveyor = conveyor
+        self.interval = interval
+        self.poisson = poisson
+        self.waiting = 0
+        self.next_arrival = 0.0 if interval else INFINITY
+        self.boxes = 0
+        self.waiting_seconds = 0.0
+        self.max_waiting = 0
+        self.neighbours.append(conveyor)
+
+    def gap(self):
+        if self.poisson:
+            return self.simulator.random.expovariate(1.0 / self.interval)
+        return self.interval
+
+    def update(self, now: float):
+        """ Stepped with its conveyor, which is synced already."""
+        if self.last_sync != now:
+            self.sync(now)
+        changed = False
+        while now >= self.next_arrival - EPSILON:
+            self.waiting += 1
+            if self.waiting > self.max_waiting:
+                self.max_waiting = self.waiting
+            self.next_arrival += self.gap()
+            changed = True
+        if not self.waiting and self.interval:
+            return changed
+        if self.conveyor.accepts():
+            self.conveyor.receive(now, now)
+            self.boxes += 1
+            if self.interval:
+                self.waiting -= 1
+            changed = True
+        return changed
+
+    def account(self, elapsed: float):
+        self.waiting_seconds += self.waiting * elapsed
+
+    def reset_statistics(self):
+        self.boxes = 0
+        self.waiting_seconds = 0.0
+        self.max_waiting = self.waiting
+
+
+class SimulatedConveyor(SimulatedElement):
+    """
+    SimulatedConveyor is the belt, the state and the statistics of one conveyor. The subclasses follow the run()
+    of their conveyor type, step() returns True when it changed anything so the line is stepped until it settles.
+    Attributes:
+        index: The index the conveyor gets from configure_conveyors.
+        belt: The SimulatedBelt of the conveyor.
+        parent: The SimulatedConveyor the conveyor is attached to, None for a parent.
+        downstream: The SimulatedConveyor the boxes at the end move onto, None when they are picked.
+        robot: The SimulatedRobot picking from the conveyor, None if it is not picked.
+        stalled: A string, why the controller keeps the conveyor stuck in its state, None while it is not.
+    """
+
+    picked_boxes = 1
+
+    def __init__(self, simulator, index, conveyor_type: str, config: dict, pitch: float):
+        super().__init__(simulator)
+        self.index = index
+        self.type = conveyor_type
+        self.config = config
+        self.name = config.get(CONVEYOR_NAME)
+        self.belt = SimulatedBelt(transit_time_of(config), pitch)
+        self.parent = None
+        self.downstream = None
+        self.robot = None
+        self.source = None
+        self.state = 'INIT'
+        self.deadline = INFINITY
+        self.merging = 0
+        self.stalled = None
+        pusher_config = config.get(PUSHER_CONFIG, {})
+        self.pusher_present = bool(pusher_config.get(PUSHER_PRESENT))
+        self.extend_delay = delay_of(pusher_config.get(EXTEND_DELAY_SEC)) if self.pusher_present else 0.0
+        self.retract_delay = delay_of(pusher_config.get(RETRACT_DELAY_SEC)) if self.pusher_present else 0.0
+        # Time the state machine waits on the retract, shorter when the restart overlaps the end of the stroke
+        self.retract_wait = self.retract_delay
+        if conveyor_type in OVERLAPPED_RETRACT_TYPES and pusher_config.get(RETRACT_OVERLAP_ENABLED):
+            self.retract_wait *= pusher_config.get(RETRACT_CLEARANCE, DEFAULT_RETRACT_CLEARANCE)
+        self.reset_statistics()
+
+    def reset_statistics(self):
+        # Seconds spent in each (state, box at the end) pair, classified once in the report
+        self.segment_seconds = {}
+        self.box_seconds = 0.0
+        self.max_boxes = len(self.belt.boxes)
+        self.boxes_out = 0
+
+    def set_state(self, state: str, running=None):
+        self.state = state
+        if running is not None:
+            self.belt.running = running
+
+    def start(self, now: float):
+        self.set_state('RUNNING', True)
+
+    def accepts(self):
+        """ True when a box can move onto the conveyor now, a box being pushed onto it keeps its entry."""
+        return self.belt.running and not self.merging and self.belt.has_room()
+
+    def receive(self, entered: float, now: float, remaining=None):
+        self.belt.add(entered, remaining)
+        if len(self.belt.boxes) > self.max_boxes:
+            self.max_boxes = len(self.belt.boxes)
+
+    def step(self, now: float):
+        return False
+
+    def update(self, now: float):
+        """
+        Steps the conveyor until it settles, the boxes at its entry fed by its source included. The states it only
+        passes through at one instant are not seen by the others, like its run() holds each state for a scan.
+        """
+        changed = False
+        source = self.source
+        for _ in range(SETTLE_PASSES):
+            progressed = self.step(now)
+            if self.downstream is not None and self.hand_off(now):
+                progressed = True
+            if source is not None and source.update(now):
+                progressed = True
+            if not progressed:
+                return changed
+            changed = True
+        raise RuntimeError(f"Conveyor {self.index} does not settle at {now:.3f} s")
+
+    def hand_off(self, now: float):
+        """ Moves the box at the end onto the downstream conveyor when it takes it."""
+        downstream = self.downstream
+        if downstream is None or not self.belt.running or not self.belt.head_at_end():
+            return False
+        if downstream.last_sync != now:
+            downstream.sync(now)
+        if not downstream.accepts():
+            return False
+        box = self.belt.remove_head()
+        self.boxes_out += 1
+        downstream.receive(box[1], now)
+        self.simulator.touch(downstream)
+        return True
+
+    def ready_for_pick(self):
+        return False
+
+    def pick_started(self, now: float):
+        pass
+
+    def picked(self, now: float):
+        """ Removes the picked_boxes boxes at the front, the robot takes them together."""
+        for _ in range(min(self.picked_boxes, len(self.belt.boxes))):
+            box = self.belt.remove_head()
+            self.boxes_out += 1
+            self.simulator.box_picked(box[1], now)
+
+    def timer_done(self, now: float):
+        return now >= self.deadline - EPSILON
+
+    def next_event(self, now: float):
+        """ The next timer, box or arrival of its source, a source is only stepped with its conveyor."""
+        event = self.deadline
+        if self.source is not None and self.source.next_arrival < event:
+            event = self.source.next_arrival
+        belt = self.belt
+        if belt.running and belt.boxes:
+            moved = now + belt.next_event()
+            if moved < event:
+                return moved
+        return event
+
+    def account(self, elapsed: float):
+        belt = self.belt
+        boxes = belt.boxes
+        segment_seconds = self.segment_seconds
+        if boxes:
+            key = (self.state, boxes[0][0] <= EPSILON)
+            segment_seconds[key] = segment_seconds.get(key, 0.0) + elapsed
+            self.box_seconds += len(boxes) * elapsed
+            if belt.running:
+                belt.advance(elapsed)
+        else:
+            key = (self.state, False)
+            segment_seconds[key] = segment_seconds.get(key, 0.0) + elapsed
+
+    def report(self, duration: float):
+        parent = self.parent.index if self.parent is not None else None
+        state_seconds = {}
+        status_seconds = {status: 0.0 for status in LineStatus}
+        active_seconds = 0.0
+        for (state, box_at_end), seconds in self.segment_seconds.items():
+            state_seconds[state] = state_seconds.get(state, 0.0) + seconds
+            status = classify_state(state, box_at_end)
+            status_seconds[status] += seconds
+            if is_active(state, status):
+                active_seconds += seconds
+        return {
+            "type": self.type,
+            "name": self.name,
+            "parent": parent,
+            "transit_sec": self.belt.transit_time,
+            "boxes": self.boxes_out,
+            "boxesPerHour": self.boxes_out / duration * 3600.0 if duration else None,
+            "utilization": active_seconds / duration if duration else None,
+            "statusShare": {status.name.lower(): seconds / duration if duration else None
+                            for status, seconds in status_seconds.items()},
+            "stateShare": {state: seconds / duration for state, seconds in sorted(state_seconds.items())
+                           if duration},
+            "meanQueue": self.box_seconds / duration if duration else None,
+            "maxQueue": self.max_boxes,
+            "stalled": self.stalled,
+        }
+
+
+class SimulatedSimple(SimulatedConveyor):
+    """ SimpleConveyor, stops with a box at the end until it is taken away, by the robot of its cell here."""
+
+    def step(self, now):
+        if self.state == 'RUNNING' and self.belt.head_at_end():
+            self.set_state('STOPPING', False)
+            self.robot.request(self)
+            return True
+        if self.state == 'STOPPING' and not self.belt.head_at_end():
+            self.set_state('RUNNING', True)
+            return True
+        return False
+
+    def ready_for_pick(self):
+        return self.state == 'STOPPING' and self.belt.head_at_end()
+
+
+class SimulatedInfeed(SimulatedConveyor):
+    """
+    InfeedConveyor and CustomConveyor, stop with a box at the end, push it and wait for the pick.
+    They restart pusher retractDelay_sec after the box is gone and the robot stopped picking.
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.restart_delay = self.retract_delay
+        self.box_was_picked = False
+        self.restart_started = False
+
+    def step(self, now):
+        if self.state == 'RUNNING':
+            if self.belt.head_at_end():
+                if self.pusher_present:
+                    self.set_state('PUSHING', False)
+                    self.deadline = now + self.extend_delay
+                else:
+                    self.wait_for_pick()
+                return True
+        elif self.state == 'PUSHING':
+            if self.timer_done(now):
+                self.set_state('RETRACT')
+                self.deadline = now + self.retract_wait
+                return True
+        elif self.state == 'RETRACT':
+            if self.timer_done(now):
+                self.wait_for_pick()
+                return True
+        elif self.state == 'WAITING_FOR_PICK':
+            return self.step_restart(now)
+        return False
+
+    def wait_for_pick(self):
+        self.set_state('WAITING_FOR_PICK', False)
+        self.deadline = INFINITY
+        self.box_was_picked = False
+        self.restart_started = False
+        self.robot.request(self)
+
+    def step_restart(self, now):
+        """ Starts the restart timer once the box is gone and the robot is not picking, restarts when it is done."""
+        if not self.box_was_picked:
+            return False
+        if not self.restart_started:
+            if self.robot.is_picking():
+                self.robot.wait_until_done(self)
+                return False
+            self.restart_started = True
+            self.deadline = now + self.restart_delay
+        if self.timer_done(now):
+            self.deadline = INFINITY
+            self.restart_started = False
+            self.set_state('RUNNING', True)
+            return True
+        return False
+
+    def ready_for_pick(self):
+        return self.state == 'WAITING_FOR_PICK' and not self.box_was_picked and self.belt.head_at_end()
+
+    def picked(self, now):
+        super().picked(now)
+        self.box_was_picked = True
+
+
+class SimulatedAccumulating(SimulatedInfeed):
+    """
+    AccumulatingConveyor, squares the first box with the pusher and keeps running to queue the next ones.
+    It stops for the pick when the robot starts picking, or after the box and accumulation sensors were both on
+    for accumulationTime. It restarts restartTime after the pick.
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.restart_delay = delay_of(self.config.get(RESTART_TIME))
+        accumulation_time = self.config.get(ACCUMULATION_TIME)
+        self.accumulation_time = float(accumulation_time) if accumulation_time is not None else None
+        self.first_box_ready = False
+        self.accumulated = 0.0
+        self.accumulating_since = None
+
+    def pause_accumulation(self, now):
+        if self.accumulating_since is not None:
+            self.accumulated += now - self.accumulating_since
+            self.accumulating_since = None
+
+    def step(self, now):
+        if self.state == 'RUNNING':
+            head = self.belt.head_at_end()
+            if head and self.belt.second_at_end():
+                if self.accumulating_since is None:
+                    self.accumulating_since = now
+            else:
+                self.pause_accumulation(now)
+
+            if self.pusher_present and head and not self.first_box_ready:
+                self.pause_accumulation(now)
+                self.set_state('PUSHING', False)
+                self.deadline = now + self.extend_delay
+                return True
+            if self.accumulation_time is not None and self.accumulating_since is not None:
+                done_time = self.accumulating_since + self.accumulation_time - self.accumulated
+                if now >= done_time - EPSILON:
+                    self.accumulated = 0.0
+                    self.accumulating_since = None
+                    self.wait_for_pick()
+                    return True
+                self.deadline = done_time
+            else:
+                self.deadline = INFINITY
+            if self.first_box_ready and head:
+                self.robot.request(self)
+            return False
+        elif self.state == 'PUSHING':
+            if self.timer_done(now):
+                self.set_state('RETRACT')
+                self.deadline = now + self.retract_wait
+                return True
+        elif self.state == 'RETRACT':
+            if self.timer_done(now):
+                self.deadline = INFINITY
+                self.first_box_ready = True
+                self.set_state('RUNNING', True)
+                return True
+        elif self.state == 'WAITING_FOR_PICK':
+            self.first_box_ready = False
+            return self.step_restart(now)
+        return False
+
+    def ready_for_pick(self):
+        if self.state == 'RUNNING':
+            return self.first_box_ready and self.belt.head_at_end()
+        return super().ready_for_pick()
+
+    def pick_started(self, now):
+        if self.state == 'RUNNING':
+            self.pause_accumulation(now)
+            self.wait_for_pick()
+            self.simulator.changed(self)
+
+
+class SimulatedZoneAccumulating(SimulatedConveyor):
+    """
+    ZoneAccumulatingConveyor, one box per zone and the boxes never touch. The zones share one drive here, so the
+    whole conveyor holds for restartTime after a pick, like the shared drive does.
+    """
+
+    def __init__(self, simulator, index, conveyor_type, config, pitch):
+        zones = max(1, len(config.get(ZONES, [])))
+        super().__init__(simulator, index, conveyor_type, config, pitch)
+        self.belt.pitch = self.belt.transit_time / zones
+        self.restart_delay = delay_of(config.get(RESTART_TIME))
+        self.holding = False
+
+    def start(self, now):
+        self.belt.running = True
+        self.update_state()
+
+    def update_state(self):
+        if self.belt.running and self.belt.has_room():
+            state = 'RUNNING'
+        elif self.belt.head_at_end():
+            state = 'WAITING_FOR_PICK'
+        else:
+            state = 'STOPPING'
+        changed = state != self.state
+        self.state = state
+        return changed
+
+    def step(self, now):
+        changed = False
+        if self.holding and self.timer_done(now):
+            self.holding = False
+            self.deadline = INFINITY
+            self.belt.running = True
+            changed = True
+        if self.belt.head_at_end() and not self.holding:
+            self.robot.request(self)
+        return self.update_state() or changed
+
+    def ready_for_pick(self):
+        return self.belt.head_at_end() and not self.holding
+
+    def picked(self, now):
+        super().picked(now)
+        if self.restart_delay > 0.0:
+            self.holding = True
+            self.belt.running = False
+            self.deadline = now + self.restart_delay
+
+
+class SimulatedDoublePickInfeed(SimulatedInfeed):
+    """
+    DoublePickInfeedConveyor, lets two boxes past its stopper, waits sustainTime once both are at the end, pushes
+    them and the robot picks both at once. It restarts restartTime after the pick and runs pacingTime in PACING
+    before letting the next boxes past its stopper.
+    """
+
+    picked_boxes = 2
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.restart_delay = delay_of(self.config.get(RESTART_TIME))
+        self.sustain_time = delay_of(self.config.get(SUSTAIN_TIME))
+        self.pacing_time = delay_of(self.config.get(PACING_TIME))
+        self.boxes_to_queue = 2
+        self.sustain_since = None
+
+    def start(self, now):
+        self.boxes_to_queue = 2
+        self.set_state('QUEUEING', True)
+
+    def accepts(self):
+        if self.state != 'QUEUEING' or self.boxes_to_queue <= 0:
+            return False
+        return super().accepts()
+
+    def receive(self, entered, now, remaining=None):
+        super().receive(entered, now, remaining)
+        self.boxes_to_queue -= 1
+
+    def step(self, now):
+        if self.state == 'QUEUEING':
+            if self.boxes_to_queue <= 0:
+                self.set_state('RUNNING', True)
+                return True
+        elif self.state == 'RUNNING':
+            if self.belt.head_at_end() and self.belt.second_at_end():
+                if self.sustain_since is None:
+                    self.sustain_since = now
+                    self.deadline = now + self.sustain_time
+                if self.timer_done(now):
+                    self.sustain_since = None
+                    if self.pusher_present:
+                        self.set_state('PUSHING', False)
+                        self.deadline = now + self.extend_delay
+                    else:
+                        self.wait_for_pick()
+                    return True
+        elif self.state in ('PUSHING', 'RETRACT'):
+            return super().step(now)
+        elif self.state == 'WAITING_FOR_PICK':
+            if self.step_restart(now):
+                self.boxes_to_queue = 2 - len(self.belt.boxes)
+                self.set_state('PACING', True)
+                self.deadline = now + self.pacing_time
+                return True
+        elif self.state == 'PACING':
+            if self.timer_done(now):
+                self.deadline = INFINITY
+                self.set_state('QUEUEING')
+                return True
+        return False
+
+    def ready_for_pick(self):
+        return self.state == 'WAITING_FOR_PICK' and not self.box_was_picked and self.belt.head_at_end()
+
+
+class SimulatedFollower(SimulatedConveyor):
+    """ FollowerConveyor, runs while its parent is RUNNING."""
+
+    def start(self, now):
+        self.step(now)
+
+    def step(self, now):
+        running = self.parent.state == 'RUNNING'
+        state = 'RUNNING' if running else 'STOPPING'
+        if state == self.state and running == self.belt.running:
+            return False
+        self.set_state(state, running)
+        return True
+
+
+class SimulatedQueueing(SimulatedConveyor):
+    """ QueueingConveyor, runs while its parent is RUNNING and stops with a box at the end otherwise."""
+
+    def start(self, now):
+        self.set_state('RUNNING', True)
+        self.step(now)
+
+    def step(self, now):
+        if self.parent.state == 'RUNNING':
+            if self.state != 'RUNNING' or not self.belt.running:
+                self.set_state('RUNNING', True)
+                return True
+        elif self.belt.head_at_end() and (self.state != 'STOPPING' or self.belt.running):
+            self.set_state('STOPPING', False)
+            return True
+        return False
+
+
+class SimulatedTransfer(SimulatedConveyor):
+    """
+    TransferConveyor, stops with a box at the end and pushes it onto the entry of its parent while the parent is
+    RUNNING and a box fits, with minimumGap_sec of free belt after the last box when metering is enabled.
+    The entry of the parent is kept for the box while it is pushed, a waiting transfer goes before the series.
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.minimum_gap = delay_of(self.config.get(MINIMUM_GAP)) if self.config.get(METERING_ENABLED) else 0.0
+
+    def merge_allowed(self):
+        return (self.parent.state == 'RUNNING' and self.parent.accepts()
+                and self.parent.belt.has_room(self.minimum_gap))
+
+    def step(self, now):
+        if self.state == 'RUNNING':
+            if self.belt.head_at_end():
+                self.set_state('STOPPING', False)
+                return True
+        elif self.state == 'STOPPING':
+            self.parent.sync(now)
+            if self.merge_allowed():
+                if self.pusher_present:
+                    self.set_state('PUSHING')
+                    self.deadline = now + self.extend_delay
+                    self.parent.merging += 1
+                else:
+                    self.merge(now)
+                    self.set_state('WAITING')
+                return True
+        elif self.state == 'PUSHING':
+            if self.timer_done(now):
+                self.parent.merging -= 1
+                self.merge(now)
+                self.set_state('RETRACT')
+                self.deadline = now + self.retract_delay
+                return True
+        elif self.state == 'RETRACT':
+            if self.timer_done(now):
+                self.deadline = INFINITY
+                self.set_state('WAITING')
+                return True
+        elif self.state == 'WAITING':
+            if not self.belt.head_at_end():
+                self.set_state('RUNNING', True)
+                return True
+        return False
+
+    def merge(self, now):
+        self.parent.sync(now)
+        if self.belt.head_at_end():
+            box = self.belt.remove_head()
+            self.boxes_out += 1
+            self.parent.receive(box[1], now)
+        self.simulator.changed(self.parent)
+
+
+SIMULATED_CONVEYOR_TYPES = {
+    "SimpleConveyor": SimulatedSimple,
+    "InfeedConveyor": SimulatedInfeed,
+    "CustomConveyor": SimulatedInfeed,
+    "AccumulatingConveyor": SimulatedAccumulating,
+    "ZoneAccumulatingConveyor": SimulatedZoneAccumulating,
+    "DoublePickInfeedConveyor": SimulatedDoublePickInfeed,
+    "FollowerConveyor": SimulatedFollower,
+    "QueueingConveyor": SimulatedQueueing,
+    "TransferConveyor": SimulatedTransfer,
+}
+
+
+class LineSimulator:
+    """
+    LineSimulator builds the simulated conveyors, robots and sources of a configuration and runs them
+    from event to event.
+    Methods:
+        run: Simulates the line for a duration and returns the report.
+    """
+
+    def __init__(self, configuration_data: dict, pick_time=DEFAULT_PICK_TIME, pick_jitter=0.0,
+                 arrival_interval=0.0, poisson=False, box_pitch=DEFAULT_BOX_PITCH, seed=1):
+        self.random = random.Random(seed)
+        self.conveyors = []
+        self.robots = {}
+        self.sources = []
+        self.now = 0.0
+        self.events = 0
+        self.boxes = 0
+        self.lead_times = StreamingHistogram()
+        self.pending = deque()
+        self.pending_set = set()
+        self.wakes = []
+        self.sequence = itertools.count()
+        self.build(configuration_data, pick_time, pick_jitter, arrival_interval, poisson, box_pitch)
+        self.elements = list(self.robots.values()) + self.conveyors + self.sources
+        self.link_neighbours()
+
+    def build(self, configuration_data, pick_time, pick_jitter, arrival_interval, poisson, box_pitch):
+        """ Builds the conveyors in the order of the configuration and attaches them like configure_conveyors."""
+        parent = None
+        last_in_series = {}
+        index = 1
+        for conveyor_config in configuration_data[LIST_OF_ALL_CONVEYORS].values():
+            conveyor_type = conveyor_config.get(TYPE)
+            if conveyor_type in CONVEYOR_TYPES:
+                conveyor = SIMULATED_CONVEYOR_TYPES[conveyor_type](self, index, conveyor_type, conveyor_config,
+                                                                   box_pitch)
+                if conveyor_type in ("FollowerConveyor", "QueueingConveyor", "TransferConveyor"):
+                    if parent is None:
+                        raise ValueError(f"{conveyor_type} {index} has no conveyor before it to attach to")
+                    conveyor.parent = parent
+                    if conveyor_type != "TransferConveyor":
+                        conveyor.downstream = last_in_series[parent.index]
+                        last_in_series[parent.index] = conveyor
+                else:
+                    cell = conveyor_config.get(ROBOT_CELL) or None
+                    if cell not in self.robots:
+                        self.robots[cell] = SimulatedRobot(self, cell, pick_time, pick_jitter, self.random)
+                    conveyor.robot = self.robots[cell]
+                    last_in_series[conveyor.index] = conveyor
+                    if conveyor_type in PARENT_CONVEYOR_TYPES:
+                        parent = conveyor
+                self.conveyors.append(conveyor)
+            index = index + 1
+
+        # Boxes enter at the upstream end of every series and on every transfer
+        for conveyor in self.conveyors:
+            if conveyor.type == "TransferConveyor" or conveyor in last_in_series.values():
+                self.sources.append(SimulatedSource(self, conveyor, arrival_interval, poisson))
+
+    def box_picked(self, entered: float, now: float):
+        self.boxes += 1
+        self.lead_times.observe(now - entered)
+
+    def link_neighbours(self):
+        """ Links every conveyor with the robot, sources and conveyors whose decisions depend on it, both ways."""
+        for conveyor in self.conveyors:
+            for other in (conveyor.parent, conveyor.downstream, conveyor.robot):
+                if other is not None and other not in conveyor.neighbours:
+                    conveyor.neighbours.append(other)
+                    # A transfer is stepped before the series when room opens on its parent
+                    if conveyor.type == "TransferConveyor":
+                        other.neighbours.insert(0, conveyor)
+                    else:
+                        other.neighbours.append(conveyor)
+        for source in self.sources:
+            source.conveyor.neighbours.append(source)
+            source.conveyor.source = source
+        # A conveyor is read by the conveyors feeding it and the ones attached to it, a source is stepped with the
+        # conveyor it feeds. A robot wakes the conveyors it picked from or held back itself
+        for conveyor in self.conveyors:
+            conveyor.watchers = tuple(other for other in conveyor.neighbours if isinstance(other, SimulatedConveyor)
+                                      and conveyor in (other.downstream, other.parent))
+        for source in self.sources:
+            source.watchers = (source.conveyor,)
+
+    def touch(self, element):
+        """ Queues an element to be stepped at the current instant."""
+        if element not in self.pending_set:
+            self.pending_set.add(element)
+            self.pending.append(element)
+
+    def changed(self, element):
+        """ Queues an element another one changed, and the elements reading it."""
+        self.touch(element)
+        for watcher in element.watchers:
+            self.touch(watcher)
+
+    def settle(self, now: float, woken):
+        """
+        Steps the woken elements and their watchers at one instant, an element that changed queues its watchers
+        again, until nothing changes anymore. Only the part of the line an event touches is stepped, and only the
+        elements stepped are scheduled again. touch and sync are inlined, this loop is most of the time of a run.
+        """
+        pending = self.pending
+        pending_set = self.pending_set
+        for element in woken:
+            for other in (element, *element.watchers):
+                if other not in pending_set:
+                    pending_set.add(other)
+                    pending.append(other)
+        budget = SETTLE_PASSES * len(self.elements)
+        # In stepping order, a set would schedule the elements waking at the same time in an arbitrary order
+        stepped = {}
+        while pending:
+            budget -= 1
+            if budget < 0:
+                raise RuntimeError(f"The simulated line does not settle at {now:.3f} s")
+            element = pending.popleft()
+            pending_set.discard(element)
+            if element.last_sync != now:
+                element.sync(now)
+            stepped[element] = None
+            if element.update(now):
+                for other in element.watchers:
+                    if other not in pending_set:
+                        pending_set.add(other)
+                        pending.append(other)
+        wakes = self.wakes
+        sequence = self.sequence
+        for element in stepped:
+            wake = element.next_event(now)
+            if wake != element.wake:
+                element.wake = wake
+                if now < wake < INFINITY:
+                    heapq.heappush(wakes, (wake, next(sequence), element))
+
+    def next_event(self):
+        """ The time of the next event and the elements it wakes."""
+        wakes = self.wakes
+        while wakes and (wakes[0][2].wake != wakes[0][0] or wakes[0][0] <= self.now):
+            heapq.heappop(wakes)
+        if not wakes:
+            return INFINITY, []
+        next_time = wakes[0][0]
+        woken = []
+        while wakes and wakes[0][0] <= next_time + EPSILON:
+            wake, _, element = heapq.heappop(wakes)
+            if element.wake == wake:
+                woken.append(element)
+        return next_time, woken
+
+    def sync_all(self):
+        for element in self.elements:
+            element.sync(self.now)
+
+    def reset_statistics(self):
+        self.sync_all()
+        self.boxes = 0
+        self.lead_times = StreamingHistogram()
+        for element in self.elements:
+            element.reset_statistics()
+
+    def run(self, duration: float, warmup=0.0):
+        """ Simulates warmup then duration seconds, the statistics only cover the duration."""
+        started = time.perf_counter()
+        for conveyor in self.conveyors:
+            conveyor.start(self.now)
+        end = warmup + duration
+        warming_up = warmup > 0.0
+        woken = self.elements
+        while True:
+            self.settle(self.now, woken)
+            self.events += 1
+            if self.now >= end:
+                break
+            target, woken = self.next_event()
+            if warming_up and target > warmup:
+                target, woken = warmup, self.put_back(woken)
+            elif target > end:
+                target, woken = end, self.put_back(woken)
+            self.now = target
+            if warming_up and self.now >= warmup:
+                warming_up = False
+                self.reset_statistics()
+        self.sync_all()
+        return self.report(duration, warmup, time.perf_counter() - started)
+
+    def put_back(self, woken):
+        """ Schedules again the elements of an event that is past the time the simulation stops at."""
+        for element in woken:
+            heapq.heappush(self.wakes, (element.wake, next(self.sequence), element))
+        return []
+
+    def report(self, duration: float, warmup: float, wall_time: float):
+        conveyors = {conveyor.index: conveyor.report(duration) for conveyor in self.conveyors}
+        stalled = {conveyor.index: conveyor.stalled for conveyor in self.conveyors if conveyor.stalled}
+        bottleneck = None
+        if conveyors:
+            bottleneck = max(conveyors, key=lambda index: conveyors[index]["utilization"] or 0.0)
+        robots = {}
+        for name, robot in self.robots.items():
+            robots[name or "default"] = {
+                "picks": robot.picks,
+                "utilization": robot.busy_seconds / duration if duration else None,
+            }
+        sources = {}
+        for source in self.sources:
+            sources[source.conveyor.index] = {
+                "boxes": source.boxes,
+                "meanWaiting": source.waiting_seconds / duration if duration and source.interval else None,
+                "maxWaiting": source.max_waiting if source.interval else None,
+            }
+        return {
+            "simulation": {
+                "duration_sec": duration,
+                "warmup_sec": warmup,
+                "events": self.events,
+                "wallTime_sec": wall_time,
+            },
+            "line": {
+                "boxes": self.boxes,
+                # A stalled line stops delivering boxes, it has no steady throughput to predict
+                "boxesPerHour": self.boxes / duration * 3600.0 if duration and not stalled else None,
+                "stalled": stalled,
+                "bottleneck": bottleneck,
+                "bottleneckType": conveyors[bottleneck]["type"] if bottleneck else None,
+                "leadTime": self.lead_times.summary(),
+            },
+            "robots": robots,
+            "sources": sources,
+            "conveyors": conveyors,
+        }
+
+
+def simulate(configuration_data: dict, duration: float, warmup=0.0, **parameters):
+    """
+    Simulates a configuration.
+
+    Parameters
+    ----------
+    configuration_data : dict
+        The configuration, as in configured_conveyors.json
+    duration : float
+        Time in seconds the statistics are collected over
+    warmup : float, optional
+        Time in seconds simulated before the statistics are collected
+    parameters :
+        pick_time, pick_jitter, arrival_interval, poisson, box_pitch and seed of the LineSimulator
+
+    Returns
+    ----------
+    dict
+        The report of the line, its robots, its sources and its conveyors
+    """
+    return LineSimulator(configuration_data, **parameters).run(duration, warmup)
+
+
+def format_share(value):
+    return '   -  ' if value is None else f'{value * 100:5.1f}%'
+
+
+def format_summary(report: dict):
+    simulation = report["simulation"]
+    line = report["line"]
+    lines = [
+        f"Simulated {simulation['duration_sec'] / 3600.0:.2f} h in {simulation['wallTime_sec']:.3f} s "
+        f"({simulation['events']} events)",
+    ]
+    if line["stalled"]:
+        lines.append(f"Line: {line['boxes']} boxes picked, no throughput, the line stalls:")
+        for index, reason in line["stalled"].items():
+            lines.append(f"  conveyor {index} stuck in {reason}")
+    else:
+        lines.append(f"Line: {line['boxes']} boxes picked, {line['boxesPerHour']:.0f} boxes/h")
+    if line["bottleneck"]:
+        lines.append(f"Bottleneck: conveyor {line['bottleneck']} ({line['bottleneckType']})")
+    lead_time = line["leadTime"]
+    if lead_time["count"]:
+        lines.append(f"Lead time: mean {lead_time['mean_sec']:.1f} s, p90 {lead_time['p90_sec']:.1f} s, "
+                     f"max {lead_time['max_sec']:.1f} s")
+    for name, robot in report["robots"].items():
+        lines.append(f"Robot {name}: {robot['picks']} picks, busy {format_share(robot['utilization']).strip()}")
+    for index, source in report["sources"].items():
+        if source["meanWaiting"] is not None:
+            lines.append(f"Boxes waiting before conveyor {index}: mean {source['meanWaiting']:.1f}, "
+                         f"max {source['maxWaiting']}")
+    lines.append("")
+    lines.append(f"{'Conveyor':<10}{'Type':<26}{'Util':>7}{'Starved':>8}{'Blocked':>8}{'Queue':>7}{'Max':>5}"
+                 f"{'Boxes/h':>9}")
+    for index, conveyor in report["conveyors"].items():
+        share = conveyor["statusShare"]
+        lines.append(f"{index:<10}{conveyor['type']:<26}{format_share(conveyor['utilization']):>7}"
+                     f"{format_share(share['starved']):>8}{format_share(share['blocked']):>8}"
+                     f"{conveyor['meanQueue']:>7.2f}{conveyor['maxQueue']:>5}{conveyor['boxesPerHour']:>9.0f}"
+                     f"{'  stalled' if conveyor['stalled'] else ''}")
+    return '\n'.join(lines)
+
+
+def load_configuration(path):
+    if path is None:
+        return get_conveyor_config()
+    with open(path) as configuration_file:
+        return json.load(configuration_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('configuration', nargs='?', help="configuration file, configured_conveyors.json by default")
+    parser.add_argument('--hours', type=float, default=DEFAULT_HOURS, help="length of the simulated shift")
+    parser.add_argument('--warmup', type=float, default=0.0, help="seconds simulated before the statistics start")
+    parser.add_argument('--pick-time', type=float, default=DEFAULT_PICK_TIME, help="seconds per robot pick")
+    parser.add_argument('--pick-jitter', type=float, default=0.0,
+                        help="pick times vary uniformly by this fraction of --pick-time")
+    parser.add_argument('--arrival-interval', type=float, default=0.0,
+                        help="seconds between boxes at each entry, 0 feeds as fast as there is room")
+    parser.add_argument('--poisson', action='store_true', help="random arrivals with --arrival-interval on average")
+    parser.add_argument('--box-pitch', type=float, default=DEFAULT_BOX_PITCH,
+                        help="seconds of belt between two queued boxes")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help="write the json report to this file, - for stdout")
+    args = parser.parse_args()
+
+    configuration_data = load_configuration(args.configuration)
+    if not configuration_data.get(LIST_OF_ALL_CONVEYORS):
+        print("The configuration has no conveyors")
+        sys.exit(1)
+    report = simulate(configuration_data, args.hours * 3600.0, args.warmup, pick_time=args.pick_time,
+                      pick_jitter=args.pick_jitter, arrival_interval=args.arrival_interval, poisson=args.poisson,
+                      box_pitch=args.box_pitch, seed=args.seed)
+
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        if args.json:
+            with open(args.json, 'w') as json_file:
+                json.dump(report, json_file, indent=2)
+        print(format_summary(report))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,403 @@
+"""
+Parallel sweep of the timer settings of a configured line, on the simulator of tools/line_simulator.py.
+
+Every conveyor contributes the throughput timers its type uses: accumulationTime, sustainTime and pacingTime.
+Each timer is tried at --factors times its configured value, never below --floor times it. The trials are the
+configured settings, every factor applied to all the timers at once, every factor applied to one timer at a time,
+and --trials random combinations, run on all the CPU cores. Every trial simulates the same boxes and picks,
+so the settings are the only difference between two trials.
+
+restartTime and the pusher delays cover the robot arm and the cylinder clearing the belt, which the simulator
+cannot see, so they are not swept unless --safety-timers is given, and then never below their configured value.
+The pusher delays are only swept for a pusher without sensors, the delay of a sensored pusher is not its stroke.
+
+The configured settings are the ones known to work on the line. The cut of a trial is the largest fraction a timer
+was shortened by from its configured value. The Pareto front is the set of trials no other trial beats on both
+throughput and cut. The fastest trial of the front cutting no timer by more than --max-cut is written as a complete
+configuration, ready to be pushed on the conveyors/configured topic.
+
+Usage: python3 tools/parameter_sweep.py [configured_conveyors.json] [--trials 200] [--output tuned_conveyors.json]
+"""
+import argparse
+import concurrent.futures
+import copy
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from configurations.restart_control import atomic_write_json
+from conveyor_types.definitions.conveyor_definitions import *
+from tools.line_simulator import DEFAULT_BOX_PITCH, DEFAULT_PICK_TIME, load_configuration, simulate
+
+# Throughput timers of the conveyor configuration each type uses
+TIMER_KEYS = {
+    "AccumulatingConveyor": (ACCUMULATION_TIME,),
+    "DoublePickInfeedConveyor": (SUSTAIN_TIME, PACING_TIME),
+}
+# Timers covering the pick zone clearing, only swept with safety_timers and never below their configured value
+SAFETY_TIMER_KEYS = {
+    "AccumulatingConveyor": (RESTART_TIME,),
+    "ZoneAccumulatingConveyor": (RESTART_TIME,),
+    "DoublePickInfeedConveyor": (RESTART_TIME,),
+}
+# Pusher delays, only swept with safety_timers for a pusher without sensors
+PUSHER_TIMER_KEYS = (EXTEND_DELAY_SEC, RETRACT_DELAY_SEC)
+
+DEFAULT_FACTORS = (0.5, 0.6, 0.7, 0.8, 0.9, 1.0, 1.25, 1.5)
+DEFAULT_FLOOR = 0.5
+DEFAULT_MAX_CUT = 0.2
+DEFAULT_TRIALS = 200
+DEFAULT_HOURS = 1.0
+DEFAULT_WARMUP = 300.0
+
+
+class SweptTimer:
+    """
+    SweptTimer is one timer of one conveyor the sweep tries different values for.
+    Attributes:
+        conveyor: The key of the conveyor in ListOfAllConveyors.
+        section: PUSHER_CONFIG for the pusher delays, None for a timer of the conveyor configuration.
+        key: The name of the timer in the configuration.
+        current: A float, the configured value.
+        floor: A float, the value the timer is never set below.
+        safety: A boolean, True for a timer covering the pick zone clearing, never set below its configured value.
+    """
+
+    def __init__(self, conveyor, section, key, current: float, floor: float, safety=False):
+        self.conveyor = conveyor
+        self.section = section
+        self.key = key
+        self.current = current
+        self.safety = safety
+        self.floor = max(floor, current) if safety else floor
+
+    def name(self):
+        return f"{self.conveyor}.{self.section}.{self.key}" if self.section else f"{self.conveyor}.{self.key}"
+
+    def value(self, factor: float):
+        return round(self.current * factor, 3)
+
+    def allows(self, factor: float):
+        return self.value(factor) >= self.floor - 1e-9
+
+    def cut(self, factor: float):
+        """ The fraction the value is shortened by from the configured value, 0.0 when it is not shortened."""
+        return round(max(0.0, self.current - self.value(factor)) / self.current, 3)
+
+
+def find_timers(configuration_data: dict, floor_fraction=DEFAULT_FLOOR, safety_timers=False):
+    """
+    The timers of a configuration the sweep can change, the ones set to a positive value.
+
+    Parameters
+    ----------
+    configuration_data : dict
+        The configuration, as in configured_conveyors.json
+    floor_fraction : float, optional
+        Fraction of its configured value a throughput timer is never set below
+    safety_timers : bool, optional
+        True to also sweep restartTime and the delays of the pushers without sensors, never below their
+        configured value
+
+    Returns
+    ----------
+    list
+        A SweptTimer for each timer, in the order of the conveyors
+    """
+    timers = []
+    for conveyor, config in configuration_data.get(LIST_OF_ALL_CONVEYORS, {}).items():
+        for key in TIMER_KEYS.get(config.get(TYPE), ()):
+            current = config.get(key)
+            if current is not None and float(current) > 0.0:
+                timers.append(SweptTimer(conveyor, None, key, float(current), float(current) * floor_fraction))
+        if not safety_timers:
+            continue
+        for key in SAFETY_TIMER_KEYS.get(config.get(TYPE), ()):
+            current = config.get(key)
+            if current is not None and float(current) > 0.0:
+                timers.append(SweptTimer(conveyor, None, key, float(current), float(current), safety=True))
+        pusher_config = config.get(PUSHER_CONFIG, {})
+        if pusher_config.get(PUSHER_PRESENT) and not pusher_config.get(SENSORS_PRESENT):
+            for key in PUSHER_TIMER_KEYS:
+                current = pusher_config.get(key)
+                if current is not None and float(current) > 0.0:
+                    timers.append(SweptTimer(conveyor, PUSHER_CONFIG, key, float(current), float(current),
+                                             safety=True))
+    return timers
+
+
+def apply_settings(configuration_data: dict, timers: list, factors: tuple):
+    """ A copy of the configuration with each timer set to its configured value times its factor."""
+    configuration = copy.deepcopy(configuration_data)
+    conveyors = configuration[LIST_OF_ALL_CONVEYORS]
+    for timer, factor in zip(timers, factors):
+        config = conveyors[timer.conveyor]
+        if timer.section is not None:
+            config = config[timer.section]
+        config[timer.key] = timer.value(factor)
+    return configuration
+
+
+def largest_cut(timers: list, factors: tuple):
+    """ The largest fraction a timer is shortened by from its configured value, 0.0 when none is."""
+    return max([timer.cut(factor) for timer, factor in zip(timers, factors)], default=0.0)
+
+
+def candidate_settings(timers: list, factors: tuple, trials: int, seed=1):
+    """
+    The factors of every trial, the configured settings first. Factors that would put a timer below its floor
+    are left out.
+
+    Returns
+    ----------
+    list
+        A tuple of one factor per timer for each trial, without duplicates
+    """
+    allowed = [[factor for factor in factors if timer.allows(factor)] or [1.0] for timer in timers]
+    candidates = {}
+
+    def add(candidate):
+        candidates.setdefault(tuple(candidate), None)
+
+    add([1.0] * len(timers))
+    for factor in factors:
+        add([factor if factor in choices else 1.0 for choices in allowed])
+    for position, choices in enumerate(allowed):
+        for factor in choices:
+            candidate = [1.0] * len(timers)
+            candidate[position] = factor
+            add(candidate)
+    generator = random.Random(seed)
+    for _ in range(trials):
+        add([generator.choice(choices) for choices in allowed])
+    return list(candidates)
+
+
+# Set in each worker process by initialize_worker, so the configuration is sent once per process
+_worker = {}
+
+
+def initialize_worker(configuration_data, timers, duration, warmup, parameters):
+    _worker.update(configuration_data=configuration_data, timers=timers, duration=duration, warmup=warmup,
+                   parameters=parameters)
+
+
+def run_trial(factors: tuple):
+    """ Simulates one trial in a worker process and returns its factors, throughput, bottleneck and stalls."""
+    configuration = apply_settings(_worker["configuration_data"], _worker["timers"], factors)
+    report = simulate(configuration, _worker["duration"], _worker["warmup"], **_worker["parameters"])
+    line = report["line"]
+    return factors, line["boxesPerHour"], line["bottleneck"], line["stalled"]
+
+
+def pareto_front(results: list):
+    """
+    The trials no other trial beats on both throughput and cut.
+
+    Parameters
+    ----------
+    results : list
+        A dictionary with boxesPerHour and largestCut for each trial
+
+    Returns
+    ----------
+    list
+        The trials of the front, from the smallest cut to the fastest
+    """
+    ordered = sorted(results, key=lambda result: (result["largestCut"], -result["boxesPerHour"]))
+    front = []
+    for result in ordered:
+        if not front or result["boxesPerHour"] > front[-1]["boxesPerHour"] + 1e-9:
+            front.append(result)
+    return front
+
+
+class ParameterSweep:
+    """
+    ParameterSweep runs the trials of a configuration on a process pool and keeps the Pareto front.
+    Attributes:
+        configuration_data: A dictionary, the configuration the settings are applied to.
+        timers: A list of the SweptTimer of the configuration.
+        workers: An int, number of processes, 1 runs the trials in this process.
+    Methods:
+        run: Runs every trial and returns the report.
+        configuration: The configuration with the settings of one trial.
+    """
+
+    def __init__(self, configuration_data: dict, floor_fraction=DEFAULT_FLOOR, workers=None, safety_timers=False):
+        self.configuration_data = configuration_data
+        self.timers = find_timers(configuration_data, floor_fraction, safety_timers)
+        self.workers = workers or os.cpu_count() or 1
+
+    def evaluate(self, candidates: list, duration: float, warmup: float, parameters: dict):
+        arguments = (self.configuration_data, self.timers, duration, warmup, parameters)
+        if self.workers == 1:
+            initialize_worker(*arguments)
+            return [run_trial(candidate) for candidate in candidates]
+        with concurrent.futures.ProcessPoolExecutor(self.workers, initializer=initialize_worker,
+                                                    initargs=arguments) as executor:
+            chunk_size = max(1, len(candidates) // (self.workers * 4))
+            return list(executor.map(run_trial, candidates, chunksize=chunk_size))
+
+    def result(self, factors: tuple, boxes_per_hour: float, bottleneck, stalled):
+        return {
+            "boxesPerHour": boxes_per_hour,
+            "stalled": stalled,
+            "largestCut": largest_cut(self.timers, factors),
+            "bottleneck": bottleneck,
+            "factors": factors,
+            "settings": {timer.name(): timer.value(factor) for timer, factor in zip(self.timers, factors)},
+        }
+
+    def configuration(self, result: dict):
+        return apply_settings(self.configuration_data, self.timers, result["factors"])
+
+    def run(self, duration: float, warmup=DEFAULT_WARMUP, factors=DEFAULT_FACTORS, trials=DEFAULT_TRIALS,
+            max_cut=DEFAULT_MAX_CUT, seed=1, **parameters):
+        """
+        Runs every trial and picks the fastest trial of the Pareto front cutting no timer by more than max_cut.
+        A trial on which the line stalls has no throughput and is left out, when the configured settings stall
+        nothing is selected.
+
+        Parameters
+        ----------
+        duration : float
+            Time in seconds each trial collects statistics over
+        warmup : float, optional
+            Time in seconds simulated before the statistics are collected
+        factors : tuple, optional
+            Multiples of the configured values each timer is tried at
+        trials : int, optional
+            Number of random combinations tried on top of the configured and one-timer-at-a-time settings
+        max_cut : float, optional
+            Largest fraction the selected settings may shorten a timer by from its configured value
+        seed : int, optional
+            Seed of the random combinations and of the simulations
+        parameters :
+            pick_time, pick_jitter, arrival_interval, poisson and box_pitch of the simulation
+
+        Returns
+        ----------
+        dict
+            The configured settings, the Pareto front and the selected settings
+        """
+        started = time.perf_counter()
+        candidates = candidate_settings(self.timers, tuple(factors), trials, seed)
+        results = [self.result(*outcome) for outcome in
+                   self.evaluate(candidates, duration, warmup, dict(parameters, seed=seed))]
+        baseline = results[0]
+        front = pareto_front([result for result in results if result["boxesPerHour"] is not None])
+        eligible = [result for result in front if result["largestCut"] <= max_cut + 1e-9]
+        selected = max(eligible, key=lambda result: result["boxesPerHour"]) if eligible else baseline
+        if baseline["boxesPerHour"] is None:
+            selected = None
+        return {
+            "sweep": {
+                "trials": len(results),
+                "timers": [timer.name() for timer in self.timers],
+                "workers": self.workers,
+                "duration_sec": duration,
+                "wallTime_sec": time.perf_counter() - started,
+                "maxCut": max_cut,
+            },
+            "baseline": baseline,
+            "front": front,
+            "selected": selected,
+        }
+
+
+def format_cut(value):
+    return f'{value * 100:5.0f}%'
+
+
+def format_summary(report: dict):
+    sweep = report["sweep"]
+    baseline = report["baseline"]
+    selected = report["selected"]
+    lines = [
+        f"Swept {len(sweep['timers'])} timer(s) over {sweep['trials']} trials in {sweep['wallTime_sec']:.1f} s "
+        f"on {sweep['workers']} process(es)",
+        f"Configured: {baseline['boxesPerHour']:.0f} boxes/h",
+        f"Selected:   {selected['boxesPerHour']:.0f} boxes/h, largest cut {format_cut(selected['largestCut'])}",
+        "",
+        f"{'Boxes/h':>9}{'Cut':>8}  Bottleneck",
+    ]
+    for result in report["front"]:
+        marker = '  <' if result is selected else ''
+        lines.append(f"{result['boxesPerHour']:>9.0f}{format_cut(result['largestCut']):>8}  "
+                     f"{result['bottleneck'] or '-'}{marker}")
+    changed = {name: value for name, value in selected["settings"].items() if value != baseline["settings"][name]}
+    if changed:
+        lines.append("")
+        lines.append("Selected settings:")
+        for name, value in changed.items():
+            lines.append(f"  {name}: {baseline['settings'][name]} -> {value}")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('configuration', nargs='?', help="configuration file, configured_conveyors.json by default")
+    parser.add_argument('--trials', type=int, default=DEFAULT_TRIALS, help="number of random combinations tried")
+    parser.add_argument('--factors', type=float, nargs='+', default=DEFAULT_FACTORS,
+                        help="multiples of the configured values each timer is tried at")
+    parser.add_argument('--floor', type=float, default=DEFAULT_FLOOR,
+                        help="fraction of its configured value a throughput timer is never set below")
+    parser.add_argument('--max-cut', type=float, default=DEFAULT_MAX_CUT,
+                        help="largest fraction the selected settings shorten a timer by")
+    parser.add_argument('--safety-timers', action='store_true',
+                        help="also sweep restartTime and the delays of open-loop pushers, never below their value")
+    parser.add_argument('--hours', type=float, default=DEFAULT_HOURS, help="simulated time of each trial")
+    parser.add_argument('--warmup', type=float, default=DEFAULT_WARMUP,
+                        help="seconds simulated before the statistics start")
+    parser.add_argument('--pick-time', type=float, default=DEFAULT_PICK_TIME, help="seconds per robot pick")
+    parser.add_argument('--pick-jitter', type=float, default=0.0,
+                        help="pick times vary uniformly by this fraction of --pick-time")
+    parser.add_argument('--arrival-interval', type=float, default=0.0,
+                        help="seconds between boxes at each entry, 0 feeds as fast as there is room")
+    parser.add_argument('--poisson', action='store_true', help="random arrivals with --arrival-interval on average")
+    parser.add_argument('--box-pitch', type=float, default=DEFAULT_BOX_PITCH,
+                        help="seconds of belt between two queued boxes")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workers', type=int, help="number of processes, all the CPU cores by default")
+    parser.add_argument('--output', help="write the configuration with the selected settings to this file")
+    parser.add_argument('--json', help="write the json report to this file, - for stdout")
+    args = parser.parse_args()
+
+    configuration_data = load_configuration(args.configuration)
+    if not configuration_data.get(LIST_OF_ALL_CONVEYORS):
+        print("The configuration has no conveyors")
+        sys.exit(1)
+    sweep = ParameterSweep(configuration_data, args.floor, args.workers, args.safety_timers)
+    if not sweep.timers:
+        print("The configuration has no timers to sweep")
+        sys.exit(1)
+    report = sweep.run(args.hours * 3600.0, args.warmup, args.factors, args.trials, args.max_cut, args.seed,
+                       pick_time=args.pick_time, pick_jitter=args.pick_jitter,
+                       arrival_interval=args.arrival_interval, poisson=args.poisson, box_pitch=args.box_pitch)
+
+    if report["selected"] is None:
+        print("The line stalls with the configured settings, nothing to tune:")
+        for index, reason in report["baseline"]["stalled"].items():
+            print(f"  conveyor {index} stuck in {reason}")
+        sys.exit(1)
+    if args.output:
+        atomic_write_json(args.output, sweep.configuration(report["selected"]))
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        if args.json:
+            with open(args.json, 'w') as json_file:
+                json.dump(report, json_file, indent=2)
+        print(format_summary(report))
+        if args.output:
+            print(f"\nConfiguration written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,351 @@
+"""
+Offline analyzer of the traces written by helpers/trace_recorder.py.
+
+For every conveyor it reports the availability, the throughput, the time spent working, starved, blocked
+and faulted, and the time spent in each ConveyorState. For the line it reports the bottleneck conveyor,
+the ConveyorState that limits it and the distribution of the pick cycle times. The bottleneck is the conveyor
+active the largest share of its time, active being working or waiting on the robot to pick. A conveyor without
+a box sensor cannot tell when it carries a box, its running time is unknown and it is never the bottleneck.
+The traces are streamed one line at a time, memory does not grow with the length of the trace.
+Rotated traces are read in the order they are given, .gz files are decompressed on the fly.
+
+Usage: python3 tools/trace_analyzer.py trace.jsonl.2 trace.jsonl.1 trace.jsonl [--json report.json]
+"""
+import argparse
+import gzip
+import json
+import math
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from helpers.line_status import LineStatus, classify_state
+
+# Conveyor types the robot picks from, their boxes leave the line
+PICK_CONVEYOR_TYPES = ("InfeedConveyor", "AccumulatingConveyor", "ZoneAccumulatingConveyor",
+                       "DoublePickInfeedConveyor", "CustomConveyor")
+
+
+class StreamingHistogram:
+    """
+    StreamingHistogram keeps a distribution in logarithmic buckets, each bucket is ratio wide,
+    so percentiles are within a few percent whatever the number of values.
+    """
+
+    def __init__(self, ratio=1.02, minimum=0.001):
+        self.log_ratio = math.log(ratio)
+        self.minimum = minimum
+        self.buckets = {}
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float):
+        bucket = int(math.log(max(value, self.minimum) / self.minimum) / self.log_ratio)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+        self.count += other.count
+        self.sum += other.sum
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, q: float):
+        if not self.count:
+            return None
+        rank = q / 100.0 * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                # Middle of the bucket, clamped to the values actually seen
+                value = self.minimum * math.exp((bucket + 0.5) * self.log_ratio)
+                return min(self.max, max(self.min, value))
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean_sec": self.sum / self.count,
+            "min_sec": self.min,
+            "p50_sec": self.percentile(50),
+            "p90_sec": self.percentile(90),
+            "p99_sec": self.percentile(99),
+            "max_sec": self.max,
+        }
+
+
+class ConveyorTrace:
+    """
+    ConveyorTrace accumulates the events of one conveyor. The time between two events is added to the
+    state and the LineStatus the conveyor was in, time before the first state of a run is not counted.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.type = None
+        self.parent = None
+        self.state = None
+        self.box = None
+        self.pick = None
+        self.since = None
+        self.last_pick_time = None
+        self.box_sensor = False
+        self.state_seconds = {}
+        self.status_seconds = {status.name: 0.0 for status in LineStatus}
+        self.boxes = 0
+        self.pick_cycles = StreamingHistogram()
+        self.commands = 0
+        self.commands_failed = 0
+        self.command_latency = StreamingHistogram(minimum=0.0001)
+
+    def advance(self, t: float):
+        if self.state is not None and self.since is not None and t > self.since:
+            elapsed = t - self.since
+            self.state_seconds[self.state] = self.state_seconds.get(self.state, 0.0) + elapsed
+            status = classify_state(self.state, self.box).name
+            self.status_seconds[status] += elapsed
+        if self.since is None or t > self.since:
+            self.since = t
+
+    def restart(self):
+        """ The controller restarted, the state and sensors are unknown until the next events."""
+        self.state = None
+        self.box = None
+        self.pick = None
+        self.since = None
+        self.last_pick_time = None
+
+    def on_event(self, t: float, event: str, value, record: dict):
+        self.advance(t)
+        if event == "state":
+            self.state = value
+        elif event == "box":
+            if self.box and not value:
+                self.boxes += 1
+            self.box = value
+            self.box_sensor = True
+        elif event == "pick":
+            if value and not self.pick:
+                if self.last_pick_time is not None and t > self.last_pick_time:
+                    self.pick_cycles.observe(t - self.last_pick_time)
+                self.last_pick_time = t
+            self.pick = value
+        elif event == "cmd":
+            self.commands += 1
+            if not record.get("ok", True):
+                self.commands_failed += 1
+            if record.get("lat") is not None:
+                self.command_latency.observe(record["lat"])
+
+    def observed_seconds(self):
+        return sum(self.status_seconds.values())
+
+    def limiting_state(self):
+        """ The state other than INIT the conveyor spent the most time in."""
+        states = {state: seconds for state, seconds in self.state_seconds.items() if state != 'INIT'}
+        return max(states, key=states.get) if states else None
+
+    def report(self):
+        observed = self.observed_seconds()
+        share = {status.lower(): (seconds / observed if observed else None)
+                 for status, seconds in self.status_seconds.items()}
+        # Waiting for a pick is the robot working at this conveyor, it counts as active for the bottleneck
+        active = ((self.status_seconds[LineStatus.WORKING.name] + self.state_seconds.get('WAITING_FOR_PICK', 0.0))
+                  / observed if observed else None)
+        return {
+            "type": self.type,
+            "parent": self.parent,
+            "observed_sec": observed,
+            "boxSensor": self.box_sensor,
+            "availability": 1.0 - share["faulted"] if observed else None,
+            "boxes": self.boxes,
+            "boxesPerHour": self.boxes / observed * 3600.0 if observed else None,
+            "statusShare": share,
+            "activeShare": active,
+            "stateSeconds": dict(sorted(self.state_seconds.items())),
+            "limitingState": self.limiting_state(),
+            "pickCycles": self.pick_cycles.summary(),
+            "commands": self.commands,
+            "commandsFailed": self.commands_failed,
+            "commandLatency": self.command_latency.summary(),
+        }
+
+
+class TraceAnalyzer:
+    """
+    TraceAnalyzer streams the events of one or more traces and builds the report of the line.
+    """
+
+    def __init__(self):
+        self.conveyors = {}
+        self.first_time = None
+        self.last_time = None
+        self.events = 0
+        self.invalid_lines = 0
+        self.restarts = 0
+
+    def conveyor(self, index):
+        key = str(index)
+        if key not in self.conveyors:
+            self.conveyors[key] = ConveyorTrace(key)
+        return self.conveyors[key]
+
+    def feed_line(self, line: str):
+        line = line.strip()
+        if not line:
+            return
+        try:
+            record = json.loads(line)
+            t = float(record["t"])
+            event = record["e"]
+        except (ValueError, KeyError, TypeError):
+            self.invalid_lines += 1
+            return
+        self.events += 1
+        if self.first_time is None:
+            self.first_time = t
+        if self.last_time is None or t > self.last_time:
+            self.last_time = t
+
+        if event == "config":
+            self.restarts += 1
+            for conveyor in self.conveyors.values():
+                conveyor.restart()
+            for index, description in (record.get("conveyors") or {}).items():
+                conveyor = self.conveyor(index)
+                conveyor.type = description.get("type")
+                conveyor.parent = description.get("parent")
+        elif record.get("c") is not None:
+            self.conveyor(record["c"]).on_event(t, event, record.get("v"), record)
+
+    def feed(self, lines):
+        for line in lines:
+            self.feed_line(line)
+
+    def finish(self):
+        """ Closes the time of every conveyor at the last event of the trace."""
+        if self.last_time is not None:
+            for conveyor in self.conveyors.values():
+                conveyor.advance(self.last_time)
+
+    def report(self):
+        conveyors = {index: conveyor.report() for index, conveyor in sorted(self.conveyors.items(),
+                                                                           key=lambda item: int(item[0]))}
+        observed = {index: report for index, report in conveyors.items() if report["observed_sec"]}
+
+        # The conveyor active the largest share of its time has the least slack, it sets the line rate.
+        # A conveyor without a box sensor cannot tell when it carries a box, it is left out
+        sensed = {index: report for index, report in observed.items() if report["boxSensor"]}
+        bottleneck = None
+        if sensed:
+            bottleneck = max(sensed, key=lambda index: sensed[index]["activeShare"])
+
+        picked = [report for report in observed.values() if report["type"] in PICK_CONVEYOR_TYPES]
+        duration = (self.last_time - self.first_time) if self.first_time is not None else 0.0
+        line_boxes = sum(report["boxes"] for report in picked)
+
+        pick_cycles = StreamingHistogram()
+        for conveyor in self.conveyors.values():
+            pick_cycles.merge(conveyor.pick_cycles)
+
+        return {
+            "trace": {
+                "events": self.events,
+                "invalidLines": self.invalid_lines,
+                "restarts": self.restarts,
+                "duration_sec": duration,
+            },
+            "line": {
+                "boxes": line_boxes,
+                "boxesPerHour": line_boxes / duration * 3600.0 if duration else None,
+                "bottleneck": bottleneck,
+                "bottleneckType": conveyors[bottleneck]["type"] if bottleneck else None,
+                "limitingState": conveyors[bottleneck]["limitingState"] if bottleneck else None,
+                "pickCycles": pick_cycles.summary(),
+            },
+            "conveyors": conveyors,
+        }
+
+
+def open_trace(path: str):
+    if path == '-':
+        return sys.stdin
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt')
+    return open(path)
+
+
+def format_share(value):
+    return '   -  ' if value is None else f'{value * 100:5.1f}%'
+
+
+def format_summary(report: dict):
+    line = report["line"]
+    lines = [
+        f"Trace: {report['trace']['events']} events over {report['trace']['duration_sec'] / 3600.0:.2f} h, "
+        f"{report['trace']['restarts']} restart(s), {report['trace']['invalidLines']} invalid line(s)",
+        f"Line: {line['boxes']} boxes picked"
+        + (f", {line['boxesPerHour']:.0f} boxes/h" if line['boxesPerHour'] is not None else ""),
+    ]
+    if line["bottleneck"]:
+        lines.append(f"Bottleneck: conveyor {line['bottleneck']} ({line['bottleneckType']}), "
+                     f"limited by {line['limitingState']}")
+    cycles = line["pickCycles"]
+    if cycles["count"]:
+        lines.append(f"Pick cycle: mean {cycles['mean_sec']:.2f} s, p50 {cycles['p50_sec']:.2f} s, "
+                     f"p90 {cycles['p90_sec']:.2f} s, p99 {cycles['p99_sec']:.2f} s over {cycles['count']} picks")
+    lines.append("")
+    lines.append(f"{'Conveyor':<10}{'Type':<26}{'Avail':>7}{'Active':>8}{'Work':>7}{'Starved':>8}{'Blocked':>8}"
+                 f"{'Boxes/h':>9}  Limiting state")
+    for index, conveyor in report["conveyors"].items():
+        share = conveyor["statusShare"]
+        rate = f"{conveyor['boxesPerHour']:.0f}" if conveyor["boxesPerHour"] is not None else "-"
+        lines.append(f"{index:<10}{(conveyor['type'] or '?'):<26}{format_share(conveyor['availability']):>7}"
+                     f"{format_share(conveyor['activeShare']):>8}{format_share(share['working']):>7}{format_share(share['starved']):>8}"
+                     f"{format_share(share['blocked']):>8}{rate:>9}  {conveyor['limitingState'] or '-'}")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('traces', nargs='+', help="trace files in time order, - for stdin")
+    parser.add_argument('--json', help="write the json report to this file, - for stdout")
+    parser.add_argument('--quiet', action='store_true', help="do not print the summary")
+    args = parser.parse_args()
+
+    analyzer = TraceAnalyzer()
+    for path in args.traces:
+        trace = open_trace(path)
+        try:
+            analyzer.feed(trace)
+        finally:
+            if trace is not sys.stdin:
+                trace.close()
+    analyzer.finish()
+    report = analyzer.report()
+
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(report, json_file, indent=2)
+    if not args.quiet and args.json != '-':
+        print(format_summary(report))
+
+
+if __name__ == '__main__':
+    main()